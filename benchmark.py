@@ -0,0 +1,549 @@
+#!/usr/bin/env python
+
+"""
+Small benchmarks for the loading and rendering paths
+
+Usage
+-----
+    python benchmark.py obj [--model models/cow.obj] [--scale 100]
+    python benchmark.py stream [--model models/cow.obj] [--scale 300]
+    python benchmark.py indexed [--model models/cow.obj]
+    python benchmark.py vcache [--model models/cow.obj] [--scale 1]
+    python benchmark.py normals [--model models/cow.obj] [--scale 300] [--crease-angle 60]
+    python benchmark.py lod [--model models/cow.obj]
+    python benchmark.py formats [--model models/cow.obj] [--scale 100]
+    python benchmark.py vformat [--model models/cow.obj]
+    python benchmark.py overlay [--model models/cow.obj] [--frames 500]
+    python benchmark.py uvgrid [--size 100]
+    python benchmark.py trace [--models Box UVSphere UVTorus models/cow.obj] [--save counts.json]
+                              [--compare counts.json]
+"""
+
+from __future__ import division, print_function
+import os
+import sys
+import json
+import argparse
+import tempfile
+import timeit
+import resource
+import multiprocessing
+
+import numpy as np
+
+from configs import Global
+from meshHelper import MeshHelper
+
+
+def scaleObj(data, scale):
+    """
+    Builds a bigger obj by repeating the `v`, `vn` and `f` records of `data` `scale` times
+
+    Parameters
+    ----------
+    data : str
+    scale : int
+
+    Returns
+    -------
+    str
+        obj text with `scale` disjoint copies of the model
+    """
+    lines = data.splitlines()
+    vertices = [l for l in lines if l.startswith(b'v ')]
+    normals = [l for l in lines if l.startswith(b'vn ')]
+    faces = [[c.split(b'/') for c in l.split()[1:]] for l in lines if l.startswith(b'f ')]
+
+    out = []
+    for i in range(scale):
+        out.extend(vertices)
+        out.extend(normals)
+    for i in range(scale):
+        v_off, n_off = i * len(vertices), i * len(normals)
+        for face in faces:
+            corners = []
+            for corner in face:
+                corner = list(corner)
+                corner[0] = str(int(corner[0]) + v_off).encode('ascii')
+                if len(corner) == 3 and corner[2]:
+                    corner[2] = str(int(corner[2]) + n_off).encode('ascii')
+                corners.append(b'/'.join(corner))
+            out.append(b'f ' + b' '.join(corners))
+    return b'\n'.join(out) + b'\n'
+
+
+def legacyParseObj(obj):
+    """
+    The original per-line python parser of `objects.Obj`, kept for comparison
+    """
+    vertices_lines = []
+    faces_lines = []
+    normals_lines = []
+
+    for line in obj.split(b'\n'):
+        line = line.strip()
+        if not line:
+            continue
+
+        if line[:2] == b'v ':
+            vertices_lines.append(line)
+        elif line[:2] == b'f ':
+            faces_lines.append(line)
+        elif line[:3] == b'vn ':
+            normals_lines.append(line)
+
+    vertices_all = []
+    for line in vertices_lines:
+        vertices_all.append( [float(x) for x in line.split()[1:]] + [1.0] )
+
+    normals_all = []
+    for line in normals_lines:
+        normals_all.append( [float(x) for x in line.split()[1:]] )
+
+    faces_v_num = []
+    faces_ordered = []
+    normals_ordered = []
+    for line in faces_lines:
+        v_num = 0
+        for v in [int(x.split(b'//')[0])-1 for x in line.split()[1:]]:
+            faces_ordered.append(vertices_all[v])
+            faces_ordered.append(vertices_all[v][:-1] + [0.0])
+            v_num += 2
+        if len(normals_all):
+            for v in [int(x.split(b'//')[1])-1 for x in line.split()[1:]]:
+                normals_ordered.append(normals_all[v])
+                normals_ordered.append(normals_all[v])
+        faces_v_num.append(v_num)
+
+    acc = faces_v_num[::]
+    acc.insert(0,0)
+    return faces_ordered, normals_ordered, faces_v_num, np.cumsum(acc)
+
+
+def vectorizedParseObj(obj):
+    return MeshHelper.expandFaces(MeshHelper.parseObj(obj))
+
+
+def bestOf(func, repeat):
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def benchObj(args):
+    data = scaleObj(open(args.model, 'rb').read(), args.scale)
+    print("%s x%d: %.1f MB" % (args.model, args.scale, len(data) / 2**20))
+
+    new = vectorizedParseObj(data)
+    old = legacyParseObj(data)
+    assert np.allclose(np.array(old[0], dtype=np.float32), new[0])
+    assert np.allclose(np.array(old[1], dtype=np.float32), new[1])
+    assert np.array_equal(old[2], new[2]) and np.array_equal(old[3], new[3])
+
+    t_old = bestOf(lambda: legacyParseObj(data), args.repeat)
+    t_new = bestOf(lambda: vectorizedParseObj(data), args.repeat)
+    print("python loops: %8.3f s" % t_old)
+    print("numpy:        %8.3f s" % t_new)
+    print("speed-up:     %8.1fx" % (t_old / t_new))
+
+
+def peakMemory(func, path, queue):
+    """
+    Runs `func(path)` and reports the peak RSS of the process in MB (run in a child process)
+    """
+    result = func(path)
+    final = sum(a.nbytes for a in result)
+    scale = 1 if sys.platform == 'darwin' else 1024 # ru_maxrss is in KB on linux
+    queue.put((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2**20, final / 2**20))
+
+
+def writeScaledObj(model, scale, path):
+    with open(path, 'wb') as f:
+        f.write(scaleObj(open(model, 'rb').read(), scale))
+
+
+def loadWhole(path):
+    return vectorizedParseObj(open(path, 'rb').read())
+
+
+def loadStreamed(path):
+    return MeshHelper.expandFaces(MeshHelper.loadObj(path))
+
+
+def benchStream(args):
+    fd, path = tempfile.mkstemp(suffix='.obj')
+    os.close(fd)
+    try:
+        # write the big model from a child too, so its memory is not inherited below
+        process = multiprocessing.Process(target=writeScaledObj, args=(args.model, args.scale, path))
+        process.start()
+        process.join()
+        print("%s x%d: %.1f MB" % (args.model, args.scale, os.path.getsize(path) / 2**20))
+
+        for name, func in [('read + parse', loadWhole), ('streamed', loadStreamed)]:
+            queue = multiprocessing.Queue()
+            process = multiprocessing.Process(target=peakMemory, args=(func, path, queue))
+            process.start()
+            peak, final = queue.get()
+            process.join()
+            print("%-14s peak RSS %8.1f MB, final arrays %8.1f MB" % (name, peak, final))
+    finally:
+        os.remove(path)
+
+
+def benchIndexed(args):
+    mesh = MeshHelper.loadObj(args.model)
+    vertices, normals, faces_v_num, faces_v_start = MeshHelper.expandFaces(mesh)
+    indexed = MeshHelper.indexFaces(mesh)
+
+    old_bytes = vertices.nbytes + normals.nbytes
+    new_bytes = indexed['vertices'].nbytes + indexed['normals'].nbytes + indexed['indices'].nbytes
+    welded = len(indexed['vertices'])
+    print("%s: %d faces, %d triangles" % (args.model, len(faces_v_num), len(indexed['indices']) // 3))
+    print("per-corner fans: %8d vertices, %8.1f KB" % (len(vertices), old_bytes / 2**10))
+    print("indexed:         %8d vertices, %8.1f KB (incl. indices)" % (len(indexed['vertices']), new_bytes / 2**10))
+    print("fill pass vertex shader runs: %d -> at most %d (%d welded vertices)" % (
+        len(vertices), len(indexed['indices']), welded))
+    print("wireframe lines: %d -> %d, in one draw call instead of one per face" % (
+        faces_v_num.sum(), len(indexed['wireframe_indices']) // 2))
+
+
+def benchVertexCache(args):
+    data = scaleObj(open(args.model, 'rb').read(), args.scale)
+    indexed = MeshHelper.indexFaces(MeshHelper.parseObj(data))
+    print("%s x%d: %d triangles" % (args.model, args.scale, len(indexed['indices']) // 3))
+    for size in args.cache_sizes:
+        start = timeit.default_timer()
+        optimized = MeshHelper.optimizeVertexCache(indexed, size)
+        elapsed = timeit.default_timer() - start
+        print("cache %2d: ACMR %.3f -> %.3f (%.2f s)" % ((size,) + tuple(optimized['acmr']) + (elapsed,)))
+
+
+def benchNormals(args):
+    mesh = MeshHelper.parseObj(scaleObj(open(args.model, 'rb').read(), args.scale))
+    reference = mesh['normals'][mesh['face_normals']] if mesh['face_normals'] is not None else None
+    print("%s x%d: %d faces, %d corners" % (args.model, args.scale, len(mesh['faces_v_num']),
+                                            len(mesh['face_vertices'])))
+
+    for weighting in ['area', 'angle']:
+        for crease_angle in [None, args.crease_angle]:
+            start = timeit.default_timer()
+            MeshHelper.generateNormals(mesh, crease_angle, weighting)
+            elapsed = timeit.default_timer() - start
+
+            line = "%-5s crease %-5s %6.3f s" % (weighting, crease_angle, elapsed)
+            if reference is not None:
+                dots = (mesh['normals'][mesh['face_normals']] * reference).sum(axis=1)
+                line += ", median cos to file normals %.4f" % np.median(dots)
+            print(line)
+
+
+def benchLod(args):
+    mesh = MeshHelper.loadObj(args.model)
+    if mesh['face_normals'] is None:
+        MeshHelper.generateNormals(mesh)
+    full = MeshHelper.optimizeVertexCache(MeshHelper.indexFaces(mesh))
+    faces = len(full['indices']) // 3
+    radius = MeshHelper.boundingSphere(full)[3]
+    print("%s: %d faces" % (args.model, faces))
+
+    for fraction in Global.LOD_LEVELS[1:]:
+        start = timeit.default_timer()
+        lod = MeshHelper.decimate(full, int(faces * fraction))
+        elapsed = timeit.default_timer() - start
+
+        # distance from the simplified vertices to the closest original vertex, relative to the size
+        original = full['vertices']
+        simplified = lod['vertices']
+        nearest = np.sqrt(((simplified[:, None] - original[None])**2).sum(axis=2).min(axis=1)) \
+            if len(original) * len(simplified) < 2**26 else np.zeros(1)
+        print("%5.1f%%: %7d faces in %.3f s, mean vertex offset %.2f%% of radius" % (
+            100 * fraction, len(lod['indices']) // 3, elapsed, 100 * nearest.mean() / radius))
+
+
+def writePly(mesh, path, grouped = True):
+    """
+    Writes a parsed mesh as binary little endian ply, with per vertex normals when the mesh has them
+
+    Faces are grouped by size unless `grouped` is False, which keeps the obj face order (i.e.
+    triangles and quads interleaved, as scanners and exporters write them)
+    """
+    fields = [('x', '<f4'), ('y', '<f4'), ('z', '<f4')]
+    vertices = mesh['vertices']
+    face_vertices = mesh['face_vertices']
+    if mesh['face_normals'] is not None:
+        # ply normals are per vertex: one vertex per (position, normal) pair
+        fields += [('nx', '<f4'), ('ny', '<f4'), ('nz', '<f4')]
+        key = face_vertices.astype(np.int64) * len(mesh['normals']) + mesh['face_normals']
+        _, first, face_vertices = np.unique(key, return_index=True, return_inverse=True)
+        vertices = np.column_stack((vertices[mesh['face_vertices'][first]],
+                                    mesh['normals'][mesh['face_normals'][first]]))
+
+    records = np.zeros(len(vertices), dtype=fields)
+    for i, (name, _) in enumerate(fields):
+        records[name] = vertices[:, i]
+
+    header = ['ply', 'format binary_little_endian 1.0', 'element vertex %d' % len(vertices)]
+    header += ['property float %s' % name for name, _ in fields]
+    header += ['element face %d' % len(mesh['faces_v_num']), 'property list uchar int vertex_indices',
+               'end_header']
+    with open(path, 'wb') as f:
+        f.write(('\n'.join(header) + '\n').encode('ascii'))
+        f.write(records.tobytes())
+        if not grouped:
+            # one count byte then the indices, face after face
+            sizes = 1 + 4 * mesh['faces_v_num'].astype(np.int64)
+            is_count = np.zeros(sizes.sum(), dtype=bool)
+            is_count[np.cumsum(sizes) - sizes] = True
+            face_records = np.zeros(len(is_count), dtype=np.uint8)
+            face_records[is_count] = mesh['faces_v_num']
+            face_records[~is_count] = face_vertices.astype('<i4').view(np.uint8)
+            f.write(face_records.tobytes())
+            return
+        starts = np.cumsum(mesh['faces_v_num']) - mesh['faces_v_num']
+        for corners in np.unique(mesh['faces_v_num']):
+            # group faces by size, the order of faces does not matter here
+            faces = np.flatnonzero(mesh['faces_v_num'] == corners)
+            face_records = np.zeros(len(faces), dtype=[('n', 'u1'), ('v', '<i4', corners)])
+            face_records['n'] = corners
+            face_records['v'] = face_vertices.reshape(-1)[starts[faces, None] + np.arange(corners)]
+            f.write(face_records.tobytes())
+
+
+def writeStl(mesh, path):
+    """
+    Writes a parsed mesh as binary stl (faces fan triangulated)
+    """
+    tri_face, tri_corners = MeshHelper._fanTriangles(mesh['faces_v_num'])
+    records = np.zeros(len(tri_corners), dtype=[('normal', '<f4', 3), ('corners', '<f4', (3, 3)),
+                                                ('attributes', '<u2')])
+    records['corners'] = mesh['vertices'][mesh['face_vertices'][tri_corners]]
+    with open(path, 'wb') as f:
+        f.write(b'\0' * 80)
+        f.write(np.array([len(records)], dtype='<u4').tobytes())
+        f.write(records.tobytes())
+
+
+def benchFormats(args):
+    mesh = MeshHelper.parseObj(scaleObj(open(args.model, 'rb').read(), args.scale))
+    directory = tempfile.mkdtemp()
+    try:
+        names = ['obj', 'ply', 'ply (mixed)', 'stl']
+        paths = [os.path.join(directory, name) for name in ('model.obj', 'model.ply', 'mixed.ply', 'model.stl')]
+        with open(paths[0], 'wb') as f:
+            f.write(scaleObj(open(args.model, 'rb').read(), args.scale))
+        writePly(mesh, paths[1])
+        writePly(mesh, paths[2], grouped=False)
+        writeStl(mesh, paths[3])
+
+        changes = np.count_nonzero(np.diff(mesh['faces_v_num']))
+        print("%s x%d: %d faces, face size changes %d times in file order" % (
+            args.model, args.scale, len(mesh['faces_v_num']), changes))
+        for name, path in zip(names, paths):
+            loaded = MeshHelper.loadMesh(path)
+            t = bestOf(lambda: MeshHelper.loadMesh(path), args.repeat)
+            print("%-11s %8.1f MB %8.3f s, %d vertices" % (name, os.path.getsize(path) / 2**20,
+                                                           t, len(loaded['vertices'])))
+    finally:
+        for path in os.listdir(directory):
+            os.remove(os.path.join(directory, path))
+        os.rmdir(directory)
+
+
+def decodeNormals(normal, normal_format):
+    if normal_format == 'float32':
+        return normal
+    if normal_format == 'snorm16':
+        return normal[:, :3] / 32767
+    packed = np.column_stack([(normal >> shift) & 0x3FF for shift in (0, 10, 20)]).astype(np.int32)
+    return np.where(packed > 511, packed - 1024, packed) / 511
+
+
+def benchVertexFormat(args):
+    mesh = MeshHelper.loadMesh(args.model)
+    if mesh['face_normals'] is None:
+        MeshHelper.generateNormals(mesh)
+    indexed = MeshHelper.indexFaces(mesh)
+    vertices, normals = indexed['vertices'], indexed['normals']
+    count = len(vertices)
+
+    # separate float32 position, normal, color and wireframe color buffers, each vertex twice for the normal lines
+    old = 2 * count * (16 + 12 + 16 + 16)
+    print("%s: %d vertices, separate float32 buffers %.1f KB" % (args.model, count, old / 2**10))
+    for position_format in ['float32', 'float16']:
+        for normal_format in ['float32', 'snorm16', 'int_2_10_10_10_rev']:
+            interleaved = MeshHelper.interleave(vertices, normals, position_format, normal_format)
+            new = interleaved.nbytes # colors are constant attributes
+            position_error = np.abs(interleaved['position'][:, :3].astype(np.float64) - vertices).max()
+            decoded = decodeNormals(interleaved['normal'], normal_format)
+            normals64 = normals.astype(np.float64)
+            sines = np.sqrt((np.cross(decoded, normals64)**2).sum(axis=1))
+            angle = np.degrees(np.arctan2(sines, (decoded * normals64).sum(axis=1))).max()
+            print("%-7s / %-18s %2d B/vertex, %.1f KB (%.1fx smaller), max position error %.2g, "
+                  "max normal error %.3f deg" % (position_format, normal_format, interleaved.dtype.itemsize,
+                                                 new / 2**10, old / new, position_error, angle))
+
+
+def legacyUVGrid(U, V):
+    """
+    The nested loops `UVObject.initUV` used to build the grid corners with
+    """
+    point = []
+    for u in range(U):
+        for v in range(V):
+            point.extend([
+                (u/U, v/V, 0, 1.0),
+                (u/U, (v+1)/V, 0, 1.0),
+                ((u+1)/U, (v+1)/V, 0, 1.0),
+                ((u+1)/U, v/V, 0, 1.0),
+            ])
+    position = np.zeros(len(point), [('position', np.float32, 4)])
+    position['position'] = point
+    return position
+
+
+def benchUVGrid(args):
+    size = args.size
+    assert np.array_equal(legacyUVGrid(size, size)['position'], MeshHelper.uvGrid(size, size)['corners'])
+
+    t_old = bestOf(lambda: legacyUVGrid(size, size), args.repeat)
+    t_new = bestOf(lambda: MeshHelper.uvGrid(size, size), args.repeat)
+    print("%dx%d grid, %d faces" % (size, size, size * size))
+    print("python loops:         %7.2f ms" % (1000 * t_old))
+    print("numpy (incl. edges):  %7.2f ms" % (1000 * t_new))
+
+
+def benchOverlay(args):
+    # needs a display and the GL/Qt packages, unlike the other benchmarks
+    import OpenGL.GL as gl
+    from main import GLUTDisplay
+
+    display = GLUTDisplay()
+    display.standalone = False # no swap, so vsync does not cap the frame rate
+    display.setModel(args.model)
+    obj = display.render_obj
+    obj.wireframe_on = obj.color_on = True
+    print("%s: %d faces, %d frames of %dx%d" % (args.model, obj.levels[0]['faces'], args.frames,
+                                                Global.WIDTH, Global.HEIGHT))
+
+    def frames():
+        for i in range(args.frames):
+            display.display()
+        gl.glFinish()
+
+    for name, overlay in [('two passes (fill + GL_LINES)', False), ('single pass overlay', True)]:
+        obj.wireframe_overlay = overlay
+        frames() # warm up, builds the overlay buffer on first use
+        elapsed = bestOf(frames, 3)
+        print("%-30s %7.3f ms/frame" % (name, 1000 * elapsed / args.frames))
+
+
+def benchTrace(args):
+    # needs a display and the GL/Qt packages, unlike the other benchmarks
+    from glTracer import GLTracer
+    from main import GLUTDisplay
+
+    display = GLUTDisplay()
+    display.standalone = False
+    counts = {}
+    for model in args.models:
+        display.setModel(model)
+        obj = display.render_obj
+        obj.wireframe_on = obj.color_on = obj.normals_on = True
+        display.display() # builds the buffers drawn on first use
+
+        GLTracer.reset()
+        GLTracer.install(GLUTDisplay)
+        try:
+            for i in range(args.frames):
+                display.display()
+        finally:
+            GLTracer.uninstall()
+        counts[model] = dict((key, stats['mean']) for key, stats in GLTracer.report()['per_frame'].items())
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    keys = list(GLTracer.categories) + ['bytes_uploaded']
+    print("per frame, color + wireframe + normals on" + (" (vs %s)" % args.compare if baseline else ""))
+    print("%-20s" % "" + "".join("%18s" % key for key in keys))
+    for model in args.models:
+        row = "%-20s" % model
+        for key in keys:
+            value = counts[model].get(key, 0)
+            cell = "%g" % value
+            old = (baseline or {}).get(model, {}).get(key)
+            if old is not None and old != value:
+                cell += " (%+g)" % (value - old)
+            row += "%18s" % cell
+        print(row)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(counts, f, indent=1, sort_keys=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    commands = parser.add_subparsers(dest='command')
+
+    obj = commands.add_parser('obj', help='python vs numpy obj parsing')
+    obj.add_argument('--model', default='models/cow.obj')
+    obj.add_argument('--scale', type=int, default=100)
+    obj.add_argument('--repeat', type=int, default=3)
+    obj.set_defaults(func=benchObj)
+
+    stream = commands.add_parser('stream', help='peak memory of whole-file vs streamed loading')
+    stream.add_argument('--model', default='models/cow.obj')
+    stream.add_argument('--scale', type=int, default=300)
+    stream.set_defaults(func=benchStream)
+
+    indexed = commands.add_parser('indexed', help='buffer sizes of the per-corner vs indexed layout')
+    indexed.add_argument('--model', default='models/cow.obj')
+    indexed.set_defaults(func=benchIndexed)
+
+    vcache = commands.add_parser('vcache', help='ACMR before/after vertex cache reordering')
+    vcache.add_argument('--model', default='models/cow.obj')
+    vcache.add_argument('--scale', type=int, default=1)
+    vcache.add_argument('--cache-sizes', type=int, nargs='+', default=[8, 16, 32])
+    vcache.set_defaults(func=benchVertexCache)
+
+    normals = commands.add_parser('normals', help='time of generating vertex normals')
+    normals.add_argument('--model', default='models/cow.obj')
+    normals.add_argument('--scale', type=int, default=300)
+    normals.add_argument('--crease-angle', type=float, default=60)
+    normals.set_defaults(func=benchNormals)
+
+    lod = commands.add_parser('lod', help='level of detail chain build time and size')
+    lod.add_argument('--model', default='models/cow.obj')
+    lod.set_defaults(func=benchLod)
+
+    formats = commands.add_parser('formats', help='load time of the same mesh as obj, ply and stl')
+    formats.add_argument('--model', default='models/cow.obj')
+    formats.add_argument('--scale', type=int, default=100)
+    formats.add_argument('--repeat', type=int, default=3)
+    formats.set_defaults(func=benchFormats)
+
+    vformat = commands.add_parser('vformat', help='vertex memory and precision of the interleaved formats')
+    vformat.add_argument('--model', default='models/cow.obj')
+    vformat.set_defaults(func=benchVertexFormat)
+
+    uvgrid = commands.add_parser('uvgrid', help='python vs numpy UV grid generation')
+    uvgrid.add_argument('--size', type=int, default=Global.MAX_U)
+    uvgrid.add_argument('--repeat', type=int, default=5)
+    uvgrid.set_defaults(func=benchUVGrid)
+
+    trace = commands.add_parser('trace', help='GL calls per frame of each model, to compare commits')
+    trace.add_argument('--models', nargs='+', default=['Box', 'UVSphere', 'UVTorus', 'models/cow.obj'])
+    trace.add_argument('--frames', type=int, default=10)
+    trace.add_argument('--save', help='write the counts to this json file')
+    trace.add_argument('--compare', help='show the differences with counts saved by --save')
+    trace.set_defaults(func=benchTrace)
+
+    overlay = commands.add_parser('overlay', help='frame time of the two pass vs single pass wireframe')
+    overlay.add_argument('--model', default='models/cow.obj')
+    overlay.add_argument('--frames', type=int, default=500)
+    overlay.set_defaults(func=benchOverlay)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -10,12 +10,24 @@ import numpy as np
 from OpenGL.arrays import vbo
 from configs import Global
 from shaderHelper import ShaderHelper
+from renderScheduler import RenderScheduler
 
 class BufferHelper(object):
     """Keeps track of and provides useful functions for buffers and bufferIds on GPU"""
 
     buffers = {}
 
+    vertex_arrays = {
+        # name => {'id': VAO or None when replayed, 'attributes': [(buffer name, shader var name)...],
+        #          'elements': element buffer name or None}
+    }
+
+    # None until checked, needs a GL context
+    vertex_arrays_supported = None
+
+    # attribute locations left enabled by replayed vertex arrays
+    replayed_attributes = set()
+
     @classmethod
     def bindBuffer(cls, name):
         """
@@ -26,10 +38,10 @@ class BufferHelper(object):
         name : str
         """
         buffer = cls.buffers[name]['bufferId']
-        gl.glBindBuffer(gl.GL_ARRAY_BUFFER, buffer)
+        gl.glBindBuffer(cls.buffers[name]['target'], buffer)
     
     @classmethod
-    def sendToGPU(cls, name, data, form):
+    def sendToGPU(cls, name, data, form, target = gl.GL_ARRAY_BUFFER):
         """
         Sends data to GPU.
 
@@ -40,26 +52,113 @@ class BufferHelper(object):
         form : gl.GLenum
             GL_STREAM_DRAW, GL_STREAM_READ, GL_STREAM_COPY, GL_STATIC_DRAW, GL_STATIC_READ,
             GL_STATIC_COPY, GL_DYNAMIC_DRAW, GL_DYNAMIC_READ, or GL_DYNAMIC_COPY
+        target : gl.GLenum
+            GL_ARRAY_BUFFER for vertex attributes, GL_ELEMENT_ARRAY_BUFFER for indices
         
         Notes
         -----
-        `name` is used to save buffer in `self.buffers`
+        `name` is used to save buffer in `self.buffers`. Sending again under the same name reuses
+        the GL buffer: same size and usage updates it in place (orphaning the old storage first
+        for stream/dynamic buffers so the driver does not wait on draws still using it), anything
+        else re-specifies its storage.
         """
-        # ask for an empty buffer slot from GPU
-        buffer = gl.glGenBuffers(1)
+        previous = cls.buffers.get(name)
+        if previous is not None and previous['target'] != target:
+            cls.deleteBuffer(name)
+            previous = None
+
+        if previous is None:
+            # ask for an empty buffer slot from GPU
+            buffer = gl.glGenBuffers(1)
+        else:
+            buffer = previous['bufferId']
+
+        # the element buffer binding is part of the bound vertex array, leave those alone
+        if target == gl.GL_ELEMENT_ARRAY_BUFFER and cls.vertexArraysSupported():
+            gl.glBindVertexArray(0)
 
         # make this buffer default for usage
-        gl.glBindBuffer(gl.GL_ARRAY_BUFFER, buffer)
+        gl.glBindBuffer(target, buffer)
 
         # upload data to this buffer
-        gl.glBufferData(gl.GL_ARRAY_BUFFER, data.nbytes, data, form)
+        if previous is not None and previous['nbytes'] == data.nbytes and previous['usage'] == form:
+            if form not in (gl.GL_STATIC_DRAW, gl.GL_STATIC_READ, gl.GL_STATIC_COPY):
+                gl.glBufferData(target, data.nbytes, None, form)
+            gl.glBufferSubData(target, 0, data.nbytes, data)
+        else:
+            gl.glBufferData(target, data.nbytes, data, form)
 
         # save buffer information
-        cls.buffers[name] = {'bufferId': buffer, 'data': data}
+        cls.buffers[name] = {'bufferId': buffer, 'data': data, 'target': target, 'usage': form,
+                             'nbytes': data.nbytes}
+        RenderScheduler.requestRedraw()
 
         # return buffer id
         return buffer
 
+    @classmethod
+    def deleteBuffer(cls, name):
+        """
+        Frees the GPU buffer saved as `name` (no-op if there is none)
+
+        Parameters
+        ----------
+        name : str
+        """
+        buffer = cls.buffers.pop(name, None)
+        if buffer is not None:
+            gl.glDeleteBuffers(1, [buffer['bufferId']])
+
+    @classmethod
+    def deleteBuffers(cls, names):
+        for name in names:
+            cls.deleteBuffer(name)
+
+    @classmethod
+    def liveBytes(cls):
+        """
+        Returns
+        -------
+        dict
+            buffer name => bytes currently allocated on the GPU
+        """
+        return dict((name, buffer['nbytes']) for name, buffer in cls.buffers.items())
+
+    # numpy type code => GL attribute component type
+    attribute_types = {
+        'f4': gl.GL_FLOAT,
+        'f2': gl.GL_HALF_FLOAT,
+        'i1': gl.GL_BYTE,
+        'u1': gl.GL_UNSIGNED_BYTE,
+        'i2': gl.GL_SHORT,
+        'u2': gl.GL_UNSIGNED_SHORT,
+        'i4': gl.GL_INT,
+        'u4': gl.GL_UNSIGNED_INT,
+    }
+
+    @classmethod
+    def attributeFormat(cls, dtype, field):
+        """
+        Describes field `field` of the record dtype `dtype` for `glVertexAttribPointer`
+
+        Returns
+        -------
+        (int, gl.GLenum, bool, int)
+            components, component type, normalized, byte offset in the record
+
+        Notes
+        -----
+        Integer fields are normalized (i.e. uint8 colors, snorm16 normals). A uint32 field with
+        `{'gl_packed': 'int_2_10_10_10_rev'}` metadata is a packed signed 10/10/10/2 vector.
+        """
+        field_dtype, offset = dtype.fields[field][:2]
+        base = field_dtype.base
+        if base.metadata and base.metadata.get('gl_packed') == 'int_2_10_10_10_rev':
+            return 4, gl.GL_INT_2_10_10_10_REV, True, offset
+        components = int(np.prod(field_dtype.shape)) if field_dtype.shape else 1
+        code = '%s%d' % (base.kind, base.itemsize)
+        return components, cls.attribute_types[code], base.kind in 'iu', offset
+
     @classmethod
     def sendToShaders(cls, name, shader_vname = None):
         """
@@ -73,7 +172,9 @@ class BufferHelper(object):
 
         Notes
         -----
-        If `shader_vname` is not entered, will use `name` as shader parameter var name
+        If `shader_vname` is not entered, will use `name` as shader parameter var name.
+        The buffer data is a record array: the field named `shader_vname` is used if there is
+        one (interleaved buffers), otherwise its only field (see `attributeFormat`).
         """
         if not shader_vname:
             shader_vname = name
@@ -83,15 +184,128 @@ class BufferHelper(object):
         buffer = cls.buffers[name]['bufferId']
 
         # setup data
-        stride = data.strides[0]
-        offset = ctypes.c_void_p(0)  
+        field = shader_vname if shader_vname in data.dtype.names else data.dtype.names[0]
+        components, component_type, normalized, offset = cls.attributeFormat(data.dtype, field)
+        stride = data.dtype.itemsize
 
-        # query for shader variable information
-        loc = gl.glGetAttribLocation(ShaderHelper.getProgram(), shader_vname)
+        # shader variable location, introspected when the program was linked
+        loc = ShaderHelper.getAttribLocation(shader_vname)
+        if loc < 0:
+            # not used by the current program (optimized out by the compiler)
+            return
         gl.glEnableVertexAttribArray(loc)
 
         gl.glBindBuffer(gl.GL_ARRAY_BUFFER, buffer)
-        gl.glVertexAttribPointer(loc, data[0][0].size, gl.GL_FLOAT, False, stride, offset)
+        gl.glVertexAttribPointer(loc, components, component_type, normalized, stride, ctypes.c_void_p(offset))
+
+    @classmethod
+    def vertexArraysSupported(cls):
+        """
+        Whether vertex array objects are available (GL 3.0 or GL_ARB_vertex_array_object)
+        """
+        if cls.vertex_arrays_supported is None:
+            try:
+                cls.vertex_arrays_supported = bool(gl.glGenVertexArrays) and bool(gl.glBindVertexArray)
+            except Exception:
+                cls.vertex_arrays_supported = False
+        return cls.vertex_arrays_supported
+
+    @classmethod
+    def buildVertexArray(cls, name, attributes, elements = None):
+        """
+        Records an attribute layout once, to be bound with `bindVertexArray` when drawing
+
+        Parameters
+        ----------
+        name : str
+        attributes : list
+            (buffer name, shader var name) pairs, as given to `sendToShaders`
+        elements : str
+            name of the element buffer drawn from, if any
+
+        Notes
+        -----
+        Locations are taken from the current program, so build with the program the layout is
+        drawn with. Without VAO support the layout is replayed on every bind instead.
+        """
+        cls.deleteVertexArray(name)
+
+        vao = None
+        if cls.vertexArraysSupported():
+            vao = gl.glGenVertexArrays(1)
+            gl.glBindVertexArray(vao)
+            for buffer_name, shader_vname in attributes:
+                cls.sendToShaders(buffer_name, shader_vname)
+            if elements is not None:
+                cls.bindBuffer(elements)
+            gl.glBindVertexArray(0)
+
+        cls.vertex_arrays[name] = {'id': vao, 'attributes': list(attributes), 'elements': elements}
+
+    @classmethod
+    def bindVertexArray(cls, name):
+        """
+        Binds the layout recorded by `buildVertexArray` as `name`
+        """
+        vertex_array = cls.vertex_arrays[name]
+        if vertex_array['id'] is not None:
+            gl.glBindVertexArray(vertex_array['id'])
+            return
+
+        # attributes of the previous layout fall back to their constant value
+        locations = set(ShaderHelper.getAttribLocation(shader_vname) for _, shader_vname in vertex_array['attributes'])
+        for loc in cls.replayed_attributes - locations:
+            gl.glDisableVertexAttribArray(loc)
+        cls.replayed_attributes = set(loc for loc in locations if loc >= 0)
+
+        for buffer_name, shader_vname in vertex_array['attributes']:
+            cls.sendToShaders(buffer_name, shader_vname)
+        if vertex_array['elements'] is not None:
+            cls.bindBuffer(vertex_array['elements'])
+
+    @classmethod
+    def unbindVertexArray(cls):
+        """
+        Leaves no vertex layout bound (i.e. before drawing with the fixed function pipeline)
+        """
+        if cls.vertexArraysSupported():
+            gl.glBindVertexArray(0)
+        for loc in cls.replayed_attributes:
+            gl.glDisableVertexAttribArray(loc)
+        cls.replayed_attributes = set()
+
+    @classmethod
+    def deleteVertexArray(cls, name):
+        """
+        Frees the vertex array `name` (no-op if there is none); its buffers are left alone
+        """
+        vertex_array = cls.vertex_arrays.pop(name, None)
+        if vertex_array is not None and vertex_array['id'] is not None:
+            gl.glDeleteVertexArrays(1, [vertex_array['id']])
+
+    @classmethod
+    def deleteVertexArrays(cls, names):
+        for name in names:
+            cls.deleteVertexArray(name)
+
+    @classmethod
+    def sendConstantToShaders(cls, shader_vname, values):
+        """
+        Gives attribute `shader_vname` the same value for every vertex, without a buffer
+
+        Parameters
+        ----------
+        shader_vname : str
+        values : tuple
+            4 floats
+
+        Notes
+        -----
+        Only used by draws whose vertex array does not source the attribute from a buffer.
+        """
+        loc = ShaderHelper.getAttribLocation(shader_vname)
+        if loc >= 0:
+            gl.glVertexAttrib4f(loc, *values)
 
     @classmethod
     def sendUniformToShaders(cls, name, data, function_type):
@@ -106,24 +320,10 @@ class BufferHelper(object):
         data : int or list or numpy.array
             need to make sure coincides with function_type
         function_type : str
-            see switch for available uniform types
-        """
-        switch = {
-            '1f': gl.glUniform1f,
-            '2f': gl.glUniform2f,
-            '3f': gl.glUniform3f,
-            '4f': gl.glUniform4f,
-            '1i': gl.glUniform1i,
-            '2i': gl.glUniform2i,
-            '3i': gl.glUniform3i,
-            '4i': gl.glUniform4i,
-            'm3': gl.glUniformMatrix3fv,
-            'm4': gl.glUniformMatrix4fv,
-        }
-        
-        loc = gl.glGetUniformLocation(ShaderHelper.getProgram(), name)
-        if function_type[0] == 'm':
-            switch[function_type](loc, 1, gl.GL_FALSE, data)
-        else:
-            switch[function_type](loc, *data)
-        
+            see `ShaderHelper.uniform_functions` for available uniform types
+
+        Notes
+        -----
+        Values already held by the program are not sent again, see `ShaderHelper.sendUniform`
+        """
+        ShaderHelper.sendUniform(name, data, function_type)
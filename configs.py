@@ -17,19 +17,82 @@ class Global(object):
 
     MODELS_LOC = './models/'
 
+    # bytes of obj text parsed at once while loading
+    OBJ_CHUNK_SIZE = 16 * 2**20
+
+    # ply faces of one size are viewed in place in runs of at least PLY_MIN_RUN faces, shorter
+    # runs are decoded PLY_FACE_WINDOW bytes at a time
+    PLY_MIN_RUN = 64
+    PLY_FACE_WINDOW = 2**20
+
+    # parsed meshes are kept here and memory-mapped on later loads
+    MESH_CACHE_ENABLED = True
+    MESH_CACHE_LOC = './.meshcache/'
+    MESH_CACHE_MAX_BYTES = 2 * 2**30
+
+    # parse every model of MODELS_LOC in a process pool at startup (goes through the mesh cache)
+    PRELOAD_MODELS = False
+    PRELOAD_PROCESSES = None # None for one per cpu
+
+    # post-transform vertex cache entries assumed when reordering triangles
+    VERTEX_CACHE_SIZE = 16
+
+    # normals generated for models without `vn` records
+    NORMALS_WEIGHTING = 'area' # 'area' or 'angle'
+    CREASE_ANGLE = None # degrees, None for fully smooth
+
+    # interleaved vertex layout of obj models (see `MeshHelper.vertexFormat`); float16 positions
+    # need GL_ARB_half_float_vertex, packed normals GL_ARB_vertex_type_2_10_10_10_rev
+    VERTEX_POSITION_FORMAT = 'float32' # 'float32' or 'float16'
+    VERTEX_NORMAL_FORMAT = 'snorm16' # 'float32', 'snorm16' or 'int_2_10_10_10_rev'
+
+    # level of detail chain built for obj models, as fractions of the full face count
+    LOD_LEVELS = [1.0, 0.25, 0.06, 0.015]
+    LOD_MIN_FACES = 64
+    LOD_FACES_PER_PIXEL = 1.0
+
     WIDTH = 1600
     HEIGHT = 800
 
-    REFRESH_TIMER = 1 # millisecs
+    # frames are only drawn when something changed (see `RenderScheduler`), at most once per
+    # refresh; continuous rendering redraws as fast as possible, for benchmarking
+    DISPLAY_REFRESH_RATE = 60 # Hz, paces redraws when vsync is off
+    SWAP_INTERVAL = 1 # vertical blanks per buffer swap, 0 for no vsync
+    CONTINUOUS_RENDERING = False
+
+    # frame timing (see `FrameProfiler`), toggled with 'p' and dumped with 'd' in the windows
+    PROFILER_ENABLED = False
+    PROFILER_OVERLAY = True # statistics drawn over the Qt view while profiling
+    PROFILER_HISTORY = 1000 # frames the rolling statistics are computed over
+    PROFILER_QUERY_FRAMES = 4 # frames whose GPU timer queries may be in flight
+    PROFILER_DUMP_LOC = './profiles/'
+
+    # GL call counting (see `GLTracer`), toggled with 't'
+    TRACER_HISTORY = 1000 # frames the per frame counts are averaged over
+
+    # offscreen rendering to PNG files (see headless.py)
+    HEADLESS_PLATFORM = 'egl' # 'egl' or 'osmesa', PYOPENGL_PLATFORM takes precedence
+    HEADLESS_SAMPLES = 4 # multisampling of the framebuffer object
+    HEADLESS_PNG_COMPRESSION = 6 # zlib level, lower writes faster
+    HEADLESS_OUTPUT_LOC = './renders/'
+
+    # frame capture (see `FrameCapture`), toggled with 'v' in the windows
+    CAPTURE_LOC = './captures/'
+    CAPTURE_FORMAT = 'png' # 'png' (numbered files) or 'raw' (one rgb24 file, e.g. for ffmpeg)
+    CAPTURE_BUFFERS = 3 # pixel pack buffers in flight, frames are mapped up to this many frames later
+    CAPTURE_QUEUE_FRAMES = 16 # frames waiting for the encoder thread before capturing waits
+    CAPTURE_PNG_COMPRESSION = 1 # zlib level of captured frames
 
     # UI defaults
     COLOR_DEFAULT = True
     WIREFRAME_DEFAULT = False
+    WIREFRAME_OVERLAY_DEFAULT = False # wireframe drawn by the fill pass (see light.frag)
     NORMALS_DEFAULT = False
 
     # for UV objects
     MAX_U = 100
     MAX_V = 100
+    UV_BUFFER_CACHE_SIZE = 8 # (U, V) grids kept on the GPU
 
     # perspective frustum
     FOVY = 27.
@@ -54,6 +117,11 @@ class Global(object):
     VERTEX_SHADER_LOC = 'shaders/basic.vert'
     FRAGMENT_SHADER_LOC = 'shaders/light.frag'
 
+    # declarations prepended to every shader; camera matrices and lights are shared by all
+    # programs through a uniform buffer when supported
+    SCENE_SHADER_LOC = 'shaders/scene.glsl'
+    SCENE_UNIFORM_BLOCK = True
+
     CLEAR_COLOR = (.05, .05, .05, 1.)
     WIREFRAME_COLOR = (1,1,1,1)
     SOLID_COLOR = (.5,.5,.5,1)
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+
+from __future__ import division
+import os
+import json
+import ctypes
+import timeit
+import threading
+import collections
+import numpy as np
+import OpenGL.GL as gl
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+from configs import Global
+from imageHelper import ImageHelper
+from frameProfiler import FrameProfiler
+
+class FrameCapture(object):
+    """
+    Records the drawn frames to disk without waiting on the GPU
+
+    Notes
+    -----
+    `capture` is called once a frame is drawn, with the framebuffer to record bound for reading.
+    It only issues a `glReadPixels` into one of `Global.CAPTURE_BUFFERS` pixel pack buffers,
+    which returns at once; a buffer is mapped when its fence says the copy is done, or when
+    the ring is full and it holds the oldest frame (i.e. a couple of frames later). Mapping
+    before the copy is done waits on the GPU, which is counted in `stalls`.
+
+    The mapped pixels go through a queue of `Global.CAPTURE_QUEUE_FRAMES` to an encoder
+    thread writing them as numbered PNG files or appending them to one raw rgb24 file
+    (zlib and file writes release the GIL). When the encoder falls behind, `capture` waits
+    for room in the queue, counted in `queue_wait`.
+    """
+
+    active = False
+    directory = None
+    width = height = 0
+    format = None
+
+    free_buffers = []
+    in_flight = collections.deque() # (frame number, buffer, fence) read back, not mapped yet
+    encoder_queue = None
+    thread = None
+    error = None
+
+    frame = 0
+    stalls = 0
+    queue_wait = 0.0
+    encoded = 0
+    started = None
+
+    @classmethod
+    def start(cls, directory, width, height, format = None):
+        """
+        Starts recording every captured frame
+
+        Parameters
+        ----------
+        directory : str
+            created if needed; gets `frame_000000.png`... or `frames.rgb`, and `capture.json`
+        width : int
+        height : int
+            region read from the bottom left corner of the framebuffer, for the whole capture
+        format : str
+            'png' or 'raw', defaults to `Global.CAPTURE_FORMAT`
+        """
+        if cls.active:
+            cls.stop()
+        format = format or Global.CAPTURE_FORMAT
+        if format not in ['png', 'raw']:
+            raise ValueError('Unknown capture format %r (png or raw)' % format)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        cls.directory, cls.width, cls.height, cls.format = directory, width, height, format
+        cls.frame = cls.stalls = cls.encoded = 0
+        cls.queue_wait = 0.0
+        cls.error = None
+
+        size = 4 * width * height
+        cls.free_buffers = [int(buffer) for buffer in np.atleast_1d(gl.glGenBuffers(Global.CAPTURE_BUFFERS))]
+        for buffer in cls.free_buffers:
+            gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, buffer)
+            gl.glBufferData(gl.GL_PIXEL_PACK_BUFFER, size, None, gl.GL_STREAM_READ)
+        gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, 0)
+        cls.in_flight.clear()
+
+        cls.encoder_queue = queue.Queue(maxsize=Global.CAPTURE_QUEUE_FRAMES)
+        cls.thread = threading.Thread(target=cls.encode, name='FrameCapture encoder')
+        cls.thread.daemon = True
+        cls.thread.start()
+
+        cls.started = timeit.default_timer()
+        cls.active = True
+
+    @staticmethod
+    def fencesSupported():
+        return bool(gl.glFenceSync)
+
+    @classmethod
+    def capture(cls):
+        """
+        Reads back the frame just drawn from the bound read framebuffer
+        """
+        if not cls.active:
+            return
+        FrameProfiler.begin('capture')
+
+        # hand over the frames already copied, and make room in the ring
+        cls.collect()
+        if not cls.free_buffers:
+            cls.map(*cls.in_flight.popleft())
+
+        buffer = cls.free_buffers.pop()
+        gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, buffer)
+        gl.glPixelStorei(gl.GL_PACK_ALIGNMENT, 4)
+        # RGBA keeps the copy on the drivers' fast path, alpha is dropped by the encoder
+        gl.glReadPixels(0, 0, cls.width, cls.height, gl.GL_RGBA, gl.GL_UNSIGNED_BYTE, ctypes.c_void_p(0))
+        gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, 0)
+
+        fence = gl.glFenceSync(gl.GL_SYNC_GPU_COMMANDS_COMPLETE, 0) if cls.fencesSupported() else None
+        cls.in_flight.append((cls.frame, buffer, fence))
+        cls.frame += 1
+
+        FrameProfiler.end('capture')
+
+    @classmethod
+    def collect(cls):
+        """
+        Maps the frames whose copy is done, oldest first (without fences, none are)
+        """
+        while cls.in_flight:
+            frame, buffer, fence = cls.in_flight[0]
+            if fence is None or gl.glClientWaitSync(fence, 0, 0) not in (gl.GL_ALREADY_SIGNALED,
+                                                                         gl.GL_CONDITION_SATISFIED):
+                return
+            cls.map(*cls.in_flight.popleft())
+
+    @classmethod
+    def map(cls, frame, buffer, fence):
+        """
+        Copies the pixels of `frame` out of `buffer` to the encoder queue, freeing the buffer
+        """
+        if fence is not None:
+            if gl.glClientWaitSync(fence, 0, 0) == gl.GL_TIMEOUT_EXPIRED:
+                cls.stalls += 1
+            gl.glDeleteSync(fence)
+
+        size = 4 * cls.width * cls.height
+        gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, buffer)
+        address = gl.glMapBuffer(gl.GL_PIXEL_PACK_BUFFER, gl.GL_READ_ONLY)
+        pixels = ctypes.string_at(address, size) if address else None
+        gl.glUnmapBuffer(gl.GL_PIXEL_PACK_BUFFER)
+        gl.glBindBuffer(gl.GL_PIXEL_PACK_BUFFER, 0)
+        cls.free_buffers.append(buffer)
+
+        if pixels is None:
+            cls.error = cls.error or 'could not map the pixel buffer of frame %d' % frame
+            return
+        start = timeit.default_timer()
+        cls.encoder_queue.put((frame, pixels))
+        cls.queue_wait += timeit.default_timer() - start
+
+    @classmethod
+    def encode(cls):
+        """
+        Encoder thread: writes the queued frames until it gets None
+        """
+        raw = None
+        while True:
+            item = cls.encoder_queue.get()
+            if item is None:
+                break
+            if cls.error is not None:
+                # keep draining so `capture` never waits on a dead encoder
+                continue
+
+            frame, pixels = item
+            # GL rows go bottom up
+            image = np.frombuffer(pixels, dtype=np.uint8).reshape(cls.height, cls.width, 4)[::-1, :, :3]
+            try:
+                if cls.format == 'png':
+                    ImageHelper.writePng(os.path.join(cls.directory, 'frame_%06d.png' % frame), image,
+                                         Global.CAPTURE_PNG_COMPRESSION)
+                else:
+                    if raw is None:
+                        raw = open(os.path.join(cls.directory, 'frames.rgb'), 'wb')
+                    raw.write(np.ascontiguousarray(image).tobytes())
+            except (IOError, OSError) as e:
+                cls.error = str(e)
+                continue
+            cls.encoded += 1
+
+        if raw is not None:
+            raw.close()
+
+    @classmethod
+    def stop(cls):
+        """
+        Maps the frames still in flight, waits for the encoder and frees the buffers
+
+        Returns
+        -------
+        dict
+            'frames' captured and 'encoded', 'seconds' since `start` (encoder drained),
+            'stalls' (maps waiting on the GPU), 'queue_wait' seconds spent waiting on the
+            encoder and the 'error' of the encoder if any; also written to `capture.json`
+        """
+        if not cls.active:
+            return None
+        while cls.in_flight:
+            cls.map(*cls.in_flight.popleft())
+        cls.encoder_queue.put(None)
+        cls.thread.join()
+
+        gl.glDeleteBuffers(len(cls.free_buffers), cls.free_buffers)
+        cls.free_buffers = []
+        cls.active = False
+
+        stats = {
+            'frames': cls.frame,
+            'encoded': cls.encoded,
+            'seconds': timeit.default_timer() - cls.started,
+            'stalls': cls.stalls,
+            'queue_wait': cls.queue_wait,
+            'error': cls.error,
+            'format': cls.format,
+            'width': cls.width,
+            'height': cls.height,
+        }
+        with open(os.path.join(cls.directory, 'capture.json'), 'w') as f:
+            json.dump(stats, f, indent=1, sort_keys=True)
+        return stats
+
+    @classmethod
+    def summary(cls, stats):
+        """
+        Returns
+        -------
+        str
+            one line describing `stats` from `stop`
+        """
+        line = '%d/%d frames of %dx%d written to %s in %.2f s (%.1f fps), %d stalls, %.2f s waiting on the encoder' % (
+            stats['encoded'], stats['frames'], stats['width'], stats['height'], cls.directory, stats['seconds'],
+            stats['encoded'] / stats['seconds'] if stats['seconds'] else 0.0, stats['stalls'], stats['queue_wait'])
+        if stats['error']:
+            line += ', error: %s' % stats['error']
+        return line
@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+
+from __future__ import division
+import os
+import csv
+import json
+import timeit
+import collections
+import numpy as np
+import OpenGL.GL as gl
+
+from configs import Global
+
+class FrameProfiler(object):
+    """
+    Records the CPU and GPU time of every frame and of the passes drawn in it
+
+    Notes
+    -----
+    Sections are delimited by `begin(name)` / `end(name)` (the display wraps the whole frame in
+    'frame', `Object.draw` its 'fill', 'wireframe' and 'normals' passes). CPU time is the wall
+    time spent submitting the section. GPU time comes from `GL_TIMESTAMP` queries issued with
+    `glQueryCounter` at both ends of the section; timestamps nest where `GL_TIME_ELAPSED`
+    queries cannot.
+
+    Query results are read without stalling: finished frames wait in a ring of
+    `Global.PROFILER_QUERY_FRAMES` and are only read once their last query is available. When
+    the ring is full the oldest frame is kept without GPU times (counted in `dropped`).
+
+    Needs GL_ARB_timer_query for GPU times, only CPU times are recorded without it.
+    """
+
+    enabled = Global.PROFILER_ENABLED
+    timer_queries = None # checked on first use, with the GL context current
+
+    free_queries = []
+    pending = collections.deque() # (frame number, sections) waiting for their query results
+    sections = [] # sections of the frame being drawn, in begin order
+    open_sections = {} # name => section begun but not ended
+
+    # last `Global.PROFILER_HISTORY` frames: (frame number, [(section, cpu ms, gpu ms or None)...])
+    frames = collections.deque(maxlen=Global.PROFILER_HISTORY)
+    frame = 0
+    dropped = 0
+
+    @classmethod
+    def setEnabled(cls, bool):
+        cls.enabled = bool
+        if not bool:
+            cls.reset()
+
+    @classmethod
+    def reset(cls):
+        """
+        Forgets the recorded frames and any pending queries
+        """
+        for frame, sections in cls.pending:
+            cls.releaseQueries(sections)
+        cls.releaseQueries(cls.sections)
+        cls.pending.clear()
+        cls.sections = []
+        cls.open_sections = {}
+        cls.frames.clear()
+        cls.dropped = 0
+
+    @classmethod
+    def timerQueriesSupported(cls):
+        """
+        Whether GPU times can be measured (GL 3.3 or GL_ARB_timer_query)
+        """
+        if cls.timer_queries is None:
+            try:
+                from OpenGL.GL.ARB.timer_query import glInitTimerQueryARB
+                cls.timer_queries = bool(glInitTimerQueryARB())
+            except ImportError:
+                cls.timer_queries = False
+        return cls.timer_queries
+
+    @classmethod
+    def timestamp(cls):
+        """
+        Issues a `GL_TIMESTAMP` query, reusing released query objects
+
+        Returns
+        -------
+        int
+            the query, None without timer queries
+        """
+        if not cls.timerQueriesSupported():
+            return None
+        query = cls.free_queries.pop() if cls.free_queries else gl.glGenQueries(1)
+        gl.glQueryCounter(query, gl.GL_TIMESTAMP)
+        return query
+
+    @classmethod
+    def releaseQueries(cls, sections):
+        for section in sections:
+            cls.free_queries.extend(query for query in section['queries'] if query is not None)
+            section['queries'] = [None, None]
+
+    @classmethod
+    def begin(cls, name):
+        if not cls.enabled:
+            return
+        section = {'name': name, 'cpu': -timeit.default_timer(), 'queries': [cls.timestamp(), None]}
+        cls.open_sections[name] = section
+        cls.sections.append(section)
+
+    @classmethod
+    def end(cls, name):
+        if not cls.enabled:
+            return
+        section = cls.open_sections.pop(name, None)
+        if section is None:
+            return
+        section['queries'][1] = cls.timestamp()
+        section['cpu'] += timeit.default_timer()
+
+    @classmethod
+    def beginFrame(cls):
+        if not cls.enabled:
+            return
+        cls.collect()
+        cls.frame += 1
+        cls.sections = []
+        cls.open_sections = {}
+        cls.begin('frame')
+
+    @classmethod
+    def endFrame(cls):
+        if not cls.enabled:
+            return
+        cls.end('frame')
+        # sections left open by an exception have no end, drop them
+        unfinished = set(id(section) for section in cls.open_sections.values())
+        cls.releaseQueries(cls.open_sections.values())
+        cls.sections = [section for section in cls.sections if id(section) not in unfinished]
+        cls.open_sections = {}
+        cls.pending.append((cls.frame, cls.sections))
+        cls.sections = []
+
+        # never wait on the GPU: past the ring size, the oldest frame goes without GPU times
+        while len(cls.pending) > Global.PROFILER_QUERY_FRAMES:
+            frame, sections = cls.pending.popleft()
+            cls.releaseQueries(sections)
+            cls.record(frame, sections, None)
+            cls.dropped += 1
+
+    @classmethod
+    def collect(cls):
+        """
+        Records the frames whose query results are available, oldest first
+        """
+        while cls.pending:
+            frame, sections = cls.pending[0]
+            # timestamps complete in order, the end of 'frame' was issued last
+            last = sections[0]['queries'][1] if sections else None
+            if last is not None and not gl.glGetQueryObjectiv(last, gl.GL_QUERY_RESULT_AVAILABLE):
+                return
+            cls.pending.popleft()
+
+            gpu = None
+            if last is not None:
+                gpu = {}
+                for i, section in enumerate(sections):
+                    start, end = section['queries']
+                    if start is not None and end is not None:
+                        gpu[i] = (gl.glGetQueryObjectui64v(end, gl.GL_QUERY_RESULT) -
+                                  gl.glGetQueryObjectui64v(start, gl.GL_QUERY_RESULT)) / 1e6
+            cls.releaseQueries(sections)
+            cls.record(frame, sections, gpu)
+
+    @classmethod
+    def record(cls, frame, sections, gpu):
+        """
+        Parameters
+        ----------
+        frame : int
+        sections : list
+        gpu : dict
+            section index => GPU milliseconds, None if unknown
+        """
+        cls.frames.append((frame, [(section['name'], 1000 * section['cpu'], (gpu or {}).get(i))
+                                   for i, section in enumerate(sections)]))
+
+    @classmethod
+    def statistics(cls):
+        """
+        Rolling statistics over the recorded frames
+
+        Returns
+        -------
+        dict
+            section name => {'samples': int, 'cpu_ms': {...}, 'gpu_ms': {...} or None}, each
+            time with 'mean', 'p50', 'p95' and 'p99'
+        """
+        cpu, gpu = collections.OrderedDict(), {}
+        for frame, samples in cls.frames:
+            for name, cpu_ms, gpu_ms in samples:
+                cpu.setdefault(name, []).append(cpu_ms)
+                if gpu_ms is not None:
+                    gpu.setdefault(name, []).append(gpu_ms)
+
+        def summarize(times):
+            if not times:
+                return None
+            p50, p95, p99 = np.percentile(times, [50, 95, 99])
+            return {'mean': float(np.mean(times)), 'p50': float(p50), 'p95': float(p95), 'p99': float(p99)}
+
+        return collections.OrderedDict(
+            (name, {'samples': len(times), 'cpu_ms': summarize(times), 'gpu_ms': summarize(gpu.get(name))})
+            for name, times in cpu.items())
+
+    @classmethod
+    def summary(cls):
+        """
+        Returns
+        -------
+        list
+            one line of text per section, p50/p95/p99 in milliseconds (for the on-screen overlay)
+        """
+        lines = ['%-10s %-20s %s' % ('p50/95/99', 'cpu ms', 'gpu ms')]
+        for name, stats in cls.statistics().items():
+            times = []
+            for key in ['cpu_ms', 'gpu_ms']:
+                if stats[key] is None:
+                    times.append('-')
+                else:
+                    times.append('%.2f/%.2f/%.2f' % (stats[key]['p50'], stats[key]['p95'], stats[key]['p99']))
+            lines.append('%-10s %-20s %s' % (name, times[0], times[1]))
+        if cls.dropped:
+            lines.append('%d frames without gpu times' % cls.dropped)
+        return lines
+
+    @classmethod
+    def dump(cls, path):
+        """
+        Writes the recorded frames to `path`
+
+        Parameters
+        ----------
+        path : str
+            '.csv' for one row per section and frame (frame, section, cpu_ms, gpu_ms), anything
+            else for json with the 'statistics' and the 'frames'
+        """
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        if path.endswith('.csv'):
+            with open(path, 'w') as f:
+                writer = csv.writer(f)
+                writer.writerow(['frame', 'section', 'cpu_ms', 'gpu_ms'])
+                for frame, samples in cls.frames:
+                    for name, cpu_ms, gpu_ms in samples:
+                        writer.writerow([frame, name, '%.4f' % cpu_ms, '' if gpu_ms is None else '%.4f' % gpu_ms])
+        else:
+            with open(path, 'w') as f:
+                json.dump({
+                    'statistics': cls.statistics(),
+                    'dropped': cls.dropped,
+                    'frames': [{'frame': frame, 'sections': [
+                        {'name': name, 'cpu_ms': cpu_ms, 'gpu_ms': gpu_ms} for name, cpu_ms, gpu_ms in samples
+                    ]} for frame, samples in cls.frames],
+                }, f, indent=1)
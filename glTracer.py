@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+
+from __future__ import division
+import sys
+import json
+import functools
+import collections
+import numpy as np
+
+from configs import Global
+
+class _TracedGL(object):
+    """
+    Stands in for the `OpenGL.GL` module of a traced module, wrapping some of its functions
+    """
+
+    def __init__(self, module, wrappers):
+        self._module = module
+        self.__dict__.update(wrappers)
+
+    def __getattr__(self, name):
+        return getattr(self._module, name)
+
+
+class GLTracer(object):
+    """
+    Counts GL calls, state changes and uploaded bytes per frame
+
+    Notes
+    -----
+    Nothing is wrapped until `install`: the `gl` module of objects.py, bufferHelper.py and
+    shaderHelper.py is then replaced by a proxy counting the functions of `categories`, the
+    entry points in `helper_methods` are wrapped, and so is the display function drawing the
+    frames. `uninstall` puts the originals back, so the tracer costs nothing when it is off.
+
+    Counters are deterministic for a given scene, which makes them suitable for comparing
+    commits (see `python benchmark.py trace`).
+    """
+
+    # category => GL functions counted in it
+    categories = collections.OrderedDict([
+        ('draw_calls', ['glDrawArrays', 'glDrawElements', 'glMultiDrawArrays', 'glMultiDrawElements']),
+        ('program_switches', ['glUseProgram']),
+        ('state_changes', ['glEnable', 'glDisable', 'glPolygonOffset', 'glBindBuffer', 'glBindBufferBase',
+                           'glBindVertexArray']),
+        ('attribute_rebinds', ['glVertexAttribPointer', 'glEnableVertexAttribArray',
+                               'glDisableVertexAttribArray', 'glVertexAttrib4f']),
+        ('uniform_uploads', ['glUniform1f', 'glUniform2f', 'glUniform3f', 'glUniform4f', 'glUniform1i',
+                             'glUniform2i', 'glUniform3i', 'glUniform4i', 'glUniformMatrix3fv',
+                             'glUniformMatrix4fv']),
+        ('buffer_uploads', ['glBufferData', 'glBufferSubData']),
+    ])
+
+    # class => entry points counted by name
+    helper_methods = {
+        'BufferHelper': ['sendToGPU', 'bindVertexArray', 'buildVertexArray', 'sendToShaders',
+                         'sendConstantToShaders', 'deleteBuffer'],
+        'ShaderHelper': ['buildAndUseProgram', 'sendUniform', 'sendScene', 'applyUniforms'],
+    }
+
+    traced_modules = ['objects', 'bufferHelper', 'shaderHelper']
+
+    installed = False
+    originals = [] # (owner, attribute, original value) to restore
+    category_of = dict((name, category) for category, names in categories.items() for name in names)
+
+    counters = collections.Counter() # counts of the frame being drawn
+    outside = collections.Counter() # counts between frames (i.e. model uploads)
+    frames = collections.deque(maxlen=Global.TRACER_HISTORY)
+
+    @classmethod
+    def count(cls, name, args):
+        """
+        Counts a call of GL function `name`
+        """
+        counters = cls.counters
+        counters[name] += 1
+        counters[cls.category_of[name]] += 1
+        if name == 'glBufferData' and args[2] is not None:
+            counters['bytes_uploaded'] += int(args[1])
+        elif name == 'glBufferSubData':
+            counters['bytes_uploaded'] += int(args[2])
+            if args[0] == cls.gl.GL_UNIFORM_BUFFER:
+                counters['uniform_uploads'] += 1
+
+    @classmethod
+    def _wrap(cls, name, function, counter):
+        # no functools.wraps, GL function objects do not all have a __name__
+        def traced(*args, **kwargs):
+            counter(name, args)
+            return function(*args, **kwargs)
+        return traced
+
+    @classmethod
+    def _replace(cls, owner, attribute, value):
+        if isinstance(owner, type):
+            # the raw class attribute, so classmethods and staticmethods come back as they were
+            owner = next(klass for klass in owner.__mro__ if attribute in klass.__dict__)
+            original = owner.__dict__[attribute]
+        else:
+            original = getattr(owner, attribute)
+        cls.originals.append((owner, attribute, original))
+        setattr(owner, attribute, value)
+
+    @classmethod
+    def install(cls, display_class, display_method = 'display'):
+        """
+        Starts counting
+
+        Parameters
+        ----------
+        display_class : type
+            class whose `display_method` draws one frame (i.e. `GLUTDisplay`)
+        display_method : str
+        """
+        if cls.installed:
+            return
+        import OpenGL.GL as gl
+        cls.gl = gl
+
+        names = [name for names in cls.categories.values() for name in names]
+        # functions the driver does not provide stay null so support checks keep working
+        wrappers = dict((name, cls._wrap(name, getattr(gl, name), cls.count))
+                        for name in names if getattr(gl, name, None))
+        proxy = _TracedGL(gl, wrappers)
+        for module_name in cls.traced_modules:
+            module = sys.modules.get(module_name)
+            if module is not None and getattr(module, 'gl', None) is gl:
+                cls._replace(module, 'gl', proxy)
+
+        def countHelper(name, args):
+            cls.counters[name] += 1
+
+        for class_name, methods in cls.helper_methods.items():
+            module = sys.modules.get(class_name[0].lower() + class_name[1:])
+            helper = getattr(module, class_name, None)
+            if helper is None:
+                continue
+
+            # glUniform* are called through this table
+            if class_name == 'ShaderHelper':
+                functions = dict(helper.uniform_functions)
+                for key, function in helper.uniform_functions.items():
+                    name = next((name for name in cls.categories['uniform_uploads']
+                                 if getattr(gl, name, None) is function), None)
+                    if function and name is not None:
+                        functions[key] = cls._wrap(name, function, cls.count)
+                cls._replace(helper, 'uniform_functions', functions)
+
+            for method in methods:
+                original = helper.__dict__[method]
+                wrapped = cls._wrap('%s.%s' % (class_name, method), original.__func__, countHelper)
+                cls._replace(helper, method, classmethod(wrapped) if isinstance(original, classmethod)
+                             else staticmethod(wrapped))
+
+        display = next(klass.__dict__[display_method] for klass in display_class.__mro__
+                       if display_method in klass.__dict__)
+        @functools.wraps(display)
+        def tracedDisplay(self, *args, **kwargs):
+            cls.beginFrame()
+            try:
+                return display(self, *args, **kwargs)
+            finally:
+                cls.endFrame()
+        cls._replace(display_class, display_method, tracedDisplay)
+
+        cls.installed = True
+
+    @classmethod
+    def uninstall(cls):
+        """
+        Stops counting, putting back every wrapped function
+        """
+        while cls.originals:
+            owner, attribute, original = cls.originals.pop()
+            setattr(owner, attribute, original)
+        cls.installed = False
+
+    @classmethod
+    def reset(cls):
+        cls.counters.clear()
+        cls.outside.clear()
+        cls.frames.clear()
+
+    @classmethod
+    def beginFrame(cls):
+        cls.outside.update(cls.counters)
+        cls.counters.clear()
+
+    @classmethod
+    def endFrame(cls):
+        cls.frames.append(dict(cls.counters))
+        cls.counters.clear()
+
+    @classmethod
+    def report(cls):
+        """
+        Per frame statistics of the recorded frames
+
+        Returns
+        -------
+        dict
+            'frames' recorded, and per counter (categories, 'bytes_uploaded', GL functions and
+            helper entry points) the 'mean', 'min' and 'max' per frame in 'per_frame', plus the
+            counts made 'between_frames'
+        """
+        keys = sorted(set(key for frame in cls.frames for key in frame))
+        per_frame = collections.OrderedDict()
+        for key in list(cls.categories) + ['bytes_uploaded'] + keys:
+            if key in per_frame:
+                continue
+            values = np.array([frame.get(key, 0) for frame in cls.frames] or [0])
+            per_frame[key] = {'mean': float(values.mean()), 'min': int(values.min()), 'max': int(values.max())}
+        return {'frames': len(cls.frames), 'per_frame': per_frame, 'between_frames': dict(cls.outside)}
+
+    @classmethod
+    def summary(cls):
+        """
+        Returns
+        -------
+        list
+            one line of text per category, mean per frame
+        """
+        report = cls.report()
+        lines = ['%d frames traced, per frame:' % report['frames']]
+        for key in list(cls.categories) + ['bytes_uploaded']:
+            lines.append('  %-18s %10.1f' % (key, report['per_frame'][key]['mean']))
+        return lines
+
+    @classmethod
+    def dump(cls, path):
+        with open(path, 'w') as f:
+            json.dump(cls.report(), f, indent=1, sort_keys=True)
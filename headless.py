@@ -0,0 +1,400 @@
+#!/usr/bin/env python
+
+"""
+Renders models to PNG files without a window, on an EGL or OSMesa context
+
+Usage
+-----
+    python headless.py [--models Box UVTorus models/cow.obj] [--shading lights normals zbuffer]
+                       [--size 800 600] [--eye 0 0 25] [--lookat 0 0 -15] [--up 0 1 0]
+                       [--fovy 27] [--rotate 20 30] [--scale 1.0] [--wireframe] [--overlay]
+                       [--normals] [--no-color] [--samples 4] [--out ./renders/]
+                       [--platform egl|osmesa] [--turntable 120] [--capture-format png|raw]
+                       [--no-capture]
+
+Works without a GPU or a display server with Mesa (llvmpipe): one image is written per model
+and shading, and the throughput is printed in images per second. With `--turntable`, every
+model and shading is recorded as a sequence of frames through `FrameCapture` instead, and the
+frame rate is printed with and without waiting for the frames to be written.
+"""
+
+from __future__ import division, print_function
+import os
+import sys
+import math
+import argparse
+import timeit
+
+from configs import Global
+
+SHADINGS = ['lights', 'normals', 'zbuffer']
+
+def parseArguments(argv = None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--models', nargs='+', default=['Box'],
+                        help='builtin models (Box, UVSphere, UVMobius, UVTorus, UVKleinBottle) or model files')
+    parser.add_argument('--shading', nargs='+', default=['lights'], choices=SHADINGS)
+    parser.add_argument('--size', nargs=2, type=int, default=[Global.WIDTH, Global.HEIGHT],
+                        metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--eye', nargs=3, type=float, default=Global.EYE)
+    parser.add_argument('--lookat', nargs=3, type=float, default=Global.LOOKAT)
+    parser.add_argument('--up', nargs=3, type=float, default=Global.UP)
+    parser.add_argument('--fovy', type=float, default=Global.FOVY)
+    parser.add_argument('--rotate', nargs=2, type=float, default=[0, 0], metavar=('X', 'Y'),
+                        help='model rotation in degrees, around x then y')
+    parser.add_argument('--scale', type=float, default=1.0)
+    parser.add_argument('--wireframe', action='store_true')
+    parser.add_argument('--overlay', action='store_true', help='single pass wireframe')
+    parser.add_argument('--normals', action='store_true', help='draw the normal vectors')
+    parser.add_argument('--no-color', action='store_true')
+    parser.add_argument('--samples', type=int, default=Global.HEADLESS_SAMPLES)
+    parser.add_argument('--compression', type=int, default=Global.HEADLESS_PNG_COMPRESSION)
+    parser.add_argument('--out', default=Global.HEADLESS_OUTPUT_LOC)
+    parser.add_argument('--turntable', type=int, default=0, metavar='FRAMES',
+                        help='record FRAMES frames turning around the y axis instead of one image')
+    parser.add_argument('--capture-format', choices=['png', 'raw'], default=Global.CAPTURE_FORMAT)
+    parser.add_argument('--no-capture', action='store_true',
+                        help='draw the turntable frames without recording them, for comparison')
+    parser.add_argument('--platform', choices=['egl', 'osmesa'],
+                        default=os.environ.get('PYOPENGL_PLATFORM', Global.HEADLESS_PLATFORM))
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    ARGS = parseArguments()
+    # PyOpenGL binds to its platform on first import, which the imports below do
+    os.environ['PYOPENGL_PLATFORM'] = ARGS.platform
+
+import ctypes
+import numpy as np
+import OpenGL.GL as gl
+
+from transforms import Transform
+from imageHelper import ImageHelper
+from frameCapture import FrameCapture
+from main import GLUTDisplay
+
+
+class HeadlessContext(object):
+    """
+    GL context without a window, drawing into a framebuffer object
+
+    Notes
+    -----
+    The context comes from EGL (pbuffer surface) or OSMesa, whichever `PYOPENGL_PLATFORM`
+    names. Frames are drawn into a multisampled framebuffer object and resolved into a single
+    sampled one for `readPixels`.
+    """
+
+    def __init__(self, width, height, samples = 0):
+        self.width, self.height = width, height
+        self.platform = os.environ.get('PYOPENGL_PLATFORM', Global.HEADLESS_PLATFORM)
+        if self.platform == 'egl':
+            self.createEGLContext()
+        elif self.platform == 'osmesa':
+            self.createOSMesaContext()
+        else:
+            raise ValueError('No headless context on platform %r (egl or osmesa)' % self.platform)
+
+        self.framebuffers = []
+        self.renderbuffers = []
+        self.samples = min(max(samples, 0), int(gl.glGetIntegerv(gl.GL_MAX_SAMPLES)))
+        self.resolve_framebuffer = self.buildFramebuffer(0, depth=self.samples <= 1)
+        if self.samples > 1:
+            self.draw_framebuffer = self.buildFramebuffer(self.samples, depth=True)
+        else:
+            self.draw_framebuffer = self.resolve_framebuffer
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, self.draw_framebuffer)
+
+    def createEGLContext(self):
+        from OpenGL import EGL
+        self.egl = EGL
+
+        self.display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+        major, minor = EGL.EGLint(), EGL.EGLint()
+        if not EGL.eglInitialize(self.display, ctypes.pointer(major), ctypes.pointer(minor)):
+            raise RuntimeError('Could not initialize EGL')
+
+        attributes = (EGL.EGLint * 13)(
+            EGL.EGL_SURFACE_TYPE, EGL.EGL_PBUFFER_BIT,
+            EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT,
+            EGL.EGL_RED_SIZE, 8, EGL.EGL_GREEN_SIZE, 8, EGL.EGL_BLUE_SIZE, 8,
+            EGL.EGL_DEPTH_SIZE, 24,
+            EGL.EGL_NONE)
+        config, count = EGL.EGLConfig(), EGL.EGLint()
+        if not EGL.eglChooseConfig(self.display, attributes, ctypes.pointer(config), 1, ctypes.pointer(count)) \
+                or count.value < 1:
+            raise RuntimeError('No EGL config for desktop OpenGL')
+
+        surface_attributes = (EGL.EGLint * 5)(EGL.EGL_WIDTH, self.width, EGL.EGL_HEIGHT, self.height, EGL.EGL_NONE)
+        self.surface = EGL.eglCreatePbufferSurface(self.display, config, surface_attributes)
+        EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+        self.context = EGL.eglCreateContext(self.display, config, EGL.EGL_NO_CONTEXT, None)
+        if not EGL.eglMakeCurrent(self.display, self.surface, self.surface, self.context):
+            raise RuntimeError('Could not make the EGL context current')
+
+    def createOSMesaContext(self):
+        from OpenGL import osmesa, arrays
+        self.osmesa = osmesa
+
+        self.context = osmesa.OSMesaCreateContextExt(osmesa.OSMESA_RGBA, 24, 0, 0, None)
+        if not self.context:
+            raise RuntimeError('Could not create the OSMesa context')
+        # OSMesa draws the default framebuffer here, we only draw into our own
+        self.buffer = arrays.GLubyteArray.zeros((self.height, self.width, 4))
+        if not osmesa.OSMesaMakeCurrent(self.context, self.buffer, gl.GL_UNSIGNED_BYTE, self.width, self.height):
+            raise RuntimeError('Could not make the OSMesa context current')
+
+    def buildFramebuffer(self, samples, depth):
+        """
+        Returns
+        -------
+        int
+            framebuffer with an RGBA8 and, if `depth`, a 24 bit depth renderbuffer of the
+            context size
+        """
+        framebuffer = gl.glGenFramebuffers(1)
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, framebuffer)
+        self.framebuffers.append(framebuffer)
+
+        attachments = [(gl.GL_RGBA8, gl.GL_COLOR_ATTACHMENT0)]
+        if depth:
+            attachments.append((gl.GL_DEPTH_COMPONENT24, gl.GL_DEPTH_ATTACHMENT))
+        for internal_format, attachment in attachments:
+            renderbuffer = gl.glGenRenderbuffers(1)
+            gl.glBindRenderbuffer(gl.GL_RENDERBUFFER, renderbuffer)
+            gl.glRenderbufferStorageMultisample(gl.GL_RENDERBUFFER, samples, internal_format,
+                                                self.width, self.height)
+            gl.glFramebufferRenderbuffer(gl.GL_FRAMEBUFFER, attachment, gl.GL_RENDERBUFFER, renderbuffer)
+            self.renderbuffers.append(renderbuffer)
+
+        status = gl.glCheckFramebufferStatus(gl.GL_FRAMEBUFFER)
+        if status != gl.GL_FRAMEBUFFER_COMPLETE:
+            raise RuntimeError('Incomplete framebuffer (0x%x)' % status)
+        return framebuffer
+
+    def resolve(self):
+        """
+        Leaves the last frame, single sampled, in the framebuffer bound for reading
+        """
+        width, height = self.width, self.height
+        if self.draw_framebuffer != self.resolve_framebuffer:
+            gl.glBindFramebuffer(gl.GL_READ_FRAMEBUFFER, self.draw_framebuffer)
+            gl.glBindFramebuffer(gl.GL_DRAW_FRAMEBUFFER, self.resolve_framebuffer)
+            gl.glBlitFramebuffer(0, 0, width, height, 0, 0, width, height,
+                                 gl.GL_COLOR_BUFFER_BIT, gl.GL_NEAREST)
+            gl.glBindFramebuffer(gl.GL_DRAW_FRAMEBUFFER, self.draw_framebuffer)
+        gl.glBindFramebuffer(gl.GL_READ_FRAMEBUFFER, self.resolve_framebuffer)
+
+    def readPixels(self):
+        """
+        Reads the last frame back, waiting for it to be drawn
+
+        Returns
+        -------
+        numpy.array
+            (height, width, 3) uint8 RGB of the last frame, first row on top
+        """
+        self.resolve()
+        gl.glPixelStorei(gl.GL_PACK_ALIGNMENT, 1)
+        data = gl.glReadPixels(0, 0, self.width, self.height, gl.GL_RGB, gl.GL_UNSIGNED_BYTE)
+
+        # GL rows go bottom up
+        return np.frombuffer(data, dtype=np.uint8).reshape(self.height, self.width, 3)[::-1]
+
+    def release(self):
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, 0)
+        gl.glDeleteRenderbuffers(len(self.renderbuffers), self.renderbuffers)
+        gl.glDeleteFramebuffers(len(self.framebuffers), self.framebuffers)
+        self.renderbuffers, self.framebuffers = [], []
+
+        if self.platform == 'egl':
+            EGL = self.egl
+            EGL.eglMakeCurrent(self.display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, EGL.EGL_NO_CONTEXT)
+            EGL.eglDestroySurface(self.display, self.surface)
+            EGL.eglDestroyContext(self.display, self.context)
+            EGL.eglTerminate(self.display)
+        else:
+            self.osmesa.OSMesaDestroyContext(self.context)
+
+
+class HeadlessDisplay(GLUTDisplay):
+    """
+    `GLUTDisplay` drawing into a `HeadlessContext` instead of a window
+
+    Notes
+    -----
+    Transformations, models and the frame itself go through the `GLUTDisplay` code paths, so
+    images match what the windows show for the same camera.
+    """
+
+    def __init__(self, context):
+        self.context = context
+        self.render_obj = None
+        self.standalone = False # no buffers to swap
+
+        self.buildProgram()
+        self.reshape(context.width, context.height)
+
+    def setCamera(self, eye, lookat, up, fovy):
+        Global.EYE, Global.LOOKAT, Global.UP = tuple(eye), tuple(lookat), tuple(up)
+        Global.FOVY = fovy
+        self.reshape(self.viewport_width, self.viewport_height)
+
+    def setRotation(self, x, y):
+        """
+        Rotates the model `x` degrees around the x axis, then `y` degrees around the y axis
+        """
+        self.resetRotation()
+        self.rotationMatrix *= Transform.xrotate(math.radians(x))
+        self.rotationMatrix *= Transform.yrotate(math.radians(y))
+
+    def setShading(self, shading):
+        """
+        Parameters
+        ----------
+        shading : str
+            'lights', 'normals' or 'zbuffer'
+        """
+        self.setLightsShading(shading == 'lights')
+        self.setNormalsShading(shading == 'normals')
+        self.setZBufferShading(shading == 'zbuffer')
+
+    def render(self):
+        """
+        Draws one frame
+
+        Returns
+        -------
+        numpy.array
+            see `HeadlessContext.readPixels`
+        """
+        self.display()
+        return self.context.readPixels()
+
+    def captureFrame(self):
+        # the frame is drawn multisampled
+        if FrameCapture.active:
+            self.context.resolve()
+            FrameCapture.capture()
+
+
+def loadModel(display, model, args):
+    """
+    Switches `display` to `model` with the display toggles of `args`
+
+    Returns
+    -------
+    str
+        name of the model in file names
+    """
+    display.setModel(model)
+    render_obj = display.render_obj
+    render_obj.wireframe_on = args.wireframe or args.overlay
+    render_obj.wireframe_overlay = args.overlay
+    render_obj.normals_on = args.normals
+    render_obj.color_on = not args.no_color
+    return os.path.splitext(os.path.basename(model))[0]
+
+def renderImages(display, args):
+    """
+    Writes one PNG per model and shading of `args` to `args.out`
+
+    Returns
+    -------
+    dict
+        'images' written, 'load' (model building), 'render' (drawing and reading back) and
+        'encode' (PNG) seconds
+    """
+    stats = {'images': 0, 'load': 0.0, 'render': 0.0, 'encode': 0.0}
+    for model in args.models:
+        start = timeit.default_timer()
+        name = loadModel(display, model, args)
+        stats['load'] += timeit.default_timer() - start
+
+        for shading in args.shading:
+            display.setShading(shading)
+
+            start = timeit.default_timer()
+            pixels = display.render()
+            stats['render'] += timeit.default_timer() - start
+
+            start = timeit.default_timer()
+            ImageHelper.writePng(os.path.join(args.out, '%s_%s.png' % (name, shading)), pixels, args.compression)
+            stats['encode'] += timeit.default_timer() - start
+            stats['images'] += 1
+
+    display.releaseModel()
+    return stats
+
+def renderTurntables(display, args):
+    """
+    Draws `args.turntable` frames per model and shading, turning the model a full circle around
+    the y axis, and records them with `FrameCapture` to `args.out`/<model>_<shading>/ (unless
+    `args.no_capture`)
+
+    Returns
+    -------
+    list
+        (model name, shading, frames, seconds drawing, seconds until written, capture stats
+        or None) per turntable
+    """
+    results = []
+    for model in args.models:
+        name = loadModel(display, model, args)
+        for shading in args.shading:
+            display.setShading(shading)
+            # first frame builds the lazy buffers, keep it out of the timings
+            display.render()
+
+            if not args.no_capture:
+                FrameCapture.start(os.path.join(args.out, '%s_%s' % (name, shading)),
+                                   display.viewport_width, display.viewport_height, args.capture_format)
+            start = timeit.default_timer()
+            for i in range(args.turntable):
+                display.setRotation(args.rotate[0], args.rotate[1] + 360 * i / args.turntable)
+                display.display()
+            drawn = timeit.default_timer() - start
+
+            if args.no_capture:
+                gl.glFinish()
+                capture = None
+            else:
+                capture = FrameCapture.stop()
+            results.append((name, shading, args.turntable, drawn, timeit.default_timer() - start, capture))
+
+    display.releaseModel()
+    return results
+
+
+if __name__ == '__main__':
+    context = HeadlessContext(ARGS.size[0], ARGS.size[1], ARGS.samples)
+    print('%s on %s, %dx%d, %d samples' % (context.platform, gl.glGetString(gl.GL_RENDERER),
+                                           context.width, context.height, context.samples))
+
+    display = HeadlessDisplay(context)
+    display.setCamera(ARGS.eye, ARGS.lookat, ARGS.up, ARGS.fovy)
+    display.setRotation(*ARGS.rotate)
+    display.scale = ARGS.scale
+
+    if ARGS.turntable:
+        results = renderTurntables(display, ARGS)
+        context.release()
+
+        for name, shading, frames, drawn, total, capture in results:
+            print('%s %s: %d frames, %.1f fps drawing, %.1f fps %s' % (
+                name, shading, frames, frames / drawn, frames / total,
+                'until all were written' if capture else 'without capturing'))
+            if capture:
+                print('  %s' % FrameCapture.summary(capture))
+        sys.exit(0)
+
+    stats = renderImages(display, ARGS)
+    context.release()
+
+    seconds = stats['render'] + stats['encode']
+    images = max(stats['images'], 1)
+    print('%d images in %.2f s (+ %.2f s loading models): %.1f images/s' % (
+        stats['images'], seconds, stats['load'], stats['images'] / seconds if seconds else 0.0))
+    print('per image: %.1f ms drawing and reading back, %.1f ms writing the png' % (
+        1000 * stats['render'] / images, 1000 * stats['encode'] / images))
+    sys.exit(0 if stats['images'] else 1)
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+from __future__ import division
+import os
+import zlib
+import struct
+import numpy as np
+
+class ImageHelper(object):
+    """
+    Writes rendered frames to disk without any imaging library
+    """
+
+    PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+    # channels => PNG color type
+    PNG_COLOR_TYPES = {1: 0, 3: 2, 4: 6}
+
+    @staticmethod
+    def pngChunk(tag, data):
+        return (struct.pack('>I', len(data)) + tag + data +
+                struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff))
+
+    @classmethod
+    def encodePng(cls, pixels, level = 6):
+        """
+        Parameters
+        ----------
+        pixels : numpy.array
+            (height, width, channels) uint8, first row on top, 1 (gray), 3 (RGB) or 4 (RGBA)
+            channels
+        level : int
+            zlib compression level, lower is faster
+
+        Returns
+        -------
+        bytes
+            the PNG file
+        """
+        pixels = np.asarray(pixels, dtype=np.uint8)
+        if pixels.ndim == 2:
+            pixels = pixels[:, :, np.newaxis]
+        height, width, channels = pixels.shape
+        if channels not in cls.PNG_COLOR_TYPES:
+            raise ValueError('Cannot write %d channel images' % channels)
+
+        # every row starts with its filter type, 0 (none)
+        rows = np.zeros((height, 1 + width * channels), dtype=np.uint8)
+        rows[:, 1:] = pixels.reshape(height, -1)
+
+        header = struct.pack('>IIBBBBB', width, height, 8, cls.PNG_COLOR_TYPES[channels], 0, 0, 0)
+        return (cls.PNG_SIGNATURE +
+                cls.pngChunk(b'IHDR', header) +
+                cls.pngChunk(b'IDAT', zlib.compress(rows.tobytes(), level)) +
+                cls.pngChunk(b'IEND', b''))
+
+    @classmethod
+    def writePng(cls, path, pixels, level = 6):
+        """
+        Writes `pixels` (see `encodePng`) to `path`, creating its directory if needed
+        """
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(path, 'wb') as f:
+            f.write(cls.encodePng(pixels, level))
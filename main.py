@@ -3,6 +3,7 @@
 from __future__ import division
 import os
 import sys
+import time
 import ctypes
 import OpenGL.GL as gl
 import OpenGL.GLU as glu
@@ -14,11 +15,16 @@ from configs import Global
 from shaderHelper import ShaderHelper
 from bufferHelper import BufferHelper
 from transforms import Transform
-from qtHelper import QtHelper
+from renderScheduler import RenderScheduler
+from frameProfiler import FrameProfiler
+from glTracer import GLTracer
+from frameCapture import FrameCapture
+from meshHelper import MeshHelper
+from qtHelper import QtHelper, QTModelLoader
 
 from objects import Box, Obj, UVObject, UVSphere, UVMobius, UVTorus, UVKlein
 
-from PyQt4.QtCore import Qt, QTimer
+from PyQt4.QtCore import Qt, QTimer, pyqtSignal
 from PyQt4 import QtGui
 from PyQt4.QtOpenGL import QGLWidget, QGLFormat
 
@@ -48,11 +54,13 @@ class GLUTDisplay(object):
         glut.glutCreateWindow('Frightened Glut Rabbit')
         glut.glutReshapeWindow(Global.WIDTH, Global.HEIGHT)
         glut.glutReshapeFunc(self.reshape)
-        glut.glutDisplayFunc(self.display)
+        glut.glutDisplayFunc(lambda: self.display()) # looked up per frame, `GLTracer` may wrap it
         glut.glutKeyboardFunc(self.keyboard)
         glut.glutMouseFunc(self.glutMousePressEvent)
         glut.glutMotionFunc(self.glutMouseMoveEvent)
-        glut.glutTimerFunc(Global.REFRESH_TIMER, self.onTimer, Global.REFRESH_TIMER)
+
+        # redraw only on changes (GLUT has no portable vsync control, so pace with timers)
+        RenderScheduler.install(lambda delay: glut.glutTimerFunc(delay, self.onTimer, 0))
 
         self.buildProgram()
 
@@ -72,21 +80,16 @@ class GLUTDisplay(object):
             self.rotationMatrix *= Transform.xrotate((self.yorigpos - y) * -0.01)
 
         self.xorigpos, self.yorigpos = x, y
+        RenderScheduler.requestRedraw()
 
     def glutMousePressEvent(self, button, state, x, y):
         self.xorigpos, self.yorigpos = x, y
 
     @classmethod
-    def onTimer(cls, t):
+    def onTimer(cls, value):
         """
-        GLUT function to refresh the screen at given interval
-
-        Parameters
-        ----------
-        t : int
-            interval in milliseconds
+        GLUT timer function posting the redraw scheduled by `RenderScheduler`
         """
-        glut.glutTimerFunc(t, cls.onTimer, t)
         glut.glutPostRedisplay()
 
     def display(self):
@@ -97,18 +100,29 @@ class GLUTDisplay(object):
         -----
         `self.render_obj` is being drawn here, initialized in `self.__init__()`
         """
+        RenderScheduler.beginFrame()
+        FrameProfiler.beginFrame()
 
-        gl.glClearColor(*Global.CLEAR_COLOR)
-        gl.glClear(gl.GL_COLOR_BUFFER_BIT | gl.GL_DEPTH_BUFFER_BIT)
-        gl.glEnable(gl.GL_DEPTH_TEST)
+        # a failing frame must not leave the scheduler painting, no redraw would ever be posted
+        try:
+            gl.glClearColor(*Global.CLEAR_COLOR)
+            gl.glClear(gl.GL_COLOR_BUFFER_BIT | gl.GL_DEPTH_BUFFER_BIT)
+            gl.glEnable(gl.GL_DEPTH_TEST)
 
-        self.prepTransformation()
-        self.render_obj.draw()
+            self.prepTransformation()
+            self.render_obj.updateView(self.projection_mat, self.view_mat, self.model_mat, self.viewport_height)
+            self.render_obj.draw()
 
-        gl.glFlush()
+            # before the buffers are swapped
+            self.captureFrame()
 
-        if self.standalone:
-            glut.glutSwapBuffers()
+            gl.glFlush()
+
+            if self.standalone:
+                glut.glutSwapBuffers()
+        finally:
+            FrameProfiler.endFrame()
+            RenderScheduler.endFrame()
 
     def reshape(self, width, height):
         """
@@ -125,8 +139,10 @@ class GLUTDisplay(object):
         If it is not called, the projection frustum is not created.
         """
         gl.glViewport(0, 0, width, height)
+        self.viewport_width, self.viewport_height = width, height
 
         self.projection_mat = Transform.perspective(Global.FOVY, width/height, Global.ZNEAR, Global.ZFAR)
+        RenderScheduler.requestRedraw()
 
     def keyboard(self, key, x, y ):
         """
@@ -134,6 +150,16 @@ class GLUTDisplay(object):
         """
         if key == '\033':    #ESC
             sys.exit( )
+        elif key == 'c':
+            self.setContinuousRendering(not RenderScheduler.continuous)
+        elif key == 'p':
+            self.toggleProfiler()
+        elif key == 'd':
+            self.dumpProfile()
+        elif key == 't':
+            self.toggleTracer()
+        elif key == 'v':
+            self.toggleCapture()
 
     def buildProgram(self):
         """
@@ -162,6 +188,7 @@ class GLUTDisplay(object):
         # setup view matrix
         view_mat = np.array(Transform.lookat(Global.EYE, Global.LOOKAT, Global.UP))
         BufferHelper.sendUniformToShaders('view', view_mat, 'm4')
+        self.view_mat = view_mat
 
         # setup model matrix
         model_mat = np.matrix(np.identity(4, dtype=np.float32))
@@ -176,6 +203,7 @@ class GLUTDisplay(object):
         # transform
         model_mat *= self.translationMatrix
         BufferHelper.sendUniformToShaders('model', model_mat, 'm4')
+        self.model_mat = model_mat
 
     def run(self):
         """
@@ -189,21 +217,77 @@ class GLUTDisplay(object):
 
     def changeScale(self, value):
         self.scale = value * 0.1
+        RenderScheduler.requestRedraw()
 
     def resetRotation(self):
         self.rotationMatrix = np.matrix(np.identity(4, dtype=np.float32))
+        RenderScheduler.requestRedraw()
 
     def resetTranslation(self):
         self.translationMatrix = np.matrix(np.identity(4, dtype=np.float32))
+        RenderScheduler.requestRedraw()
 
     def toggleWireframe(self):
         self.render_obj.toggleWireframe()
+        RenderScheduler.requestRedraw()
+
+    def toggleWireframeOverlay(self):
+        self.render_obj.toggleWireframeOverlay()
+        RenderScheduler.requestRedraw()
 
     def toggleColor(self):
         self.render_obj.toggleColor()
+        RenderScheduler.requestRedraw()
 
     def toggleNormals(self):
         self.render_obj.toggleNormals()
+        RenderScheduler.requestRedraw()
+
+    def setContinuousRendering(self, bool):
+        RenderScheduler.setContinuous(bool)
+
+    def toggleProfiler(self):
+        FrameProfiler.setEnabled(not FrameProfiler.enabled)
+        RenderScheduler.requestRedraw()
+
+    def dumpProfile(self):
+        """
+        Writes the frame times recorded so far as csv and json to `Global.PROFILER_DUMP_LOC`
+        """
+        name = os.path.join(Global.PROFILER_DUMP_LOC, time.strftime('frames-%Y%m%d-%H%M%S'))
+        for extension in ['.csv', '.json']:
+            FrameProfiler.dump(name + extension)
+        print('Frame times written to %s.{csv,json}' % name)
+
+    def toggleTracer(self):
+        """
+        Starts counting GL calls per frame, or stops and prints the counts
+        """
+        if GLTracer.installed:
+            GLTracer.uninstall()
+            print('\n'.join(GLTracer.summary()))
+        else:
+            GLTracer.reset()
+            GLTracer.install(GLUTDisplay)
+            RenderScheduler.requestRedraw()
+
+    def captureFrame(self):
+        """
+        Hands the frame just drawn to `FrameCapture` (reads the back buffer)
+        """
+        FrameCapture.capture()
+
+    def toggleCapture(self):
+        """
+        Starts recording the drawn frames to `Global.CAPTURE_LOC`, or stops and prints what was
+        written (needs the GL context current)
+        """
+        if FrameCapture.active:
+            print(FrameCapture.summary(FrameCapture.stop()))
+        else:
+            FrameCapture.start(os.path.join(Global.CAPTURE_LOC, time.strftime('capture-%Y%m%d-%H%M%S')),
+                               self.viewport_width, self.viewport_height)
+            RenderScheduler.requestRedraw()
 
     def setNormalsShading(self, bool):
         self.render_obj.setNormalsShading(bool)
@@ -214,26 +298,46 @@ class GLUTDisplay(object):
     def setLightsShading(self, bool):
         self.render_obj.setLightsShading(bool)
 
-    def setModel(self, text):
-        switch = {
-            'Box' : Box,
-            'UVSphere' : UVSphere,
-            'UVMobius' : UVMobius,
-            'UVTorus' : UVTorus,
-            'UVKleinBottle' : UVKlein,
-        }
+    builtin_models = {
+        'Box' : Box,
+        'UVSphere' : UVSphere,
+        'UVMobius' : UVMobius,
+        'UVTorus' : UVTorus,
+        'UVKleinBottle' : UVKlein,
+    }
 
+    def releaseModel(self):
+        """
+        Frees the GPU buffers of the current model, before building the next one (models share
+        buffer names)
+        """
+        if getattr(self, 'render_obj', None) is not None:
+            self.render_obj.release()
+            self.render_obj = None
+
+    def setModel(self, text):
         text = str(text)
 
-        if text in switch.keys():
-            self.render_obj = switch[text]()
+        self.releaseModel()
+        if text in self.builtin_models.keys():
+            self.render_obj = self.builtin_models[text]()
         else:
-            self.render_obj = Obj(open(text).read())
+            self.render_obj = Obj(text)
+        RenderScheduler.requestRedraw()
 
 class QTDisplay(QGLWidget, GLUTDisplay):
     """
     PyQt4 OpenGL display class, re-using GLUTDisplay functions
+
+    Notes
+    -----
+    obj models are parsed by a `QTModelLoader` thread while the previous model keeps being drawn;
+    `modelChanged` is emitted once `self.render_obj` is replaced.
     """
+
+    modelChanged = pyqtSignal()
+    loadProgress = pyqtSignal(int)
+
     def __init__(self, parent = None):
         """
         Basic init of widget class
@@ -244,11 +348,14 @@ class QTDisplay(QGLWidget, GLUTDisplay):
         format = self.format()
         format.setSamples(128)
         format.setSampleBuffers(True)
+        format.setSwapInterval(Global.SWAP_INTERVAL)
         self.setFormat(format)
 
         # Let QT deal with swapping buffers
         self.standalone = False
 
+        self.loader = None
+
     def mouseMoveEvent(self, event):
         self.glutMouseMoveEvent(event.pos().x(), event.pos().y())
 
@@ -258,18 +365,104 @@ class QTDisplay(QGLWidget, GLUTDisplay):
     def keyPressEvent(self, event):
         if event.key() == Qt.Key_Control:
             self.ctrlDown = True
+        elif event.key() == Qt.Key_P:
+            self.toggleProfiler()
+        elif event.key() == Qt.Key_D:
+            self.dumpProfile()
+        elif event.key() == Qt.Key_T:
+            self.toggleTracer()
+        elif event.key() == Qt.Key_V:
+            self.makeCurrent()
+            self.toggleCapture()
 
     def keyReleaseEvent(self, event):
         if event.key() == Qt.Key_Control:
             self.ctrlDown = False
 
+    def setModel(self, text):
+        """
+        Switches to model `text`, loading obj files in the background
+
+        Notes
+        -----
+        Picking another model while an obj is loading cancels that load.
+        """
+        text = str(text)
+
+        if self.loader is not None:
+            self.loader.cancel()
+            self.loader = None
+            self.loadProgress.emit(-1)
+
+        if text in self.builtin_models.keys():
+            self.releaseModel()
+            self.render_obj = self.builtin_models[text]()
+            self.modelChanged.emit()
+            return
+
+        if text in Obj.preloaded:
+            # already parsed at startup, only the upload is left
+            self.releaseModel()
+            self.render_obj = Obj(text)
+            self.modelChanged.emit()
+            return
+
+        loader = QTModelLoader(text, Obj.buildArrays, self)
+        loader.progress[int].connect(self.loadProgress)
+        loader.loaded.connect(lambda arrays: self.modelLoaded(loader, arrays))
+        loader.failed[str].connect(lambda message: self.modelFailed(loader, message))
+        loader.finished.connect(loader.deleteLater)
+        self.loader = loader
+        self.loadProgress.emit(0)
+        loader.start()
+
+    def modelLoaded(self, loader, arrays):
+        """
+        Uploads the arrays built by `loader` (runs on the GL thread)
+        """
+        if loader is not self.loader:
+            # superseded by a later setModel
+            return
+        self.loader = None
+        self.loadProgress.emit(-1)
+
+        self.makeCurrent()
+        self.releaseModel()
+        self.render_obj = Obj(loader.path, arrays)
+        self.modelChanged.emit()
+        RenderScheduler.requestRedraw()
+
+    def modelFailed(self, loader, message):
+        if loader is not self.loader:
+            return
+        self.loader = None
+        self.loadProgress.emit(-1)
+        sys.stderr.write('Failed to load model %s\n' % message)
+
     def paintGL(self):
         """
         `paintGL` is called when drawing to the widget is necessary.
-        Simply redirecting to `self.display`, the `GLUTDisplay` function for drawing.
+        Simply redirecting to `self.display`, the `GLUTDisplay` function for drawing; Qt swaps
+        the buffers afterwards.
         """
         self.display()
-        self.swapBuffers()
+
+        if FrameProfiler.enabled and Global.PROFILER_OVERLAY:
+            self.drawProfile()
+
+    def drawProfile(self):
+        """
+        Draws the rolling frame time statistics over the view
+        """
+        # text is drawn by the fixed function pipeline
+        gl.glUseProgram(0)
+        BufferHelper.unbindVertexArray()
+        gl.glColor4f(*Global.WIREFRAME_COLOR)
+        font = QtGui.QFont('Monospace', 9)
+        font.setStyleHint(QtGui.QFont.TypeWriter)
+        for i, line in enumerate(FrameProfiler.summary()):
+            self.renderText(10, 20 + 15 * i, line, font)
+        gl.glUseProgram(ShaderHelper.program)
 
     def initializeGL(self):
         """
@@ -280,9 +473,9 @@ class QTDisplay(QGLWidget, GLUTDisplay):
 
         self.parentWidget().resetUI()
 
-        self.timer = QTimer(self)
-        self.timer.timeout.connect(self.paintGL)
-        self.timer.start(Global.REFRESH_TIMER)
+        # redraw only on changes; update() goes through Qt's paint event, which coalesces them
+        RenderScheduler.install(lambda delay: QTimer.singleShot(delay, self.update),
+                                vsync=self.format().swapInterval() > 0)
 
         self.setFocusPolicy(Qt.ClickFocus)
 
@@ -297,6 +490,15 @@ class QTDisplay(QGLWidget, GLUTDisplay):
 
 
 if __name__ == '__main__':
+    if Global.PRELOAD_MODELS:
+        # before any GL context exists, the pool forks
+        stats = Obj.preload([Global.MODELS_LOC + model for model in os.listdir(Global.MODELS_LOC)
+                             if MeshHelper.isMeshFile(model)])
+        print('Preloaded %d models in %.2f s, %.1f MB mapped' % (
+            stats['models'], stats['seconds'], stats['bytes'] / 2**20))
+        for path, error in stats['errors'].items():
+            sys.stderr.write('Failed to preload %s: %s\n' % (path, error))
+
     if not Global.GLUT_DISPLAY:
         app = QtGui.QApplication(sys.argv)
 
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+
+from __future__ import division
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+
+from configs import Global
+
+class MeshCache(object):
+    """
+    Keeps parsed mesh arrays on disk as .npy files so they can be memory-mapped on later loads
+
+    Notes
+    -----
+    Each entry is a directory in `Global.MESH_CACHE_LOC` named after the source path, mtime,
+    size and `VERSION`, holding one .npy file per array plus a `meta.json`. The modification
+    time of `meta.json` is the entry's last use, which drives the LRU eviction.
+    """
+
+    # bump when the cached arrays change layout
+    VERSION = 9
+
+    @classmethod
+    def entryName(cls, path):
+        """
+        Returns the cache entry name for the current state of the file at `path`
+
+        Parameters
+        ----------
+        path : str
+        """
+        stat = os.stat(path)
+        key = '%d|%s|%r|%d' % (cls.VERSION, os.path.abspath(path), stat.st_mtime, stat.st_size)
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def contentHash(path):
+        """
+        sha1 of the file contents, read `Global.OBJ_CHUNK_SIZE` bytes at a time
+        """
+        sha = hashlib.sha1()
+        with open(path, 'rb') as f:
+            chunk = f.read(Global.OBJ_CHUNK_SIZE)
+            while chunk:
+                sha.update(chunk)
+                chunk = f.read(Global.OBJ_CHUNK_SIZE)
+        return sha.hexdigest()
+
+    @classmethod
+    def entries(cls):
+        """
+        Returns
+        -------
+        dict
+            entry name => meta information of every complete entry in the cache
+        """
+        entries = {}
+        if not os.path.isdir(Global.MESH_CACHE_LOC):
+            return entries
+        for name in os.listdir(Global.MESH_CACHE_LOC):
+            meta_loc = os.path.join(Global.MESH_CACHE_LOC, name, 'meta.json')
+            try:
+                with open(meta_loc) as f:
+                    meta = json.load(f)
+                meta['last_used'] = os.path.getmtime(meta_loc)
+            except (IOError, OSError, ValueError):
+                continue
+            entries[name] = meta
+        return entries
+
+    @classmethod
+    def load(cls, name):
+        """
+        Memory-maps the arrays of entry `name`
+
+        Returns
+        -------
+        dict or None
+            array name => read-only numpy.memmap, or None if the entry is missing
+        """
+        entry_loc = os.path.join(Global.MESH_CACHE_LOC, name)
+        meta_loc = os.path.join(entry_loc, 'meta.json')
+        try:
+            with open(meta_loc) as f:
+                meta = json.load(f)
+            arrays = dict((array, np.load(os.path.join(entry_loc, array + '.npy'), mmap_mode='r'))
+                          for array in meta['arrays'])
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+
+        # mark as recently used
+        os.utime(meta_loc, None)
+        return arrays
+
+    @classmethod
+    def store(cls, name, path, content_hash, arrays):
+        """
+        Saves `arrays` as entry `name`, replacing stale entries of `path`
+
+        Parameters
+        ----------
+        name : str
+            from `entryName`
+        path : str
+            source file
+        content_hash : str
+        arrays : dict
+            array name => numpy.array
+        """
+        if not os.path.isdir(Global.MESH_CACHE_LOC):
+            os.makedirs(Global.MESH_CACHE_LOC)
+
+        # write everything to a temporary directory first so readers never see half an entry
+        tmp_loc = tempfile.mkdtemp(dir=Global.MESH_CACHE_LOC, prefix='.tmp')
+        size = 0
+        for array, data in arrays.items():
+            np.save(os.path.join(tmp_loc, array + '.npy'), data)
+            size += data.nbytes
+        meta = {
+            'version': cls.VERSION,
+            'path': os.path.abspath(path),
+            'hash': content_hash,
+            'bytes': size,
+            'arrays': sorted(arrays.keys()),
+        }
+        with open(os.path.join(tmp_loc, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+        entry_loc = os.path.join(Global.MESH_CACHE_LOC, name)
+        try:
+            os.rename(tmp_loc, entry_loc)
+        except OSError:
+            # somebody else stored the same entry in the meantime
+            shutil.rmtree(tmp_loc, ignore_errors=True)
+
+        for other, meta in cls.entries().items():
+            if other != name and meta['path'] == os.path.abspath(path):
+                cls.remove(other)
+
+        cls.evict(keep=name)
+
+    @staticmethod
+    def remove(name):
+        shutil.rmtree(os.path.join(Global.MESH_CACHE_LOC, name), ignore_errors=True)
+
+    @classmethod
+    def evict(cls, max_bytes = None, keep = None):
+        """
+        Removes least recently used entries until the cache fits in `max_bytes`
+
+        Parameters
+        ----------
+        max_bytes : int
+            defaults to `Global.MESH_CACHE_MAX_BYTES`
+        keep : str
+            entry which is never evicted (i.e. the one just stored)
+        """
+        if max_bytes is None:
+            max_bytes = Global.MESH_CACHE_MAX_BYTES
+
+        entries = cls.entries()
+        total = sum(meta['bytes'] for meta in entries.values())
+        for name in sorted(entries, key=lambda name: entries[name]['last_used']):
+            if total <= max_bytes:
+                break
+            if name == keep:
+                continue
+            cls.remove(name)
+            total -= entries[name]['bytes']
+
+    @classmethod
+    def fetch(cls, path, build, return_entry = False):
+        """
+        Returns the mesh arrays of `path`, building and caching them on a miss
+
+        Parameters
+        ----------
+        path : str
+        build : callable
+            `build(path)` returns a dict of array name => numpy.array
+        return_entry : bool
+            also return the name of the cache entry holding the arrays
+
+        Returns
+        -------
+        dict
+            array name => numpy.array (memory-mapped when coming from the cache), and the entry
+            name if `return_entry`, None when the arrays are not in the cache (disabled or not
+            writable)
+        """
+        arrays, name = cls._fetch(path, build)
+        if return_entry:
+            return arrays, name
+        return arrays
+
+    @classmethod
+    def _fetch(cls, path, build):
+        if not Global.MESH_CACHE_ENABLED:
+            return build(path), None
+
+        name = cls.entryName(path)
+        arrays = cls.load(name)
+        if arrays is not None:
+            return arrays, name
+
+        # the file may only have been touched or copied: look for the same contents
+        content_hash = cls.contentHash(path)
+        arrays = None
+        for other, meta in cls.entries().items():
+            if meta.get('version') == cls.VERSION and meta.get('hash') == content_hash:
+                arrays = cls.load(other)
+                if arrays is not None:
+                    break
+
+        if arrays is None:
+            arrays = build(path)
+        try:
+            cls.store(name, path, content_hash, arrays)
+        except (IOError, OSError):
+            # cache location not writable, just use the arrays we have
+            return arrays, None
+        stored = cls.load(name)
+        if stored is None:
+            return arrays, None
+        return stored, name
@@ -0,0 +1,1632 @@
+#!/usr/bin/env python
+
+from __future__ import division
+import os
+import numpy as np
+
+from configs import Global
+
+# byte values used while tokenising
+_NEWLINE = ord('\n')
+_CARRIAGE = ord('\r')
+_SPACE = ord(' ')
+_TAB = ord('\t')
+_SLASH = ord('/')
+
+# obj record runs copied as slices, past this many they are gathered through a byte mask
+_GATHER_RUNS = 4096
+
+# PLY property types => numpy type codes
+_PLY_TYPES = {
+    'char': 'i1', 'int8': 'i1', 'uchar': 'u1', 'uint8': 'u1',
+    'short': 'i2', 'int16': 'i2', 'ushort': 'u2', 'uint16': 'u2',
+    'int': 'i4', 'int32': 'i4', 'uint': 'u4', 'uint32': 'u4',
+    'float': 'f4', 'float32': 'f4', 'double': 'f8', 'float64': 'f8',
+}
+
+# progress reports per python loop over a mesh (each may cancel the load)
+_PROGRESS_STEPS = 100
+
+# mixed size ply faces are followed 2**_PLY_STRIDE_BITS records at a time
+_PLY_STRIDE_BITS = 5
+_PLY_STRIDE = 2**_PLY_STRIDE_BITS
+
+# binary STL triangle record: facet normal, 3 corners, attribute byte count
+_STL_TRIANGLE = np.dtype([('normal', '<f4', 3), ('corners', '<f4', (3, 3)), ('attributes', '<u2')])
+
+class LoadCancelled(Exception):
+    """Raised from a progress callback to abandon loading a mesh"""
+    pass
+
+
+class GrowableArray(object):
+    """Numpy array which can be appended to, doubling its storage when full"""
+
+    def __init__(self, dtype, width = None, capacity = 1024):
+        """
+        Parameters
+        ----------
+        dtype : numpy.dtype
+        width : int
+            number of columns, or None for a flat array
+        capacity : int
+            initial number of rows
+        """
+        shape = (capacity,) if width is None else (capacity, width)
+        self.data = np.empty(shape, dtype=dtype)
+        self.size = 0
+
+    def extend(self, values):
+        """
+        Appends the rows of `values`
+        """
+        needed = self.size + len(values)
+        if needed > len(self.data):
+            capacity = max(needed, 2 * len(self.data))
+            data = np.empty((capacity,) + self.data.shape[1:], dtype=self.data.dtype)
+            data[:self.size] = self.data[:self.size]
+            self.data = data
+        self.data[self.size:needed] = values
+        self.size = needed
+
+    def array(self):
+        """
+        Returns the filled part of the storage (not a copy)
+        """
+        return self.data[:self.size]
+
+
+class MeshHelper(object):
+    """Parses mesh files into numpy arrays ready for the GPU"""
+
+    @staticmethod
+    def _lineBounds(buf):
+        """
+        Finds the first and one-past-last byte of every line
+
+        Parameters
+        ----------
+        buf : numpy.array
+            uint8 view of the file
+
+        Returns
+        -------
+        (numpy.array, numpy.array)
+            line starts and line ends (the index of the newline byte)
+        """
+        newlines = np.flatnonzero(buf == _NEWLINE)
+        starts = np.concatenate(([0], newlines + 1))
+        ends = np.concatenate((newlines, [len(buf)]))
+        return starts, ends
+
+    @staticmethod
+    def _selectLines(buf, starts, tag):
+        """
+        Returns a boolean mask of the lines beginning with `tag` followed by whitespace
+
+        Parameters
+        ----------
+        buf : numpy.array
+            padded by `_parseChunk`, so the bytes after the last line start can be read
+        starts : numpy.array
+            line starts from `_lineBounds`
+        tag : str
+            record type, i.e. 'v', 'vn' or 'f'
+        """
+        tag = bytearray(tag.encode('ascii') if not isinstance(tag, bytes) else tag)
+
+        mask = buf[starts] == tag[0]
+        for i, char in enumerate(tag[1:], 1):
+            mask &= buf[starts + i] == char
+        after = buf[starts + len(tag)]
+        mask &= (after == _SPACE) | (after == _TAB)
+        return mask
+
+    @staticmethod
+    def _gatherLines(buf, sel, starts, ends):
+        """
+        Copies the selected lines out of `buf`, one after another, newlines included
+
+        Notes
+        -----
+        Consecutive lines are one range of bytes, and records of a type mostly come in long
+        runs, so only a few slices are copied. Files interleaving record types go through a
+        mask of the selected bytes instead.
+        """
+        first, last = starts[sel], ends[sel]
+        breaks = np.flatnonzero(first[1:] != last[:-1] + 1) + 1
+        if len(breaks) < _GATHER_RUNS:
+            run_starts = first[np.concatenate(([0], breaks))]
+            run_ends = last[np.concatenate((breaks - 1, [len(last) - 1]))] + 1
+            return np.concatenate([buf[start:end] for start, end in zip(run_starts, run_ends)])
+
+        keep = np.repeat(sel, ends - starts + 1)
+        return buf[:len(keep)][keep]
+
+    @classmethod
+    def _tokenise(cls, buf, sel, starts, ends, skip, dtype, slashes=False):
+        """
+        Converts the bodies of the selected lines into one flat array of numbers
+
+        Parameters
+        ----------
+        buf : numpy.array
+            padded by `_parseChunk`, so the last line ends with a newline too
+        sel : numpy.array
+            boolean mask of the lines to convert (from `_selectLines`)
+        starts : numpy.array
+        ends : numpy.array
+            line bounds from `_lineBounds`
+        skip : int
+            number of leading bytes (the record tag) to drop from each line
+        dtype : numpy.dtype
+        slashes : bool
+            if True, '/' separators (face records) are treated as whitespace
+
+        Returns
+        -------
+        (numpy.array, numpy.array, (int, bool))
+            flat values, number of whitespace separated tokens per line and, when
+            `slashes` is set, the number of '/' found and whether any '//' was found
+
+        Notes
+        -----
+        Everything here is done on whole byte arrays; no python object is created per line
+        or per token.
+        """
+        if not np.any(sel):
+            return np.zeros(0, dtype=dtype), np.zeros(0, dtype=np.int32), (0, False)
+
+        # the selected lines, newlines included as separators
+        body = cls._gatherLines(buf, sel, starts, ends)
+        lengths = ends[sel] - starts[sel] + 1
+        body_starts = np.cumsum(lengths) - lengths
+
+        # blank out the record tags
+        for i in range(skip):
+            body[body_starts + i] = _SPACE
+
+        # count tokens per line (a token starts on a non-space following a space; every
+        # line starts on a blanked tag byte, so tokens never straddle two lines)
+        space = body <= _SPACE
+        token_start = ~space
+        token_start[1:] &= space[:-1]
+        counts = np.add.reduceat(token_start, body_starts, dtype=np.int32)
+
+        info = (0, False)
+        if slashes:
+            slash = body == _SLASH
+            info = (np.count_nonzero(slash), bool(np.any(slash[1:] & slash[:-1])))
+            body[slash] = _SPACE
+
+        # the ' ' separator matches any run of whitespace, tabs and carriage returns included
+        text = body.tobytes() if hasattr(body, 'tobytes') else body.tostring()
+        return np.fromstring(text, dtype=dtype, sep=' '), counts, info
+
+    @staticmethod
+    def _firstColumns(values, counts, width):
+        """
+        Takes the first `width` values of each variable length record
+        """
+        if len(counts) and np.all(counts == width):
+            return values.reshape(-1, width)
+        if len(counts) and counts.min() < width:
+            raise ValueError("mesh record with fewer than %d values" % width)
+        offsets = np.cumsum(counts) - counts
+        return values[offsets[:, None] + np.arange(width)]
+
+    @classmethod
+    def _parseChunk(cls, data):
+        """
+        Parses the `v`, `vn` and `f` records found in `data`
+
+        Parameters
+        ----------
+        data : str
+            whole lines of an obj file
+
+        Returns
+        -------
+        dict
+            same as `parseObj`, except 'face_normals' is only None when the faces carry
+            no normal index (i.e. even if no `vn` line was in `data`)
+        """
+        buf = np.frombuffer(data, dtype=np.uint8)
+        starts, ends = cls._lineBounds(buf)
+        # the one copy of the chunk shared by every record type: a newline closes the last
+        # line, and the tags of the longest record ('vn') can be tested on an empty last line
+        buf = np.concatenate((buf, np.array([_NEWLINE, 0, 0], dtype=np.uint8)))
+
+        # vertices
+        sel = cls._selectLines(buf, starts, 'v')
+        values, counts, _ = cls._tokenise(buf, sel, starts, ends, 1, np.float32)
+        vertices = cls._firstColumns(values, counts, 3)
+
+        # vertex normals
+        sel = cls._selectLines(buf, starts, 'vn')
+        values, counts, _ = cls._tokenise(buf, sel, starts, ends, 2, np.float32)
+        normals = cls._firstColumns(values, counts, 3)
+
+        # faces
+        sel = cls._selectLines(buf, starts, 'f')
+        values, faces_v_num, (slashes, double) = cls._tokenise(buf, sel, starts, ends, 1, np.int64, slashes=True)
+        corners = faces_v_num.sum()
+
+        face_normals = None
+        if corners:
+            if slashes % corners:
+                raise ValueError("obj faces mix corner formats")
+            slashes //= corners
+            # v => 1 field, v/t => 2, v/t/n => 3, v//n => 2
+            fields = {0: 1, 1: 2, 2: 3}[slashes]
+            if slashes == 2 and double:
+                fields = 2
+            if len(values) != corners * fields:
+                raise ValueError("obj faces mix corner formats")
+
+            values = values.reshape(-1, fields) - 1
+            face_vertices = values[:, 0].astype(np.int32)
+            if slashes == 2:
+                face_normals = values[:, -1].astype(np.int32)
+        else:
+            face_vertices = np.zeros(0, dtype=np.int32)
+
+        return {
+            'vertices': vertices.astype(np.float32),
+            'normals': normals.astype(np.float32),
+            'face_vertices': face_vertices,
+            'face_normals': face_normals,
+            'faces_v_num': faces_v_num.astype(np.int32),
+        }
+
+    @classmethod
+    def parseObj(cls, data):
+        """
+        Parses the `v`, `vn` and `f` records of an obj file
+
+        Parameters
+        ----------
+        data : str
+            contents of the obj file
+
+        Returns
+        -------
+        dict
+            'vertices' : numpy.array
+                (N, 3) float32 positions
+            'normals' : numpy.array
+                (M, 3) float32 normals (M may be 0)
+            'face_vertices' : numpy.array
+                zero-based position index of every face corner, faces one after another
+            'face_normals' : numpy.array or None
+                zero-based normal index of every face corner
+            'faces_v_num' : numpy.array
+                number of corners of each face
+
+            Loaders of formats with vertex colors (see `loadPly`) add (N, 4) uint8 'colors'.
+
+        Notes
+        -----
+        All faces are assumed to use the same corner format (`v`, `v/t`, `v/t/n` or `v//n`).
+        Negative (relative) indices are not supported, same as before.
+        """
+        mesh = cls._parseChunk(data)
+        if not len(mesh['normals']):
+            mesh['face_normals'] = None
+        return mesh
+
+    @classmethod
+    def loadObj(cls, path, chunk_size = Global.OBJ_CHUNK_SIZE, progress = None):
+        """
+        Streams an obj file from disk, `chunk_size` bytes at a time
+
+        Parameters
+        ----------
+        path : str
+        chunk_size : int
+            number of bytes parsed at once
+        progress : callable
+            called with the fraction of the file parsed so far after every chunk; it may raise
+            `LoadCancelled` to stop loading
+
+        Returns
+        -------
+        dict
+            see `parseObj`
+
+        Notes
+        -----
+        Only one chunk of text is held in memory at a time; the parsed records are appended to
+        `GrowableArray`s, so the peak memory is about the size of the arrays themselves.
+        """
+        storage = {
+            'vertices': GrowableArray(np.float32, 3),
+            'normals': GrowableArray(np.float32, 3),
+            'face_vertices': GrowableArray(np.int32),
+            'face_normals': GrowableArray(np.int32),
+            'faces_v_num': GrowableArray(np.int32),
+        }
+        has_face_normals = None
+        total = max(os.path.getsize(path), 1)
+
+        with open(path, 'rb') as f:
+            remainder = b''
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    data = remainder
+                else:
+                    # only parse whole lines, keep the rest for the next chunk
+                    cut = chunk.rfind(b'\n') + 1
+                    if not cut:
+                        remainder += chunk
+                        continue
+                    data = remainder + chunk[:cut]
+                    remainder = chunk[cut:]
+
+                mesh = cls._parseChunk(data)
+                if len(mesh['faces_v_num']):
+                    if has_face_normals is None:
+                        has_face_normals = mesh['face_normals'] is not None
+                    elif has_face_normals != (mesh['face_normals'] is not None):
+                        raise ValueError("obj faces mix corner formats")
+                for name, array in storage.items():
+                    if mesh[name] is not None:
+                        array.extend(mesh[name])
+                del mesh, data
+
+                if not chunk:
+                    break
+                if progress is not None:
+                    progress(f.tell() / total)
+
+        mesh = dict((name, array.array()) for name, array in storage.items())
+        if not has_face_normals or not len(mesh['normals']):
+            mesh['face_normals'] = None
+        return mesh
+
+    @staticmethod
+    def _plyHeader(buf):
+        """
+        Parses the header of a binary PLY file
+
+        Parameters
+        ----------
+        buf : numpy.array
+            uint8 contents of the file
+
+        Returns
+        -------
+        (int, str, list)
+            offset of the data, byte order ('<' or '>') and the elements as
+            [name, count, [(property, type code, list count type code or None)...]]
+        """
+        end = buf[:2**16].tobytes().find(b'end_header')
+        if end < 0 or buf[:3].tobytes() != b'ply':
+            raise ValueError("not a ply file")
+        header = buf[:end].tobytes().decode('ascii').split('\n')
+        offset = end + len(b'end_header')
+        offset += 2 if buf[offset] == _CARRIAGE else 1
+
+        order = None
+        elements = []
+        for line in header:
+            words = line.split()
+            if not words:
+                continue
+            if words[0] == 'format':
+                if words[1] == 'ascii':
+                    raise ValueError("ascii ply files are not supported")
+                order = '<' if words[1] == 'binary_little_endian' else '>'
+            elif words[0] == 'element':
+                elements.append([words[1], int(words[2]), []])
+            elif words[0] == 'property':
+                if words[1] == 'list':
+                    elements[-1][2].append((words[4], _PLY_TYPES[words[3]], _PLY_TYPES[words[2]]))
+                else:
+                    elements[-1][2].append((words[2], _PLY_TYPES[words[1]], None))
+        return offset, order, elements
+
+    @staticmethod
+    def _plyValues(buf, positions, code):
+        """
+        Values of numpy type `code` (with byte order) stored at the byte `positions` of `buf`,
+        which need not be aligned
+        """
+        size = np.dtype(code).itemsize
+        if size == 1:
+            return buf[positions].view(code)
+        return np.ascontiguousarray(buf[positions[:, None] + np.arange(size)]).view(code).reshape(-1)
+
+    @classmethod
+    def _plyRecords(cls, buf, offset, window, order, layout, limit):
+        """
+        Finds the face records of mixed sizes starting at `offset`
+
+        Parameters
+        ----------
+        window : int
+            bytes looked at
+        layout : tuple
+            (count offset, count type code, bytes of the other fixed size properties, index size)
+            of the face records
+        limit : int
+            faces left in the element
+
+        Returns
+        -------
+        (numpy.array, numpy.array)
+            byte offsets in `buf` and corner counts of the records lying entirely in the window,
+            at most `limit` of them
+
+        Notes
+        -----
+        The start of a record depends on the corner count of the one before it. The count is read
+        at every byte of the window as if a record started there, which gives the following
+        record start for every byte. Squaring that table a few times gives the start
+        `_PLY_STRIDE` records further, so the chain from `offset` is followed `_PLY_STRIDE`
+        records per step.
+        """
+        count_offset, count_code, fixed, index_size = layout
+        count_size = np.dtype(count_code).itemsize
+        window = min(window, len(buf) - offset)
+
+        # count of a record starting at every byte, each byte of the counts read as one slice
+        counts = np.zeros(window, dtype=np.int64)
+        readable = max(window - count_offset - count_size + 1, 0)
+        base = offset + count_offset
+        columns = [buf[base + i:base + i + readable] for i in range(count_size)]
+        counts[:readable] = np.column_stack(columns).view(order + count_code).reshape(-1)
+
+        # records running past the window lead to the end of the window, which leads to itself
+        jump = np.empty(window + 1, dtype=np.int64)
+        jump[:window] = np.arange(fixed + count_size, window + fixed + count_size)
+        jump[:window] += np.maximum(counts, 0) * index_size
+        complete = jump[:window] <= window
+        np.minimum(jump, window, out=jump)
+        jump[window] = window
+
+        # the first records one at a time, then `_PLY_STRIDE` records at a time
+        stride = jump
+        for _ in range(_PLY_STRIDE_BITS):
+            stride = stride[stride]
+        rows = [np.zeros(_PLY_STRIDE, dtype=np.int64)]
+        for i in range(1, _PLY_STRIDE):
+            rows[0][i] = jump[rows[0][i - 1]]
+        while rows[-1][-1] < window and len(rows) * _PLY_STRIDE < limit:
+            rows.append(stride[rows[-1]])
+        positions = np.concatenate(rows)[:limit]
+
+        # the chain only moves forward, so the complete records come first
+        positions = positions[positions < window]
+        positions = positions[:np.count_nonzero(complete[positions])]
+        return offset + positions, counts[positions]
+
+    @classmethod
+    def _plyFaces(cls, buf, offset, order, count, properties):
+        """
+        Reads the face element of a binary PLY file
+
+        Returns
+        -------
+        (numpy.array, numpy.array, int)
+            face_vertices, faces_v_num and the offset right after the element
+
+        Notes
+        -----
+        Consecutive faces with the same number of corners are viewed in place as fixed-size
+        records, so a mesh of one face size is read in a single step. The number of records
+        looked at grows while the size stays the same and shrinks when it changes. Where the size
+        keeps changing (i.e. interleaved triangles and quads), `Global.PLY_FACE_WINDOW` bytes of
+        faces are decoded at once by `_plyRecords` instead.
+        """
+        lists = [p for p in properties if p[2] is not None]
+        if len(lists) != 1 or lists[0][0] not in ('vertex_indices', 'vertex_index'):
+            raise ValueError("ply faces need exactly one vertex index list")
+        index_name, index_code, count_code = lists[0]
+        count_offset = 0
+        for name, code, _ in properties[:properties.index(lists[0])]:
+            count_offset += np.dtype(code).itemsize
+        fixed = sum(np.dtype(code).itemsize for name, code, list_code in properties if list_code is None)
+        index_size = np.dtype(index_code).itemsize
+        count_size = np.dtype(count_code).itemsize
+        layout = (count_offset, count_code, fixed, index_size)
+
+        face_vertices = GrowableArray(np.int32)
+        faces_v_num = GrowableArray(np.int32)
+        done = 0
+        window = 1024
+        while done < count:
+            start = offset + count_offset
+            if start + count_size > len(buf):
+                raise ValueError("ply file is truncated")
+            corners = int(buf[start:start + count_size].view(order + count_code)[0])
+            fields = []
+            for name, code, list_code in properties:
+                if list_code is None:
+                    fields.append((name, order + code))
+                else:
+                    fields.append(('corners', order + list_code))
+                    fields.append((name, order + code, corners))
+            record = np.dtype(fields)
+
+            size = min(count - done, window, (len(buf) - offset) // record.itemsize)
+            if size <= 0:
+                raise ValueError("ply file is truncated")
+            faces = buf[offset:offset + size * record.itemsize].view(record)
+            changed = np.flatnonzero(faces['corners'] != corners)
+            run = changed[0] if len(changed) else size
+
+            if run == size or run >= Global.PLY_MIN_RUN:
+                face_vertices.extend(faces[index_name][:run].reshape(-1))
+                faces_v_num.extend(np.full(run, corners, dtype=np.int32))
+                offset += run * record.itemsize
+                done += run
+                window = 2 * window if run == size else max(2 * run, 16)
+                continue
+
+            # short runs: decode a whole window of mixed sizes
+            mixed_window = Global.PLY_FACE_WINDOW
+            starts, sizes = cls._plyRecords(buf, offset, mixed_window, order, layout, count - done)
+            while not len(starts):
+                if offset + mixed_window >= len(buf):
+                    raise ValueError("ply file is truncated")
+                # a single face larger than the window
+                mixed_window *= 2
+                starts, sizes = cls._plyRecords(buf, offset, mixed_window, order, layout, count - done)
+
+            first = np.repeat(starts + count_offset + count_size - index_size * (np.cumsum(sizes) - sizes), sizes)
+            face_vertices.extend(cls._plyValues(buf, first + index_size * np.arange(len(first)),
+                                                order + index_code))
+            faces_v_num.extend(sizes)
+            offset = int(starts[-1] + fixed + count_size + sizes[-1] * index_size)
+            done += len(starts)
+            window = 16
+        return face_vertices.array(), faces_v_num.array(), offset
+
+    @staticmethod
+    def _plyColors(block):
+        """
+        (N, 4) uint8 colors from the `red green blue [alpha]` properties of a vertex block
+        """
+        channels = [block[channel] for channel in ('red', 'green', 'blue')]
+        channels.append(block['alpha'] if 'alpha' in block.dtype.names else np.full(len(block), 255, dtype=np.uint8))
+        colors = np.column_stack(channels)
+        if colors.dtype.kind == 'f':
+            colors = np.round(np.clip(colors, 0, 1) * 255)
+        return colors.astype(np.uint8)
+
+    @classmethod
+    def loadPly(cls, path, progress = None):
+        """
+        Loads a binary PLY file
+
+        Parameters
+        ----------
+        path : str
+        progress : callable
+            see `loadObj`
+
+        Returns
+        -------
+        dict
+            see `parseObj`; 'face_normals' indexes the per vertex `nx ny nz` properties if any,
+            and (N, 4) uint8 'colors' are added when the vertices have `red green blue` properties
+
+        Notes
+        -----
+        The file is memory-mapped and the vertex and face blocks are viewed in place as numpy
+        records, only the columns in use are copied out.
+        """
+        buf = np.memmap(path, dtype=np.uint8, mode='r')
+        offset, order, elements = cls._plyHeader(buf)
+
+        mesh = None
+        face_vertices = faces_v_num = None
+        for name, count, properties in elements:
+            if name == 'face':
+                face_vertices, faces_v_num, offset = cls._plyFaces(buf, offset, order, count, properties)
+                continue
+            if any(p[2] is not None for p in properties):
+                raise ValueError("ply list properties are only supported on faces")
+
+            record = np.dtype([(p[0], order + p[1]) for p in properties])
+            block = buf[offset:offset + count * record.itemsize].view(record)
+            offset += count * record.itemsize
+            if name == 'vertex':
+                mesh = {
+                    'vertices': np.column_stack([block[axis] for axis in 'xyz']).astype(np.float32),
+                    'normals': np.zeros((0, 3), dtype=np.float32),
+                }
+                if 'nx' in record.names:
+                    mesh['normals'] = np.column_stack([block[axis] for axis in ('nx', 'ny', 'nz')]).astype(np.float32)
+                if 'red' in record.names:
+                    mesh['colors'] = cls._plyColors(block)
+        del buf
+
+        if mesh is None or face_vertices is None:
+            raise ValueError("ply file without vertex or face element")
+        mesh['face_vertices'] = face_vertices
+        mesh['faces_v_num'] = faces_v_num
+        mesh['face_normals'] = face_vertices if len(mesh['normals']) else None
+        if progress is not None:
+            progress(1.0)
+        return mesh
+
+    @staticmethod
+    def loadStl(path, progress = None):
+        """
+        Loads a binary STL file
+
+        Parameters
+        ----------
+        path : str
+        progress : callable
+            see `loadObj`
+
+        Returns
+        -------
+        dict
+            see `parseObj`; 'face_normals' is always None, facet normals are ignored so that
+            smooth normals get generated
+
+        Notes
+        -----
+        The triangle records are viewed in place from a memory map. STL has no shared vertices,
+        corners with identical positions are merged here so that welding works as for obj.
+        """
+        buf = np.memmap(path, dtype=np.uint8, mode='r')
+        if len(buf) < 84:
+            raise ValueError("not a binary stl file")
+        count = int(buf[80:84].view('<u4')[0])
+        if len(buf) != 84 + count * _STL_TRIANGLE.itemsize:
+            raise ValueError("not a binary stl file (ascii stl is not supported)")
+
+        corners = buf[84:].view(_STL_TRIANGLE)['corners'].reshape(-1, 3)
+        rows = np.ascontiguousarray(corners, dtype=np.float32)
+        del corners, buf
+
+        # merge identical positions (compared bitwise)
+        keys = rows.view(np.dtype((np.void, rows.dtype.itemsize * 3))).reshape(-1)
+        _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+
+        if progress is not None:
+            progress(1.0)
+        return {
+            'vertices': rows[first],
+            'normals': np.zeros((0, 3), dtype=np.float32),
+            'face_vertices': inverse.reshape(-1).astype(np.int32),
+            'face_normals': None,
+            'faces_v_num': np.full(count, 3, dtype=np.int32),
+        }
+
+    @classmethod
+    def loadMesh(cls, path, progress = None):
+        """
+        Loads an obj, binary ply or binary stl file, chosen by the extension of `path`
+
+        Parameters
+        ----------
+        path : str
+        progress : callable
+            see `loadObj`
+
+        Returns
+        -------
+        dict
+            see `parseObj`
+        """
+        loaders = {
+            '.obj': cls.loadObj,
+            '.ply': cls.loadPly,
+            '.stl': cls.loadStl,
+        }
+        extension = os.path.splitext(path)[1].lower()
+        if extension not in loaders:
+            raise ValueError("unknown mesh format '%s'" % extension)
+        return loaders[extension](path, progress=progress)
+
+    mesh_extensions = ('.obj', '.ply', '.stl')
+
+    @classmethod
+    def isMeshFile(cls, path):
+        """
+        Whether `loadMesh` can load `path`, judging by its extension
+        """
+        return os.path.splitext(path)[1].lower() in cls.mesh_extensions
+
+    @staticmethod
+    def expandFaces(mesh):
+        """
+        Expands a parsed mesh into the per-face-corner layout drawn with `glMultiDrawArrays`
+
+        Parameters
+        ----------
+        mesh : dict
+            output of `parseObj`
+
+        Returns
+        -------
+        (numpy.array, numpy.array, numpy.array, numpy.array)
+            vertices (2C, 4), normals (2C, 3), faces_v_num, faces_v_start
+
+        Notes
+        -----
+        Every corner is stored twice, once with w=1 and once with w=0 (used to draw normals).
+        """
+        corners = len(mesh['face_vertices'])
+
+        # gather one column at a time to keep temporaries small
+        vertices = np.empty((2 * corners, 4), dtype=np.float32)
+        normals = np.zeros((2 * corners, 3), dtype=np.float32)
+        for i in range(3):
+            vertices[0::2, i] = mesh['vertices'][:, i][mesh['face_vertices']]
+            if mesh['face_normals'] is not None:
+                normals[0::2, i] = mesh['normals'][:, i][mesh['face_normals']]
+        vertices[0::2, 3] = 1.0
+        vertices[1::2, :3] = vertices[0::2, :3]
+        vertices[1::2, 3] = 0.0
+        normals[1::2] = normals[0::2]
+
+        faces_v_num = 2 * mesh['faces_v_num']
+        faces_v_start = np.concatenate(([0], np.cumsum(faces_v_num)))
+
+        return vertices, normals, faces_v_num, faces_v_start
+
+    @staticmethod
+    def _fanTriangles(faces_v_num):
+        """
+        Fan triangulation of polygons given by their corner counts
+
+        Returns
+        -------
+        (numpy.array, numpy.array)
+            face of every triangle, and (T, 3) corner indices (s, s+j, s+j+1) for j in 1..k-2
+            of a face of k corners starting at corner s
+        """
+        faces_v_num = faces_v_num.astype(np.int64)
+        faces_start = np.cumsum(faces_v_num) - faces_v_num
+        tri_num = np.maximum(faces_v_num - 2, 0)
+        tri_face = np.repeat(np.arange(len(faces_v_num)), tri_num)
+        j = np.arange(tri_num.sum()) - np.repeat(np.cumsum(tri_num) - tri_num, tri_num) + 1
+        s = faces_start[tri_face]
+        return tri_face, np.column_stack((s, s + j, s + j + 1))
+
+    @staticmethod
+    def _cornerNeighbours(faces_v_num):
+        """
+        Returns
+        -------
+        (numpy.array, numpy.array)
+            for every corner, the next and the previous corner of the same face
+        """
+        faces_v_num = faces_v_num.astype(np.int32)
+        faces_start = (np.cumsum(faces_v_num, dtype=np.int32) - faces_v_num)[faces_v_num > 0]
+        faces_end = np.cumsum(faces_v_num, dtype=np.int32)[faces_v_num > 0] - 1
+        corners = faces_v_num.sum()
+
+        following = np.arange(1, corners + 1, dtype=np.int32)
+        following[faces_end] = faces_start
+        preceding = np.arange(-1, corners - 1, dtype=np.int32)
+        preceding[faces_start] = faces_end
+        return following, preceding
+
+    @staticmethod
+    def uniqueEdges(faces_v_num, corner_vertex, keys = None):
+        """
+        Returns the outline edges of the faces, each edge only once
+
+        Parameters
+        ----------
+        faces_v_num : numpy.array
+            number of corners of every face
+        corner_vertex : numpy.array
+            vertex of every corner, faces one after another
+        keys : numpy.array
+            per vertex, vertices with the same key are the same point (i.e. the position a
+            welded vertex comes from); defaults to the vertex itself
+
+        Returns
+        -------
+        numpy.array
+            uint32 pairs of vertices, drawn as `GL_LINES` in one call
+
+        Notes
+        -----
+        Edges shared by two faces, or split between vertices which only differ by their normal,
+        would otherwise be rasterized twice. Pairs of keys are sorted and deduplicated with
+        `numpy.unique`, keeping the first occurrence of every edge.
+        """
+        corner_vertex = np.asarray(corner_vertex)
+        following, preceding = MeshHelper._cornerNeighbours(faces_v_num)
+        edges = np.column_stack((corner_vertex, corner_vertex[following]))
+        if not len(edges):
+            return np.zeros(0, dtype=np.uint32)
+
+        ends = edges if keys is None else np.asarray(keys)[edges]
+        ends = np.sort(ends.astype(np.int64), axis=1)
+        count = ends.max() + 1
+        _, first = np.unique(ends[:, 0] * count + ends[:, 1], return_index=True)
+        first = np.sort(first[ends[first, 0] != ends[first, 1]])
+        return edges[first].reshape(-1).astype(np.uint32)
+
+    @staticmethod
+    def uvGrid(U, V):
+        """
+        Builds the faces of a `U` x `V` parameter grid over [0, 1]^2
+
+        Returns
+        -------
+        dict
+            'corners' : numpy.array
+                (4F, 4) float32 (u, v, 0, 1) corners of the F = U*V quads, u major
+            'faces_v_start', 'faces_v_num' : numpy.array
+                first corner and corner count of every face, for `glMultiDrawArrays`
+            'edges' : numpy.array
+                uint32 pairs of corners of the distinct grid edges (see `uniqueEdges`)
+        """
+        u, v = np.meshgrid(np.arange(U), np.arange(V), indexing='ij')
+        grid_u = u.reshape(-1, 1) + np.array([0, 0, 1, 1])
+        grid_v = v.reshape(-1, 1) + np.array([0, 1, 1, 0])
+
+        corners = np.zeros((grid_u.size, 4), dtype=np.float32)
+        corners[:, 0] = grid_u.reshape(-1) / U
+        corners[:, 1] = grid_v.reshape(-1) / V
+        corners[:, 3] = 1.0
+
+        faces_v_num = np.full(U * V, 4, dtype=np.int32)
+        return {
+            'corners': corners,
+            'faces_v_start': np.arange(0, 4 * U * V, 4, dtype=np.int32),
+            'faces_v_num': faces_v_num,
+            # corners on the same grid point are the same vertex
+            'edges': MeshHelper.uniqueEdges(faces_v_num, np.arange(len(corners)),
+                                            (grid_u * (V + 1) + grid_v).reshape(-1)),
+        }
+
+    @staticmethod
+    def _normalize(vectors):
+        """
+        Normalizes the columns of a (3, N) array in place, leaving zero columns alone
+        """
+        length = np.sqrt(np.einsum('ij,ij->j', vectors, vectors))
+        length[length == 0] = 1
+        vectors /= length
+        return vectors
+
+    @staticmethod
+    def _cross(a, b):
+        """
+        Cross products of the columns of two (3, N) arrays
+        """
+        return np.array([a[1] * b[2] - a[2] * b[1], a[2] * b[0] - a[0] * b[2], a[0] * b[1] - a[1] * b[0]])
+
+    @staticmethod
+    def _cornerAngles(p, p_next, p_previous):
+        """
+        Angles of the corners at `p`, between the edges to `p_next` and `p_previous` ((3, N) arrays)
+        """
+        e1, e2 = p_next - p, p_previous - p
+        normal = MeshHelper._cross(e1, e2)
+        return np.arctan2(np.sqrt(np.einsum('ij,ij->j', normal, normal)), np.einsum('ij,ij->j', e1, e2))
+
+    @classmethod
+    def _faceNormals(cls, vertices, face_vertices, faces_v_num, corner_angles = False):
+        """
+        Face normals scaled by twice the face area
+
+        Parameters
+        ----------
+        vertices : numpy.array
+            (3, N) float32 positions
+        face_vertices : numpy.array
+        faces_v_num : numpy.array
+            int32, see `parseObj`
+        corner_angles : bool
+            also return the angle of every corner
+
+        Returns
+        -------
+        (numpy.array, numpy.array)
+            (3, F) float32 normals, and the corner angles (None unless `corner_angles`)
+
+        Notes
+        -----
+        Triangles and quads, nearly every face, are gathered one corner column at a time: a
+        triangle's normal is the cross product of two edges, a quad's the one of its diagonals.
+        Bigger faces go corner by corner, relative to the first corner of their face, where
+        the cross products of consecutive corners are the fan triangles. Faces of less than 3
+        corners have no normal.
+        """
+        faces_start = np.cumsum(faces_v_num, dtype=np.int32) - faces_v_num
+        normals = np.zeros((3, len(faces_v_num)), dtype=np.float32)
+        angles = np.zeros(len(face_vertices), dtype=np.float32) if corner_angles else None
+
+        for k in (3, 4):
+            start = faces_start[faces_v_num == k]
+            p = [np.take(vertices, face_vertices[start + j], axis=1) for j in range(k)]
+            if k == 3:
+                normals[:, faces_v_num == k] = cls._cross(p[1] - p[0], p[2] - p[0])
+            else:
+                normals[:, faces_v_num == k] = cls._cross(p[2] - p[0], p[3] - p[1])
+            if corner_angles:
+                for j in range(k):
+                    angles[start + j] = cls._cornerAngles(p[j], p[(j + 1) % k], p[j - 1])
+
+        faces = np.flatnonzero(faces_v_num > 4)
+        if len(faces):
+            counts = faces_v_num[faces]
+            offsets = np.cumsum(counts, dtype=np.int32) - counts
+            corner = np.repeat(faces_start[faces] - offsets, counts) + np.arange(counts.sum(), dtype=np.int32)
+            following, preceding = cls._cornerNeighbours(counts)
+            p = np.take(vertices, face_vertices[corner], axis=1)
+            p -= np.repeat(p[:, offsets], counts, axis=1)
+            p_next = np.take(p, following, axis=1)
+            normals[:, faces] = np.add.reduceat(cls._cross(p, p_next), offsets, axis=1)
+            if corner_angles:
+                angles[corner] = cls._cornerAngles(p, p_next, np.take(p, preceding, axis=1))
+        return normals, angles
+
+    @classmethod
+    def generateNormals(cls, mesh, crease_angle = Global.CREASE_ANGLE, weighting = Global.NORMALS_WEIGHTING):
+        """
+        Computes smooth vertex normals for a parsed mesh which has none
+
+        Parameters
+        ----------
+        mesh : dict
+            output of `parseObj`, updated in place ('normals' and 'face_normals' are replaced)
+        crease_angle : float or None
+            in degrees; faces meeting at a sharper angle do not share their corner normals.
+            None smooths across every edge (fastest).
+        weighting : str
+            'area' weighs face normals by face area, 'angle' by the corner angle
+
+        Returns
+        -------
+        dict
+            `mesh`
+
+        Notes
+        -----
+        Vectors are handled as (3, N) float32 arrays, one row per axis, so that gathers and
+        arithmetic run over contiguous memory; indices stay int32.
+
+        With a crease angle, the corners of every vertex are split into smoothing groups: any
+        corner left leads a group, which takes the other corners whose face is within the
+        crease angle of the leader's face, until no corner is left. Every group gets one normal,
+        no corner pairs are built.
+        """
+        vertices = np.asarray(mesh['vertices'], dtype=np.float32)
+        face_vertices = np.asarray(mesh['face_vertices'], dtype=np.int32)
+        faces_v_num = np.asarray(mesh['faces_v_num'], dtype=np.int32)
+        corners = len(face_vertices)
+
+        # contribution of every corner to its vertex normal
+        face_normals, angles = cls._faceNormals(np.ascontiguousarray(vertices.T), face_vertices, faces_v_num,
+                                                weighting == 'angle')
+        unit = cls._normalize(face_normals.copy())
+        if weighting == 'angle':
+            weights = np.repeat(unit, faces_v_num, axis=1) * angles
+        else:
+            weights = np.repeat(face_normals, faces_v_num, axis=1)
+
+        if crease_angle is None:
+            # one normal per position: scatter-add the corner contributions
+            normals = np.array([np.bincount(face_vertices, weights[i], len(vertices)) for i in range(3)],
+                               dtype=np.float64)
+            mesh['normals'] = np.ascontiguousarray(cls._normalize(normals).T, dtype=np.float32)
+            mesh['face_normals'] = face_vertices.copy()
+            return mesh
+
+        corner_face = np.repeat(np.arange(len(faces_v_num), dtype=np.int32), faces_v_num)
+        direction = np.take(unit, corner_face, axis=1)
+        # degenerate faces add nothing, they join the first group of their vertex
+        flat = np.einsum('ij,ij->j', direction, direction) == 0
+
+        # every pass, one corner left per vertex leads a new group (whichever is scattered
+        # last); the corners left shrink quickly, most vertices are done after the first pass
+        group = np.zeros(corners, dtype=np.int32)
+        groups = np.zeros(len(vertices), dtype=np.int32)
+        leader = np.empty(len(vertices), dtype=np.int32)
+        left = np.arange(corners, dtype=np.int32)
+        vertex = face_vertices
+        cos_crease = np.cos(np.radians(crease_angle))
+        while len(left):
+            position = np.arange(len(left), dtype=np.int32)
+            leader[vertex] = position
+            lead = np.take(leader, vertex)
+            leads = lead == position
+            groups[vertex[leads]] += 1
+            joined = np.einsum('ij,ij->j', direction, np.take(direction, lead, axis=1)) >= cos_crease
+            rest = ~(joined | leads | flat)
+            left, vertex, direction, flat = left[rest], vertex[rest], direction[:, rest], flat[rest]
+            group[left] += 1
+
+        # one normal per (vertex, group), numbered in that order
+        normal_start = np.cumsum(groups, dtype=np.int32) - groups
+        face_normals = np.take(normal_start, face_vertices) + group
+        normals = np.array([np.bincount(face_normals, weights[i], groups.sum()) for i in range(3)],
+                           dtype=np.float64)
+        mesh['normals'] = np.ascontiguousarray(cls._normalize(normals).T, dtype=np.float32)
+        mesh['face_normals'] = face_normals
+        return mesh
+
+    @staticmethod
+    def indexFaces(mesh):
+        """
+        Welds identical (position, normal) corners and triangulates the faces of a parsed mesh
+
+        Parameters
+        ----------
+        mesh : dict
+            output of `parseObj`
+
+        Returns
+        -------
+        dict
+            'vertices' : numpy.array
+                (U, 3) float32 positions of the U welded vertices
+            'normals' : numpy.array
+                (U, 3) float32 normals aligned with 'vertices'
+            'indices' : numpy.array
+                uint32 triangle list (fan triangulation of every face)
+            'wireframe_indices' : numpy.array
+                uint32 pairs of vertices for every distinct face edge, drawn as `GL_LINES` (see
+                `uniqueEdges`)
+            'triangle_edges' : numpy.array
+                uint8 per triangle, bit i set when the edge opposite corner i is a face edge
+                rather than a triangulation diagonal (see `overlayVertices`)
+            'colors' : numpy.array
+                (U, 4) uint8 colors aligned with 'vertices', only if the mesh has 'colors'
+
+        Notes
+        -----
+        The lines of the normals pass are built on demand, see `normalLines`.
+        """
+        face_vertices = mesh['face_vertices'].astype(np.int64)
+        face_normals = mesh['face_normals']
+
+        # weld: one vertex per distinct (position, normal) pair
+        if face_normals is not None:
+            key = face_vertices * len(mesh['normals']) + face_normals
+        else:
+            key = face_vertices
+        key, first, corner_vertex = np.unique(key, return_index=True, return_inverse=True)
+        corner_vertex = corner_vertex.reshape(-1).astype(np.uint32)
+        welded = len(key)
+
+        vertices = mesh['vertices'][face_vertices[first]].astype(np.float32)
+
+        normals = np.zeros((welded, 3), dtype=np.float32)
+        if face_normals is not None:
+            normals[:] = mesh['normals'][face_normals[first]]
+
+        tri_face, tri_corners = MeshHelper._fanTriangles(mesh['faces_v_num'])
+        indices = corner_vertex[tri_corners].reshape(-1)
+
+        # fan (s, s+j, s+j+1): (s+j, s+j+1) is always on the outline, (s+j+1, s) only for the
+        # last triangle of the face and (s, s+j) only for the first
+        j = tri_corners[:, 1] - tri_corners[:, 0]
+        last = j == mesh['faces_v_num'][tri_face] - 2
+        triangle_edges = (1 | (last << 1) | ((j == 1) << 2)).astype(np.uint8)
+
+        # face outlines, edges shared by faces or split by normals only once
+        wireframe_indices = MeshHelper.uniqueEdges(mesh['faces_v_num'], corner_vertex, face_vertices[first])
+
+        indexed = {
+            'vertices': vertices,
+            'normals': normals,
+            'indices': indices,
+            'wireframe_indices': wireframe_indices,
+            'triangle_edges': triangle_edges,
+        }
+        if mesh.get('colors') is not None:
+            indexed['colors'] = mesh['colors'][face_vertices[first]]
+        return indexed
+
+    @staticmethod
+    def _subProgress(progress, start, end):
+        """
+        Progress callback reporting the fractions of a step going from `start` to `end` of
+        `progress`, None without `progress`
+        """
+        if progress is None:
+            return None
+        return lambda fraction: progress(start + (end - start) * fraction)
+
+    @staticmethod
+    def acmr(indices, cache_size = Global.VERTEX_CACHE_SIZE, progress = None):
+        """
+        Average cache miss ratio of a triangle list through a FIFO post-transform cache
+
+        Parameters
+        ----------
+        indices : numpy.array
+            triangle list
+        cache_size : int
+        progress : callable
+            called with the fraction done every `_PROGRESS_STEPS`th of the way, may raise
+            `LoadCancelled`
+
+        Returns
+        -------
+        float
+            vertex shader runs per triangle (0.5 is ideal on big meshes, 3 is the worst)
+        """
+        if not len(indices):
+            return 0.0
+
+        cache = set()
+        fifo = []
+        misses = 0
+        values = indices.tolist()
+        step = max(len(values) // _PROGRESS_STEPS, 1)
+        for start in range(0, len(values), step):
+            if progress is not None:
+                progress(start / len(values))
+            for v in values[start:start + step]:
+                if v not in cache:
+                    misses += 1
+                    cache.add(v)
+                    fifo.append(v)
+                    if len(fifo) > cache_size:
+                        cache.discard(fifo.pop(0))
+        return misses / (len(indices) // 3)
+
+    @staticmethod
+    def tipsify(indices, vertex_count, cache_size = Global.VERTEX_CACHE_SIZE, return_order = False,
+                progress = None):
+        """
+        Reorders triangles for the post-transform vertex cache
+
+        Parameters
+        ----------
+        indices : numpy.array
+            triangle list
+        vertex_count : int
+        cache_size : int
+        return_order : bool
+            also return the original index of every output triangle
+        progress : callable
+            see `acmr`
+
+        Returns
+        -------
+        numpy.array
+            the same triangles in cache friendly order (and their order if `return_order`)
+
+        Notes
+        -----
+        Sander, Nehab and Barczak, "Fast Triangle Reordering for Vertex Locality and Reduced
+        Overdraw" (2007). Runs in linear time, one python iteration per triangle.
+        """
+        triangles = indices.reshape(-1, 3)
+        if not len(triangles):
+            return (indices, np.zeros(0, dtype=np.int64)) if return_order else indices
+
+        if progress is None:
+            progress = lambda fraction: None
+
+        # vertex => triangles adjacency, as python lists for fast scalar access
+        corner_triangle = np.repeat(np.arange(len(triangles)), 3)
+        order = np.argsort(triangles.reshape(-1), kind='mergesort')
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(triangles.reshape(-1), minlength=vertex_count))))
+        progress(0.0)
+        adjacency = corner_triangle[order].tolist()
+        progress(0.0)
+        offsets = offsets.tolist()
+        tris = triangles.tolist()
+        progress(0.0)
+
+        live = [offsets[v + 1] - offsets[v] for v in range(vertex_count)] # live triangles per vertex
+        stamp = [0] * vertex_count # time each vertex entered the cache
+        emitted = [False] * len(tris)
+        dead_end = []
+        output = []
+        emitted_order = []
+
+        time = cache_size + 1
+        cursor = 0
+        fanning = 0
+        step = max(len(tris) // _PROGRESS_STEPS, 1)
+        next_report = 0
+        while fanning >= 0:
+            if len(emitted_order) >= next_report:
+                progress(len(emitted_order) / len(tris))
+                next_report += step
+            candidates = []
+            for t in adjacency[offsets[fanning]:offsets[fanning + 1]]:
+                if emitted[t]:
+                    continue
+                for v in tris[t]:
+                    output.append(v)
+                    dead_end.append(v)
+                    candidates.append(v)
+                    live[v] -= 1
+                    if time - stamp[v] > cache_size:
+                        stamp[v] = time
+                        time += 1
+                emitted[t] = True
+                emitted_order.append(t)
+
+            # next fanning vertex: the candidate still in cache after its fan, oldest first
+            fanning, best = -1, -1
+            for v in candidates:
+                if live[v] > 0:
+                    priority = 0
+                    if time - stamp[v] + 2 * live[v] <= cache_size:
+                        priority = time - stamp[v]
+                    if priority > best:
+                        fanning, best = v, priority
+
+            if fanning == -1:
+                # dead end: go back through recently used vertices, then scan forward
+                while dead_end:
+                    v = dead_end.pop()
+                    if live[v] > 0:
+                        fanning = v
+                        break
+                else:
+                    while cursor < vertex_count:
+                        if live[cursor] > 0:
+                            fanning = cursor
+                            break
+                        cursor += 1
+
+        progress(1.0)
+        output = np.array(output, dtype=indices.dtype)
+        if return_order:
+            return output, np.array(emitted_order, dtype=np.int64)
+        return output
+
+    @classmethod
+    def optimizeVertexCache(cls, indexed, cache_size = Global.VERTEX_CACHE_SIZE, progress = None):
+        """
+        Reorders triangles for the vertex cache, then vertices in order of first use
+
+        Parameters
+        ----------
+        indexed : dict
+            output of `indexFaces`
+        cache_size : int
+        progress : callable
+            see `acmr`
+
+        Returns
+        -------
+        dict
+            same arrays as `indexFaces`, reordered, plus 'acmr': [before, after]
+        """
+        welded = len(indexed['vertices'])
+        # the three python loops take about the same time per index
+        before = cls.acmr(indexed['indices'], cache_size, cls._subProgress(progress, 0.0, 0.25))
+        indices, triangle_order = cls.tipsify(indexed['indices'], welded, cache_size, return_order=True,
+                                              progress=cls._subProgress(progress, 0.25, 0.75))
+
+        if progress is not None:
+            progress(0.75)
+
+        # vertices in the order the triangles first use them, unused ones last
+        used, first = np.unique(indices, return_index=True)
+        unused = np.ones(welded, dtype=bool)
+        unused[used] = False
+        order = np.concatenate((indices[np.sort(first)], np.flatnonzero(unused)))
+        remap = np.empty(welded, dtype=np.uint32)
+        remap[order] = np.arange(welded, dtype=np.uint32)
+
+        optimized = {
+            'vertices': indexed['vertices'][order],
+            'normals': indexed['normals'][order],
+            'indices': remap[indices],
+            'wireframe_indices': remap[indexed['wireframe_indices']],
+            'triangle_edges': indexed['triangle_edges'][triangle_order],
+            'acmr': np.array([before, cls.acmr(indices, cache_size, cls._subProgress(progress, 0.75, 1.0))],
+                             dtype=np.float32),
+        }
+        if 'colors' in indexed:
+            optimized['colors'] = indexed['colors'][order]
+        return optimized
+
+    @staticmethod
+    def _clusterVertices(positions, triangles, resolution):
+        """
+        Snaps vertices to a `resolution`^3 grid over the bounding box
+
+        Returns
+        -------
+        (numpy.array, numpy.array)
+            cluster of every vertex and the surviving (non-degenerate, distinct) triangles
+            as (T, 3) cluster indices
+        """
+        low = positions.min(axis=0)
+        extent = (positions.max(axis=0) - low).max() or 1.0
+        cell = np.minimum(((positions - low) / extent * resolution).astype(np.int64), resolution - 1)
+        key = cell[:, 0] + resolution * (cell[:, 1] + resolution * cell[:, 2])
+        _, cluster = np.unique(key, return_inverse=True)
+        cluster = cluster.reshape(-1)
+
+        tris = cluster[triangles]
+        keep = (tris[:, 0] != tris[:, 1]) & (tris[:, 1] != tris[:, 2]) & (tris[:, 2] != tris[:, 0])
+        tris = tris[keep]
+
+        # drop triangles collapsed onto the same three clusters
+        if len(tris):
+            ordered = np.sort(tris, axis=1)
+            count = cluster.max() + 1
+            key = (ordered[:, 0] * count + ordered[:, 1]) * count + ordered[:, 2]
+            _, first = np.unique(key, return_index=True)
+            tris = tris[np.sort(first)]
+        return cluster, tris
+
+    @classmethod
+    def decimate(cls, indexed, target_faces, progress = None):
+        """
+        Simplifies an indexed mesh to about `target_faces` triangles
+
+        Parameters
+        ----------
+        indexed : dict
+            output of `indexFaces` or `optimizeVertexCache`
+        target_faces : int
+        progress : callable
+            see `acmr`
+
+        Returns
+        -------
+        dict
+            same arrays as `optimizeVertexCache`, for the simplified mesh
+
+        Notes
+        -----
+        Quadric error metrics (Garland and Heckbert) applied to vertex clustering
+        (Lindstrom, "Out-of-Core Simplification of Large Polygonal Models", 2000): vertices
+        are merged per grid cell and each cell is placed where the sum of its plane quadrics
+        is smallest. Unlike edge collapse this is a handful of array passes, so it stays
+        usable on scans with millions of faces. The grid resolution is bisected to land
+        close to `target_faces`. Normals are regenerated from the simplified surface.
+        """
+        positions = indexed['vertices'].astype(np.float64)
+        triangles = indexed['indices'].reshape(-1, 3).astype(np.int64)
+
+        # bisect the grid resolution for the face budget
+        low, high = 1, 4096
+        best = None
+        for i in range(14):
+            if progress is not None:
+                progress(0.5 * i / 14)
+            resolution = int(round(np.sqrt(low * high)))
+            cluster, tris = cls._clusterVertices(positions, triangles, resolution)
+            if best is None or abs(len(tris) - target_faces) < abs(len(best[1]) - target_faces):
+                best = (cluster, tris)
+            if len(tris) < target_faces:
+                low = resolution
+            else:
+                high = resolution
+            if high - low <= 1:
+                break
+        cluster, tris = best
+        count = cluster.max() + 1
+        if progress is not None:
+            progress(0.5)
+
+        # plane quadric of every original triangle, weighted by its area
+        p = positions[triangles]
+        normal = np.cross(p[:, 1] - p[:, 0], p[:, 2] - p[:, 0])
+        area = np.sqrt((normal * normal).sum(axis=1))
+        unit = normal / np.maximum(area, 1e-30)[:, None]
+        d = -(unit * p[:, 0]).sum(axis=1)
+        a, b, c = unit[:, 0], unit[:, 1], unit[:, 2]
+        terms = np.column_stack((a*a, a*b, a*c, b*b, b*c, c*c, a*d, b*d, c*d)) * area[:, None]
+
+        # every triangle adds its quadric to the clusters of its three vertices
+        corner_cluster = cluster[triangles].reshape(-1)
+        corner_terms = np.repeat(terms, 3, axis=0)
+        q = np.column_stack([np.bincount(corner_cluster, corner_terms[:, i], count) for i in range(9)])
+        if progress is not None:
+            progress(0.6)
+
+        A = np.empty((count, 3, 3))
+        A[:, 0, 0], A[:, 0, 1], A[:, 0, 2] = q[:, 0], q[:, 1], q[:, 2]
+        A[:, 1, 0], A[:, 1, 1], A[:, 1, 2] = q[:, 1], q[:, 3], q[:, 4]
+        A[:, 2, 0], A[:, 2, 1], A[:, 2, 2] = q[:, 2], q[:, 4], q[:, 5]
+        rhs = -q[:, 6:9]
+
+        # cluster means are the fallback for flat or degenerate quadrics
+        members = np.bincount(cluster, minlength=count).astype(np.float64)
+        mean = np.column_stack([np.bincount(cluster, positions[:, i], count) for i in range(3)]) / members[:, None]
+
+        scale = np.abs(A).reshape(count, -1).max(axis=1)
+        solvable = np.abs(np.linalg.det(A)) > 1e-6 * np.maximum(scale, 1e-30)**3
+        placed = mean.copy()
+        if solvable.any():
+            placed[solvable] = np.linalg.solve(A[solvable], rhs[solvable][:, :, None])[:, :, 0]
+
+        # keep optimal positions which stay near their cluster
+        spread = np.sqrt(np.bincount(cluster, ((positions - mean[cluster])**2).sum(axis=1), count) / members)
+        far = np.sqrt(((placed - mean)**2).sum(axis=1)) > 2 * spread + 1e-12
+        placed[far] = mean[far]
+
+        mesh = {
+            'vertices': placed.astype(np.float32),
+            'normals': np.zeros((0, 3), dtype=np.float32),
+            'face_vertices': tris.reshape(-1).astype(np.int32),
+            'face_normals': None,
+            'faces_v_num': np.full(len(tris), 3, dtype=np.int32),
+        }
+        if 'colors' in indexed:
+            # average color of each cluster
+            colors = indexed['colors'].astype(np.float64)
+            mesh['colors'] = np.round(np.column_stack([np.bincount(cluster, colors[:, i], count)
+                                                       for i in range(4)]) / members[:, None]).astype(np.uint8)
+        if progress is not None:
+            progress(0.7)
+        cls.generateNormals(mesh, crease_angle=None)
+        indexed = cls.indexFaces(mesh)
+        return cls.optimizeVertexCache(indexed, progress=cls._subProgress(progress, 0.7, 1.0))
+
+    @staticmethod
+    def boundingSphere(indexed):
+        """
+        Returns
+        -------
+        numpy.array
+            [x, y, z, radius] of a sphere around the mesh (bounding box center)
+        """
+        positions = indexed['vertices'][:, :3]
+        if not len(positions):
+            return np.zeros(4, dtype=np.float32)
+        center = (positions.min(axis=0) + positions.max(axis=0)) / 2
+        radius = np.sqrt(((positions - center)**2).sum(axis=1).max())
+        return np.append(center, radius).astype(np.float32)
+
+    @staticmethod
+    def vertexFormat(position_format = Global.VERTEX_POSITION_FORMAT, normal_format = Global.VERTEX_NORMAL_FORMAT):
+        """
+        Returns the interleaved vertex dtype for the given formats
+
+        Parameters
+        ----------
+        position_format : str
+            'float32' (3 components) or 'float16' (4 components to keep 4 byte alignment, w = 1)
+        normal_format : str
+            'float32' (3 components), 'snorm16' (4 components, w unused) or 'int_2_10_10_10_rev'
+            (one packed uint32)
+
+        Notes
+        -----
+        Packed normals carry `{'gl_packed': 'int_2_10_10_10_rev'}` as dtype metadata so that
+        `BufferHelper.sendToShaders` knows how to point at them.
+        """
+        positions = {'float32': ('<f4', 3), 'float16': ('<f2', 4)}
+        normals = {
+            'float32': ('<f4', 3),
+            'snorm16': ('<i2', 4),
+            'int_2_10_10_10_rev': (np.dtype('<u4', metadata={'gl_packed': 'int_2_10_10_10_rev'}), 1),
+        }
+        if position_format not in positions or normal_format not in normals:
+            raise ValueError("unknown vertex format %s/%s" % (position_format, normal_format))
+
+        fields = []
+        for name, (dtype, count) in [('position', positions[position_format]), ('normal', normals[normal_format])]:
+            fields.append((name, dtype) if count == 1 else (name, dtype, count))
+        return np.dtype(fields)
+
+    @classmethod
+    def interleave(cls, vertices, normals, position_format = Global.VERTEX_POSITION_FORMAT,
+                   normal_format = Global.VERTEX_NORMAL_FORMAT):
+        """
+        Packs positions and normals into one interleaved record array
+
+        Parameters
+        ----------
+        vertices : numpy.array
+            (N, 3) positions
+        normals : numpy.array
+            (N, 3) unit normals
+        position_format, normal_format : str
+            see `vertexFormat`
+
+        Returns
+        -------
+        numpy.array
+            N records of `vertexFormat(position_format, normal_format)`
+        """
+        interleaved = np.empty(len(vertices), dtype=cls.vertexFormat(position_format, normal_format))
+        if interleaved['position'].shape[1] == 4:
+            interleaved['position'][:, :3] = vertices
+            interleaved['position'][:, 3] = 1.0
+        else:
+            interleaved['position'] = vertices
+
+        normals = np.clip(normals, -1.0, 1.0)
+        if normal_format == 'float32':
+            interleaved['normal'] = normals
+        elif normal_format == 'snorm16':
+            interleaved['normal'][:, :3] = np.round(normals * 32767)
+            interleaved['normal'][:, 3] = 0
+        else:
+            # 10 bit signed x, y, z from the low bits up, w = 0
+            packed = np.round(normals * 511).astype(np.int32) & 0x3FF
+            interleaved['normal'] = (packed[:, 0] | (packed[:, 1] << 10) | (packed[:, 2] << 20)).astype(np.uint32)
+        return interleaved
+
+    @staticmethod
+    def normalLines(vertices, normals = None):
+        """
+        Builds the vertices of the normals pass, drawn as `GL_LINES` with `glDrawArrays`
+
+        Parameters
+        ----------
+        vertices : numpy.array
+            (N, 3) or (N, 4) positions
+        normals : numpy.array
+            (N, 3) normals, None for shaders which compute them
+
+        Returns
+        -------
+        numpy.array
+            2N records, each vertex with w=1 followed by itself with w=0 (which the vertex shaders
+            move along the normal when `drawNormals` is set)
+        """
+        fields = [('position', np.float32, 4)]
+        if normals is not None:
+            fields.append(('normal', np.float32, 3))
+        lines = np.empty(2 * len(vertices), dtype=fields)
+        lines['position'][:, :3] = np.repeat(np.asarray(vertices)[:, :3], 2, axis=0)
+        lines['position'][:, 3] = np.tile([1.0, 0.0], len(vertices))
+        if normals is not None:
+            lines['normal'] = np.repeat(normals, 2, axis=0)
+        return lines
+
+    @classmethod
+    def overlayVertices(cls, indexed, position_format = Global.VERTEX_POSITION_FORMAT,
+                        normal_format = Global.VERTEX_NORMAL_FORMAT):
+        """
+        Builds unindexed triangles carrying the edge coordinates of the single pass wireframe
+
+        Parameters
+        ----------
+        indexed : dict
+            output of `indexFaces` or `optimizeVertexCache`
+        position_format, normal_format : str
+            see `vertexFormat`
+
+        Returns
+        -------
+        numpy.array
+            3T records of `vertexFormat` plus 'edge' (4 normalized uint8) and 'color' if the
+            mesh has colors, drawn as `GL_TRIANGLES` with `glDrawArrays`
+
+        Notes
+        -----
+        Corner i of a triangle gets 0.5 in component i and 0 in the others, so the interpolated
+        component i reaches 0 on the edge opposite corner i. light.frag draws lines where an edge
+        component is close to an integer. Triangulation diagonals get 0.5 on all three corners
+        and the fourth component is always 0.5, so neither is ever drawn. Corners cannot share
+        vertices as they need different edge values, hence the unindexed layout.
+        """
+        indices = indexed['indices']
+        base = cls.vertexFormat(position_format, normal_format)
+        fields = [(name, base.fields[name][0]) for name in base.names] + [('edge', np.uint8, 4)]
+        if 'colors' in indexed:
+            fields.append(('color', np.uint8, 4))
+
+        overlay = np.empty(len(indices), dtype=fields)
+        interleaved = cls.interleave(indexed['vertices'][indices], indexed['normals'][indices],
+                                     position_format, normal_format)
+        for name in base.names:
+            overlay[name] = interleaved[name]
+
+        half = 128
+        edge = np.zeros((len(indices) // 3, 3, 4), dtype=np.uint8)
+        edge[:, :, 3] = half
+        corner = np.arange(3)
+        edge[:, corner, corner] = half
+        hidden = (indexed['triangle_edges'][:, None] >> corner) & 1 == 0
+        edge[:, :, :3][np.repeat(hidden[:, None, :], 3, axis=1)] = half
+        overlay['edge'] = edge.reshape(-1, 4)
+
+        if 'colors' in indexed:
+            overlay['color'] = indexed['colors'][indices]
+        return overlay
@@ -1,5 +1,8 @@
 from __future__ import division
 import sys
+import timeit
+import collections
+import multiprocessing
 import numpy as np
 
 import OpenGL.GL as gl
@@ -18,6 +21,27 @@ from PyQt4.QtOpenGL import QGLWidget, QGLFormat
 from configs import Global
 from shaderHelper import ShaderHelper
 from bufferHelper import BufferHelper
+from meshHelper import MeshHelper
+from meshCache import MeshCache
+from frameProfiler import FrameProfiler
+
+
+def _preloadModel(path):
+    """
+    Builds the cache entry of the obj at `path` (runs in a worker process)
+
+    Returns
+    -------
+    tuple
+        (path, entry name, arrays, error message), the entry name None when the arrays could
+        not be cached; the arrays only cross the process boundary then, they are otherwise
+        shared through the memory-mapped cache files
+    """
+    try:
+        arrays, name = MeshCache.fetch(path, Obj.buildArrays, return_entry=True)
+    except Exception as e:
+        return path, None, None, str(e)
+    return path, name, arrays if name is None else None, None
 
 
 class Object(object):
@@ -25,10 +49,16 @@ class Object(object):
     This is the base class for rendering objects
     """
 
+    # names of the `BufferHelper` buffers and vertex arrays the object creates
+    buffer_names = []
+    vertex_array_names = []
+
     def __init__(self):
         self.wireframe_on = Global.WIREFRAME_DEFAULT
+        self.wireframe_overlay = Global.WIREFRAME_OVERLAY_DEFAULT
         self.color_on = Global.COLOR_DEFAULT
         self.normals_on = Global.NORMALS_DEFAULT
+        self.normal_lines = {} # buffer name => vertex count, filled on the first normals pass
         self.buildShaders()
 
         self.setupLights()
@@ -39,13 +69,77 @@ class Object(object):
         self.setZbufferShading(False)
 
         BufferHelper.sendUniformToShaders('eye', Global.EYE, '3f')
+        BufferHelper.sendUniformToShaders('wireframeColor', Global.WIREFRAME_COLOR, '4f')
 
     def draw(self):
         raise NotImplementedError
 
+    def release(self):
+        """
+        Frees the GPU buffers of the object, called before switching to another model
+        """
+        BufferHelper.deleteVertexArrays(self.vertex_array_names)
+        BufferHelper.deleteBuffers(self.buffer_names)
+
+    def updateView(self, projection, view, model, height):
+        """
+        Called every frame, before `draw`, with the current transformation matrices
+        """
+        pass
+
+    def sendNormalLines(self, name, vertices, normals = None):
+        """
+        Sends the vertices of the normals pass as buffer and vertex array `name`
+
+        Parameters
+        ----------
+        name : str
+            listed in `buffer_names` and `vertex_array_names` so `release` frees it
+        vertices, normals : numpy.array
+            see `MeshHelper.normalLines`
+
+        Returns
+        -------
+        int
+            number of vertices to draw as `GL_LINES`
+
+        Notes
+        -----
+        Called from `draw` the first time `normals_on` is set, so models which never show
+        their normals do not carry every vertex twice.
+        """
+        lines = MeshHelper.normalLines(vertices, normals)
+        BufferHelper.sendToGPU(name, lines, gl.GL_STATIC_DRAW)
+        BufferHelper.buildVertexArray(name, [(name, field) for field in lines.dtype.names])
+        self.normal_lines[name] = len(lines)
+        return len(lines)
+
+    def dropNormalLines(self, name):
+        """
+        Frees the normals pass `name` so the next pass rebuilds it (i.e. after the geometry changed)
+        """
+        if self.normal_lines.pop(name, None) is not None:
+            BufferHelper.deleteVertexArray(name)
+            BufferHelper.deleteBuffer(name)
+
     def toggleWireframe(self):
         self.wireframe_on = not self.wireframe_on
 
+    def toggleWireframeOverlay(self):
+        self.wireframe_overlay = not self.wireframe_overlay
+
+    def overlayWireframe(self):
+        """
+        Whether the wireframe is drawn by the fill pass (see light.frag) instead of its own pass
+
+        Notes
+        -----
+        Only when the fill is drawn at all; without it the line pass is used either way.
+        """
+        on = self.wireframe_on and self.wireframe_overlay and self.color_on
+        BufferHelper.sendUniformToShaders('wireframeOverlay', [int(on)], '1i')
+        return on
+
     def toggleColor(self):
         self.color_on = not self.color_on
 
@@ -84,6 +178,9 @@ class Object(object):
             gl.glLightfv(light, gl.GL_DIFFUSE, diff)
             gl.glLightfv(light, gl.GL_SPECULAR, spec)
             gl.glLightfv(light, gl.GL_POSITION, pos)
+
+        # shaders read the lights from the scene uniform block when there is one
+        ShaderHelper.sendScene('lights', Global.LIGHTS)
             
         self.activeLights = len(lights)
 
@@ -104,6 +201,11 @@ class Object(object):
 class UVObject(Object):
     """
     Base class for UV objects
+
+    Notes
+    -----
+    The buffers of the last `Global.UV_BUFFER_CACHE_SIZE` (U, V) grids are kept on the GPU,
+    so sweeping a slider back and forth only rebuilds the grids it has not seen recently.
     """
 
     def buildShaders(self):
@@ -112,6 +214,11 @@ class UVObject(Object):
     def __init__(self):
         super(UVObject, self).__init__()
 
+        # (U, V) => buffer prefix and draw counts of the grid, least recently used first
+        self.uv_grids = collections.OrderedDict()
+        self.buffer_names = []
+        self.vertex_array_names = []
+
         self.U, self.V = 20, 20
 
         self.initUV()
@@ -125,43 +232,61 @@ class UVObject(Object):
         self.initUV()
 
     def initUV(self):
-        self.maxU, self.maxV = self.U, self.V
-        point = []
-        self.faces_v_num = []
-        self.faces_v_normals_num = []
-        for u in range(self.maxU):
-            for v in range(self.maxV):
-                uvs = [
-                    (u/(self.maxU),v/(self.maxV),0,1.0),
-                    (u/(self.maxU),v/(self.maxV),0,0.0),
-                    (u/(self.maxU),(v+1)/(self.maxV),0,1.0),
-                    (u/(self.maxU),(v+1)/(self.maxV),0,0.0),
-                    ((u+1)/(self.maxU),(v+1)/(self.maxV),0,1.0),
-                    ((u+1)/(self.maxU),(v+1)/(self.maxV),0,0.0),
-                    ((u+1)/(self.maxU),v/(self.maxV),0,1.0),
-                    ((u+1)/(self.maxU),v/(self.maxV),0,0.0),
-                ]
-                point.extend(uvs)
-                self.faces_v_num.append(8)
-                self.faces_v_normals_num.append(2)
-
-        acc = self.faces_v_num[::]
-        acc.insert(0,0)
-        self.faces_v_start = np.cumsum(acc)
-        self.faces_len = len(self.faces_v_num)
-
-        position = np.zeros(len(point), [('position', np.float32, 4)])
-        position['position'] = point
-        BufferHelper.sendToGPU('position', position, gl.GL_DYNAMIC_DRAW)
-        BufferHelper.sendToShaders('position')
-
-        color = np.zeros(len(point), [('color', np.float32, 4)])
-        color['color'] = [Global.SOLID_COLOR for i in range(len(position))]
-        BufferHelper.sendToGPU('color', color, gl.GL_DYNAMIC_DRAW)
-
-        wireframecolor = np.zeros(len(point), [('wireframeColor', np.float32, 4)])
-        wireframecolor['wireframeColor'] = [Global.WIREFRAME_COLOR for x in position]
-        BufferHelper.sendToGPU('wireframeColor', wireframecolor, gl.GL_DYNAMIC_DRAW)
+        key = (self.U, self.V)
+        grid = self.uv_grids.pop(key, None)
+        if grid is None:
+            grid = self.sendGrid(*key)
+        self.uv_grids[key] = grid
+        while len(self.uv_grids) > Global.UV_BUFFER_CACHE_SIZE:
+            self.releaseGrid(self.uv_grids.popitem(last=False)[1])
+
+        self.maxU, self.maxV = key
+        self.grid = grid
+        BufferHelper.sendUniformToShaders('uvGrid', [self.maxU, self.maxV], '2f')
+
+    def sendGrid(self, U, V):
+        """
+        Sends the buffers of a `U` x `V` grid to the GPU, named after its size
+
+        Returns
+        -------
+        dict
+            buffer prefix, draw counts and the first corner of every face (for the normal lines)
+        """
+        prefix = 'uv%dx%d_' % (U, V)
+        arrays = MeshHelper.uvGrid(U, V)
+
+        position = arrays['corners'].view([('position', np.float32, 4)]).reshape(-1)
+        BufferHelper.sendToGPU(prefix + 'position', position, gl.GL_STATIC_DRAW)
+        BufferHelper.sendToGPU(prefix + 'edges', arrays['edges'], gl.GL_STATIC_DRAW, gl.GL_ELEMENT_ARRAY_BUFFER)
+
+        # colors are constant attributes set per pass
+        BufferHelper.buildVertexArray(prefix + 'fill', [(prefix + 'position', 'position')])
+        BufferHelper.buildVertexArray(prefix + 'wireframe', [(prefix + 'position', 'position')], prefix + 'edges')
+
+        # the normal lines are sent on the first normals pass
+        self.buffer_names.extend(prefix + name for name in ['position', 'edges', 'normal_lines'])
+        self.vertex_array_names.extend(prefix + name for name in ['fill', 'wireframe', 'normal_lines'])
+
+        return {
+            'prefix': prefix,
+            'faces_v_start': arrays['faces_v_start'],
+            'faces_v_num': arrays['faces_v_num'],
+            'faces_len': len(arrays['faces_v_num']),
+            'edges_len': len(arrays['edges']),
+            'corners': arrays['corners'][arrays['faces_v_start']],
+        }
+
+    def releaseGrid(self, grid):
+        """
+        Frees the GPU buffers of a grid evicted from `uv_grids`
+        """
+        prefix = grid['prefix']
+        self.dropNormalLines(prefix + 'normal_lines')
+        BufferHelper.deleteVertexArrays(prefix + name for name in ['fill', 'wireframe'])
+        BufferHelper.deleteBuffers(prefix + name for name in ['position', 'edges'])
+        self.buffer_names = [name for name in self.buffer_names if not name.startswith(prefix)]
+        self.vertex_array_names = [name for name in self.vertex_array_names if not name.startswith(prefix)]
 
     def setLayoutAttr(self, layout):
         """
@@ -185,31 +310,49 @@ class UVObject(Object):
         
 
     def draw(self):
+        grid = self.grid
+        prefix = grid['prefix']
+        overlay = self.overlayWireframe()
+
         if self.color_on:
+            FrameProfiler.begin('fill')
             # make sure polygons draw under wireframe
             BufferHelper.sendUniformToShaders('wireframe', [0], '1i')
 
             gl.glPolygonOffset(5, 0);
             gl.glEnable(gl.GL_POLYGON_OFFSET_FILL);
 
-            BufferHelper.sendToShaders('color')
-            gl.glMultiDrawArrays(gl.GL_TRIANGLE_FAN, self.faces_v_start, self.faces_v_num, self.faces_len)
+            BufferHelper.bindVertexArray(prefix + 'fill')
+            BufferHelper.sendConstantToShaders('color', Global.SOLID_COLOR)
+            gl.glMultiDrawArrays(gl.GL_TRIANGLE_FAN, grid['faces_v_start'], grid['faces_v_num'], grid['faces_len'])
 
             gl.glDisable(gl.GL_POLYGON_OFFSET_FILL);
+            FrameProfiler.end('fill')
 
-        if self.wireframe_on:
+        if self.wireframe_on and not overlay:
+            FrameProfiler.begin('wireframe')
             BufferHelper.sendUniformToShaders('wireframe', [1], '1i')
 
-            BufferHelper.sendToShaders('wireframeColor', 'color')
-            gl.glMultiDrawArrays(gl.GL_LINE_LOOP, self.faces_v_start, self.faces_v_num, self.faces_len)
+            BufferHelper.bindVertexArray(prefix + 'wireframe')
+            BufferHelper.sendConstantToShaders('color', Global.WIREFRAME_COLOR)
+            gl.glDrawElements(gl.GL_LINES, grid['edges_len'], gl.GL_UNSIGNED_INT, ctypes.c_void_p(0))
+            FrameProfiler.end('wireframe')
 
         if self.normals_on:
+            FrameProfiler.begin('normals')
+            count = self.normal_lines.get(prefix + 'normal_lines')
+            if count is None:
+                # the shaders compute the normals from (u, v)
+                count = self.sendNormalLines(prefix + 'normal_lines', grid['corners'])
+
             BufferHelper.sendUniformToShaders('wireframe', [1], '1i')
-            BufferHelper.sendToShaders('wireframeColor', 'color')
+            BufferHelper.bindVertexArray(prefix + 'normal_lines')
+            BufferHelper.sendConstantToShaders('color', Global.WIREFRAME_COLOR)
 
             BufferHelper.sendUniformToShaders('drawNormals', [1], '1i')
-            gl.glMultiDrawArrays(gl.GL_LINES, self.faces_v_start, self.faces_v_normals_num, self.faces_len)
+            gl.glDrawArrays(gl.GL_LINES, 0, count)
             BufferHelper.sendUniformToShaders('drawNormals', [0], '1i')
+            FrameProfiler.end('normals')
 
 
 class UVSphere(UVObject):
@@ -296,6 +439,9 @@ class Box(Object):
     This is the basic box class to be rendered
     """
 
+    buffer_names = ['position', 'normal', 'edge', 'boxIndices', 'boxNormalLines']
+    vertex_array_names = ['box', 'boxNormalLines']
+
 
     def buildShaders(self):
         ShaderHelper.buildAndUseProgram()
@@ -308,252 +454,437 @@ class Box(Object):
         super(Box, self).__init__()
 
         # positions
-        position = np.zeros(24*2, [('position', np.float32, 4)])
+        position = np.zeros(24, [('position', np.float32, 4)])
         position['position'] = [
             # top
             (-1.0, 1.0,-1.0, 1.0),
-            (-1.0, 1.0,-1.0,  0.0),
             ( 1.0, 1.0,-1.0, 1.0),
-            ( 1.0, 1.0,-1.0,  0.0),
             ( 1.0, 1.0, 1.0, 1.0),
-            ( 1.0, 1.0, 1.0,  0.0),
             (-1.0, 1.0, 1.0, 1.0),
-            (-1.0, 1.0, 1.0,  0.0),
             # bottom
             (-1.0,-1.0,-1.0, 1.0),
-            (-1.0,-1.0,-1.0,  0.0),
             ( 1.0,-1.0,-1.0, 1.0),
-            ( 1.0,-1.0,-1.0,  0.0),
             ( 1.0,-1.0, 1.0, 1.0),
-            ( 1.0,-1.0, 1.0,  0.0),
             (-1.0,-1.0, 1.0, 1.0),
-            (-1.0,-1.0, 1.0,  0.0),
             # right
             ( 1.0,-1.0,-1.0, 1.0),
-            ( 1.0,-1.0,-1.0,  0.0),
             ( 1.0, 1.0,-1.0, 1.0),
-            ( 1.0, 1.0,-1.0,  0.0),
             ( 1.0, 1.0, 1.0, 1.0),
-            ( 1.0, 1.0, 1.0,  0.0),
             ( 1.0,-1.0, 1.0, 1.0),
-            ( 1.0,-1.0, 1.0,  0.0),
             # left
             (-1.0,-1.0,-1.0, 1.0),
-            (-1.0,-1.0,-1.0,  0.0),
             (-1.0, 1.0,-1.0, 1.0),
-            (-1.0, 1.0,-1.0,  0.0),
             (-1.0, 1.0, 1.0, 1.0),
-            (-1.0, 1.0, 1.0,  0.0),
             (-1.0,-1.0, 1.0, 1.0),
-            (-1.0,-1.0, 1.0,  0.0),
             # front
             (-1.0,-1.0, 1.0, 1.0),
-            (-1.0,-1.0, 1.0,  0.0),
             ( 1.0,-1.0, 1.0, 1.0),
-            ( 1.0,-1.0, 1.0,  0.0),
             ( 1.0, 1.0, 1.0, 1.0),
-            ( 1.0, 1.0, 1.0,  0.0),
             (-1.0, 1.0, 1.0, 1.0),
-            (-1.0, 1.0, 1.0,  0.0),
             # back
             (-1.0,-1.0,-1.0, 1.0),
-            (-1.0,-1.0,-1.0,  0.0),
             ( 1.0,-1.0,-1.0, 1.0),
-            ( 1.0,-1.0,-1.0,  0.0),
             ( 1.0, 1.0,-1.0, 1.0),
-            ( 1.0, 1.0,-1.0,  0.0),
             (-1.0, 1.0,-1.0, 1.0),
-            (-1.0, 1.0,-1.0,  0.0),
         ]
         posBuffer = BufferHelper.sendToGPU('position', position, gl.GL_DYNAMIC_DRAW)
-        BufferHelper.sendToShaders('position')
+        self.corners = position
 
         # normals
-        normal = np.zeros(24*2, [('normal', np.float32, 3)])
+        normal = np.zeros(24, [('normal', np.float32, 3)])
         normal['normal'] = [
             (0, 1.0, 0),
-        ] * 8 + [
+        ] * 4 + [
             (0,-1.0, 0),
-        ] * 8 + [
+        ] * 4 + [
             (1.0, 0 ,0),
-        ] * 8 + [
+        ] * 4 + [
             (-1.0,0, 0),
-        ] * 8 + [
+        ] * 4 + [
             (0, 0, 1.0),
-        ] * 8 + [
+        ] * 4 + [
             (0, 0,-1.0),
-        ] * 8
+        ] * 4
         BufferHelper.sendToGPU('normal', normal, gl.GL_DYNAMIC_DRAW)
-        BufferHelper.sendToShaders('normal')
-        
-        # colors for positions
-        color = np.zeros(24*2, [('color', np.float32, 4)])
-        color['color'] = [Global.SOLID_COLOR for i in range(2*24)]
-        colorBuffer = BufferHelper.sendToGPU('color', color, gl.GL_DYNAMIC_DRAW)
+        self.normals = normal
+
+        # corners of every side in its own (s, t) square, for the single pass wireframe
+        edge = np.zeros(24, [('edge', np.uint8, 4)])
+        edge['edge'] = [(0, 0, 128, 128), (255, 0, 128, 128), (255, 255, 128, 128), (0, 255, 128, 128)] * 6
+        BufferHelper.sendToGPU('edge', edge, gl.GL_STATIC_DRAW)
 
-        # wire colors
-        wireColor = np.zeros(24*2, [('wireColor', np.float32, 4)])
-        wireColor['wireColor'] = [Global.WIREFRAME_COLOR for i in range(24*2)]
-        wireColorBuffer = BufferHelper.sendToGPU('wireColor', wireColor, gl.GL_DYNAMIC_DRAW)
 
         # set up indices for drawing
-        indices = np.zeros(24*2, [('indices', np.int32, 1)])
-        indices['indices'] = range(24*2)
-        self.ind_buffer = vbo.VBO(indices, target=gl.GL_ELEMENT_ARRAY_BUFFER)
-        self.ind_buffer.bind()
+        indices = np.arange(24, dtype=np.uint32)
+        BufferHelper.sendToGPU('boxIndices', indices, gl.GL_STATIC_DRAW, gl.GL_ELEMENT_ARRAY_BUFFER)
+
+        # every pass draws the same layout, colors are constant attributes set per pass
+        BufferHelper.buildVertexArray('box', [('position', 'position'), ('normal', 'normal'), ('edge', 'edge')],
+                                      'boxIndices')
 
     def draw(self):
         """
         Basic draw function which sends elements to the shaders.
         """
+        overlay = self.overlayWireframe()
+
         if self.color_on:
+            FrameProfiler.begin('fill')
             # make sure polygons draw under wireframe
 #            gl.glPolygonOffset(2.5, 0);
 #            gl.glEnable(gl.GL_POLYGON_OFFSET_FILL);
             BufferHelper.sendUniformToShaders('wireframe', [0], '1i')
 
-            BufferHelper.sendToShaders('color', 'color')
+            BufferHelper.bindVertexArray('box')
+            BufferHelper.sendConstantToShaders('color', Global.SOLID_COLOR)
             for i in range(6): # draw each side
-                gl.glDrawElements(gl.GL_TRIANGLE_FAN, 8, gl.GL_UNSIGNED_INT, self.ind_buffer+4*8*i)
+                gl.glDrawElements(gl.GL_TRIANGLE_FAN, 4, gl.GL_UNSIGNED_INT, ctypes.c_void_p(4*4*i))
+            FrameProfiler.end('fill')
 
 #            gl.glDisable(gl.GL_POLYGON_OFFSET_FILL);
 
-        if self.wireframe_on:
+        if self.wireframe_on and not overlay:
+            FrameProfiler.begin('wireframe')
             BufferHelper.sendUniformToShaders('wireframe', [1], '1i')
-            BufferHelper.sendToShaders('wireColor', 'color')
+            BufferHelper.bindVertexArray('box')
+            BufferHelper.sendConstantToShaders('color', Global.WIREFRAME_COLOR)
             for i in range(6):
-                gl.glDrawElements(gl.GL_LINE_LOOP, 8, gl.GL_UNSIGNED_INT, self.ind_buffer+4*8*i)
+                gl.glDrawElements(gl.GL_LINE_LOOP, 4, gl.GL_UNSIGNED_INT, ctypes.c_void_p(4*4*i))
+            FrameProfiler.end('wireframe')
 
         if self.normals_on:
-            BufferHelper.sendToShaders('wireColor', 'color')
+            FrameProfiler.begin('normals')
+            count = self.normal_lines.get('boxNormalLines')
+            if count is None:
+                count = self.sendNormalLines('boxNormalLines', self.corners['position'], self.normals['normal'])
+
+            BufferHelper.bindVertexArray('boxNormalLines')
+            BufferHelper.sendConstantToShaders('color', Global.WIREFRAME_COLOR)
             BufferHelper.sendUniformToShaders('wireframe', [1], '1i')
 
             BufferHelper.sendUniformToShaders('drawNormals', [1], '1i')
-            for i in range(6):
-                gl.glDrawElements(gl.GL_LINES, 8, gl.GL_UNSIGNED_INT, self.ind_buffer+4*8*i)
+            gl.glDrawArrays(gl.GL_LINES, 0, count)
             BufferHelper.sendUniformToShaders('drawNormals', [0], '1i')
+            FrameProfiler.end('normals')
 
 class Obj(Object):
     """
     Given obj specs, renders
+
+    Notes
+    -----
+    Binary ply and stl files are loaded the same way (see `MeshHelper.loadMesh`)
     """
 
+    # path => arrays built by `preload`
+    preloaded = {}
+
     def buildShaders(self):
         ShaderHelper.buildAndUseProgram()
 
 
-    def __init__(self, obj):
+    def __init__(self, path, arrays = None):
         """
         Take everything from obj spec
+
+        Parameters
+        ----------
+        path : str
+            location of the obj, ply or stl file
+        arrays : dict
+            output of `buildArrays` if already loaded (i.e. by a background loader), in which
+            case only the GPU upload is left to do here
         """
 
         super(Obj, self).__init__()
 
-        # init storage
-        vertices_lines = []
-        faces_lines = []
-        normals_lines = []
-
-        for line in obj.split('\n'):
-            line = line.strip()
-            if not line:
-                continue
+        # arrays come memory-mapped from the mesh cache after the first parse
+        if arrays is None:
+            arrays = Obj.preloaded.get(path)
+        if arrays is None:
+            arrays = MeshCache.fetch(path, Obj.buildArrays)
+
+        self.acmr = tuple(arrays['acmr']) # vertex cache miss ratio before/after reordering
+        self.bounds = np.array(arrays['bounds']) # bounding sphere, (x, y, z, radius)
+
+        # level of detail chain, level 0 being the full mesh
+        self.buffer_names = []
+        self.vertex_array_names = []
+        self.levels = []
+        level = 0
+        while level == 0 or 'lod%d_indices' % level in arrays:
+            prefix = 'lod%d_' % level if level else ''
+            self.levels.append(self.sendLevel(prefix, dict(
+                (name[len(prefix):], array) for name, array in arrays.items() if name.startswith(prefix))))
+            level += 1
+
+        self.level = 0
+
+    def sendLevel(self, prefix, arrays):
+        """
+        Sends the buffers of one level of detail to the GPU, named with `prefix`
 
-            if line[:2] == 'v ':
-                vertices_lines.append(line)
-            elif line[:2] == 'f ':
-                faces_lines.append(line)
-            elif line[:3] == 'vn ':
-                normals_lines.append(line)
-
-        # clean up vertices
-        vertices_all = [] # vertex buffer
-        for line in vertices_lines:
-            vertices_all.append( [float(x) for x in line.split()[1:] + [1.0]] )
-
-        # clean up vertices normals
-        normals_all = [] # normal buffer
-        for line in normals_lines:
-            normals_all.append( [float(x) for x in line.split()[1:]] )
-
-        # clean up faces
-        faces_v_num = [] # number of vertices to make face
-        faces_ordered = [] # list of indices in order of face-indices
-        normals_ordered = [] # list of normals aligned with faces
-        
-        # convert each face to list of corresponding vertices
-        for line in faces_lines:
-            v_num = 0
-            for v in [int(x.split('//')[0])-1 for x in line.split()[1:]]:
-                faces_ordered.append(vertices_all[v])
-                faces_ordered.append(vertices_all[v][:-1] + [0.0])
-                v_num += 2
-            if len(normals_all):
-                for v in [int(x.split('//')[1])-1 for x in line.split()[1:]]:
-                    normals_ordered.append(normals_all[v])
-                    normals_ordered.append(normals_all[v])
-            faces_v_num.append(v_num)
-
-        self.faces_v_num = faces_v_num # number of vertices per face
-        acc = self.faces_v_num[::]
-        acc.insert(0,0) # begin at zero index
-        self.faces_v_start = np.cumsum(acc) # start of corresponding face
-        self.faces_len = len(faces_v_num)
-
-        self.faces_ordered = faces_ordered
-
-        # send ordered normals to GPU
-        normal = np.zeros(len(faces_ordered), [('normal', np.float32, 3)])
-        if len(normals_ordered):
-            normal['normal'] = normals_ordered
-        else:
-            normal['normal'] = [(0,0,0) for x in faces_ordered]
-        BufferHelper.sendToGPU('normal', normal, gl.GL_DYNAMIC_DRAW)
-        BufferHelper.sendToShaders('normal')
+        Returns
+        -------
+        dict
+            buffer prefix, draw counts and the (memory-mapped) arrays of the level
+        """
+        # send welded positions and normals to GPU, interleaved in the configured formats
+        vertices = MeshHelper.interleave(arrays['vertices'], arrays['normals'])
+        BufferHelper.sendToGPU(prefix + 'vertices', vertices, gl.GL_STATIC_DRAW)
+
+        # only models with vertex colors get a color buffer (normalized bytes), the solid and
+        # wireframe colors are constant attributes
+        fill = [(prefix + 'vertices', 'position'), (prefix + 'vertices', 'normal')]
+        if 'colors' in arrays:
+            color = arrays['colors'].view([('color', np.uint8, 4)]).reshape(-1)
+            BufferHelper.sendToGPU(prefix + 'color', color, gl.GL_STATIC_DRAW)
+            fill.append((prefix + 'color', 'color'))
+            self.buffer_names.append(prefix + 'color')
+
+        # send element indices to GPU
+        for name in ['indices', 'wireframe_indices']:
+            BufferHelper.sendToGPU(prefix + name, arrays[name], gl.GL_STATIC_DRAW, gl.GL_ELEMENT_ARRAY_BUFFER)
+
+        # the normal lines and the single pass wireframe triangles are only sent when first drawn
+        # (see `sendNormalLines` and `sendOverlay`)
+        self.buffer_names.extend(prefix + name for name in ['vertices', 'indices', 'wireframe_indices',
+                                                            'normal_lines', 'overlay'])
+
+        # one layout per pass
+        BufferHelper.buildVertexArray(prefix + 'fill', fill, prefix + 'indices')
+        BufferHelper.buildVertexArray(prefix + 'wireframe', [(prefix + 'vertices', 'position')],
+                                      prefix + 'wireframe_indices')
+        self.vertex_array_names.extend(prefix + name for name in ['fill', 'wireframe', 'normal_lines', 'overlay'])
+
+        return {
+            'prefix': prefix,
+            'faces': len(arrays['indices']) // 3,
+            'indices_len': len(arrays['indices']),
+            'wireframe_indices_len': len(arrays['wireframe_indices']),
+            'arrays': arrays,
+        }
+
+    def sendOverlay(self, level):
+        """
+        Sends the unindexed triangles of the single pass wireframe of `level`
 
-        # send ordered vertices to GPU
-        vertices = np.zeros(len(faces_ordered), [('vertices', np.float32, 4)])
-        vertices['vertices'] = faces_ordered
-        BufferHelper.sendToGPU('vertices', vertices, gl.GL_DYNAMIC_DRAW)
-        BufferHelper.sendToShaders('vertices', 'position')
+        Returns
+        -------
+        int
+            number of vertices to draw as `GL_TRIANGLES`
+        """
+        prefix = level['prefix']
+        overlay = MeshHelper.overlayVertices(level['arrays'])
+        BufferHelper.sendToGPU(prefix + 'overlay', overlay, gl.GL_STATIC_DRAW)
+        BufferHelper.buildVertexArray(prefix + 'overlay', [(prefix + 'overlay', field) for field in overlay.dtype.names])
+        level['overlay_len'] = len(overlay)
+        return len(overlay)
+
+    def updateView(self, projection, view, model, height):
+        """
+        Picks the level of detail from the projected size of the bounding sphere
+
+        Parameters
+        ----------
+        projection, view, model : numpy.matrix
+            the matrices sent to the shaders (row-vector convention, see `Transform`)
+        height : int
+            viewport height in pixels
+
+        Notes
+        -----
+        The most detailed level with at most `Global.LOD_FACES_PER_PIXEL` faces per covered
+        pixel is drawn.
+        """
+        center = np.append(self.bounds[:3], 1.0)
+        eye = np.asarray(np.dot(np.dot(center, model), view)).reshape(-1)
+        scale = np.sqrt((np.asarray(model)[0, :3]**2).sum())
+        distance = max(-eye[2], Global.ZNEAR)
 
-        # send colors to GPU
-        color = np.zeros(len(faces_ordered), [('color', np.float32, 4)])
-        color['color'] = [Global.SOLID_COLOR for x in faces_ordered]
-        BufferHelper.sendToGPU('color', color, gl.GL_DYNAMIC_DRAW)
+        # projected radius in pixels: r * cot(fovy/2) / distance * height/2
+        radius = self.bounds[3] * scale * np.asarray(projection)[1, 1] / distance * height / 2
+        budget = Global.LOD_FACES_PER_PIXEL * np.pi * radius**2
 
-        # send wireframecolors to GPU
-        wireframecolor = np.zeros(len(faces_ordered), [('wireframeColor', np.float32, 4)])
-        wireframecolor['wireframeColor'] = [Global.WIREFRAME_COLOR for x in faces_ordered]
-        BufferHelper.sendToGPU('wireframeColor', wireframecolor, gl.GL_DYNAMIC_DRAW)
+        self.level = len(self.levels) - 1
+        for i, level in enumerate(self.levels):
+            if level['faces'] <= budget:
+                self.level = i
+                break
 
+    def setLayoutAttr(self, layout):
+        """
+        Return (current row nums, current max colspan)
+        """
+        layout.addWidget(QtGui.QLabel('ACMR: %.3f -> %.3f' % self.acmr), 1, 1)
+        layout.addWidget(QtGui.QLabel('LOD faces: ' + ' / '.join(str(level['faces']) for level in self.levels)), 2, 1)
+        return (2,1)
 
+    @classmethod
+    def preload(cls, paths, processes = Global.PRELOAD_PROCESSES):
+        """
+        Builds the arrays of every obj in `paths` in a process pool and keeps them in `preloaded`
+
+        Parameters
+        ----------
+        paths : list
+        processes : int
+            pool size, None for one per cpu
+
+        Returns
+        -------
+        dict
+            'models' loaded, 'seconds' taken, 'bytes' of arrays mapped and 'errors' (path => message)
+
+        Notes
+        -----
+        Workers write their results to the mesh cache and only send back the entry names; the
+        arrays are then memory-mapped here, so the pages are shared with the OS file cache
+        instead of being pickled. Arrays the workers could not store (cache not writable) are
+        sent back pickled, and entries evicted by the ones stored after them (cache smaller
+        than the models) are rebuilt here. Needs `Global.MESH_CACHE_ENABLED`. Call it before
+        creating any GL context or Qt application, the workers are forked.
+        """
+        stats = {'models': 0, 'seconds': 0.0, 'bytes': 0, 'errors': {}}
+        if not Global.MESH_CACHE_ENABLED or not paths:
+            return stats
+
+        start = timeit.default_timer()
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(_preloadModel, paths, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+        for path, name, arrays, error in results:
+            if error is not None:
+                stats['errors'][path] = error
+                continue
+            if name is not None:
+                arrays = MeshCache.load(name)
+            if arrays is None:
+                try:
+                    arrays = MeshCache.fetch(path, cls.buildArrays)
+                except Exception as e:
+                    stats['errors'][path] = str(e)
+                    continue
+            cls.preloaded[path] = arrays
+            stats['models'] += 1
+            stats['bytes'] += sum(array.nbytes for array in arrays.values())
+        stats['seconds'] = timeit.default_timer() - start
+        return stats
+
+    @staticmethod
+    def buildArrays(path, progress = None):
+        """
+        Parses the mesh file at `path` into the arrays sent to the GPU
+
+        Parameters
+        ----------
+        path : str
+        progress : callable
+            called with the fraction done so far, may raise `LoadCancelled`
+
+        Returns
+        -------
+        dict
+            welded vertex and index arrays (see `MeshHelper.indexFaces`), reordered for the
+            vertex cache (see `MeshHelper.optimizeVertexCache`), the bounding sphere in 'bounds'
+            and the same arrays prefixed with 'lod1_', 'lod2_'... for the simplified levels
+
+        Notes
+        -----
+        Models without normals (no obj `vn` records or ply `nx ny nz` properties, and every stl)
+        get generated smooth normals (see `MeshHelper.generateNormals`)
+        """
+        if progress is None:
+            progress = lambda fraction: None
+
+        # parsing is the first half of the work, preprocessing the rest
+        mesh = MeshHelper.loadMesh(path, progress=lambda fraction: progress(0.5 * fraction))
+        if mesh['face_normals'] is None:
+            MeshHelper.generateNormals(mesh)
+        progress(0.55)
+        arrays = MeshHelper.optimizeVertexCache(MeshHelper.indexFaces(mesh),
+                                                progress=lambda fraction: progress(0.55 + 0.2 * fraction))
+        arrays['bounds'] = MeshHelper.boundingSphere(arrays)
+        progress(0.75)
+
+        # simplified levels, skipping those which would not remove enough faces
+        faces = previous = len(arrays['indices']) // 3
+        level = 1
+        share = 0.25 / max(len(Global.LOD_LEVELS) - 1, 1)
+        for i, fraction in enumerate(Global.LOD_LEVELS[1:], 1):
+            start = 0.75 + share * (i - 1)
+            progress(start)
+            target = int(faces * fraction)
+            if target < Global.LOD_MIN_FACES or target > 0.75 * previous:
+                continue
+            lod = MeshHelper.decimate(arrays, target,
+                                      progress=lambda fraction, start=start: progress(start + share * fraction))
+            for name, array in lod.items():
+                arrays['lod%d_%s' % (level, name)] = array
+            previous = len(lod['indices']) // 3
+            level += 1
+        progress(1.0)
+        return arrays
         
     def draw(self):
         """
         Basic draw function, sending elements to shaders.
         """
+        level = self.levels[self.level]
+        prefix = level['prefix']
+        overlay = self.overlayWireframe()
 
-        if self.color_on:
+        if overlay:
+            FrameProfiler.begin('fill')
+            # fill and wireframe in one pass, no polygon offset needed
+            count = level.get('overlay_len')
+            if count is None:
+                count = self.sendOverlay(level)
+
+            BufferHelper.sendUniformToShaders('wireframe', [0], '1i')
+            BufferHelper.bindVertexArray(prefix + 'overlay')
+            BufferHelper.sendConstantToShaders('color', Global.SOLID_COLOR)
+            gl.glDrawArrays(gl.GL_TRIANGLES, 0, count)
+            FrameProfiler.end('fill')
+
+        elif self.color_on:
+            FrameProfiler.begin('fill')
             # make sure polygons draw under wireframe
             BufferHelper.sendUniformToShaders('wireframe', [0], '1i')
             gl.glPolygonOffset(2.5, 0);
             gl.glEnable(gl.GL_POLYGON_OFFSET_FILL);
             
-            BufferHelper.sendToShaders('color')
-            gl.glMultiDrawArrays(gl.GL_TRIANGLE_FAN, self.faces_v_start, self.faces_v_num, self.faces_len)
+            BufferHelper.bindVertexArray(prefix + 'fill')
+            BufferHelper.sendConstantToShaders('color', Global.SOLID_COLOR)
+            gl.glDrawElements(gl.GL_TRIANGLES, level['indices_len'], gl.GL_UNSIGNED_INT, ctypes.c_void_p(0))
             
             gl.glDisable(gl.GL_POLYGON_OFFSET_FILL);
+            FrameProfiler.end('fill')
 
-        if self.wireframe_on:
+        if self.wireframe_on and not overlay:
+            FrameProfiler.begin('wireframe')
             BufferHelper.sendUniformToShaders('wireframe', [1], '1i')
-            BufferHelper.sendToShaders('wireframeColor', 'color')
-            gl.glMultiDrawArrays(gl.GL_LINE_LOOP, self.faces_v_start, self.faces_v_num, self.faces_len)
+            BufferHelper.bindVertexArray(prefix + 'wireframe')
+            BufferHelper.sendConstantToShaders('color', Global.WIREFRAME_COLOR)
+            gl.glDrawElements(gl.GL_LINES, level['wireframe_indices_len'], gl.GL_UNSIGNED_INT, ctypes.c_void_p(0))
+            FrameProfiler.end('wireframe')
 
         if self.normals_on:
+            FrameProfiler.begin('normals')
+            count = self.normal_lines.get(prefix + 'normal_lines')
+            if count is None:
+                count = self.sendNormalLines(prefix + 'normal_lines', level['arrays']['vertices'],
+                                             level['arrays']['normals'])
+
             BufferHelper.sendUniformToShaders('wireframe', [1], '1i')
-            BufferHelper.sendToShaders('wireframeColor', 'color')
+            BufferHelper.bindVertexArray(prefix + 'normal_lines')
+            BufferHelper.sendConstantToShaders('color', Global.WIREFRAME_COLOR)
 
             BufferHelper.sendUniformToShaders('drawNormals', [1], '1i')
-            gl.glMultiDrawArrays(gl.GL_LINES, [0], [len(self.faces_ordered)], 1)
+            gl.glDrawArrays(gl.GL_LINES, 0, count)
             BufferHelper.sendUniformToShaders('drawNormals', [0], '1i')
+            FrameProfiler.end('normals')
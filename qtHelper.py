@@ -2,11 +2,63 @@
 
 import os
 
-from PyQt4.QtCore import Qt, QTimer
+from PyQt4.QtCore import Qt, QTimer, QThread, pyqtSignal
 from PyQt4 import QtGui
 from PyQt4.QtOpenGL import QGLWidget, QGLFormat
 
 from configs import Global
+from meshCache import MeshCache
+from meshHelper import MeshHelper, LoadCancelled
+
+
+class QTModelLoader(QThread):
+    """
+    Worker thread building the arrays of a model off the GUI thread
+
+    Notes
+    -----
+    Only the parsing and preprocessing happens here: the arrays are handed back through
+    `loaded` so the GL upload is done by the GL thread.
+    """
+
+    progress = pyqtSignal(int)
+    loaded = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+    def __init__(self, path, build, parent = None):
+        """
+        Parameters
+        ----------
+        path : str
+        build : callable
+            `build(path, progress)` returns a dict of array name => numpy.array
+        """
+        super(QTModelLoader, self).__init__(parent)
+        self.path = path
+        self.build = build
+        self.cancelled = False
+
+    def cancel(self):
+        """
+        Asks the worker to stop at its next progress report
+        """
+        self.cancelled = True
+
+    def reportProgress(self, fraction):
+        if self.cancelled:
+            raise LoadCancelled(self.path)
+        self.progress.emit(int(100 * fraction))
+
+    def run(self):
+        try:
+            arrays = MeshCache.fetch(self.path, lambda path: self.build(path, self.reportProgress))
+        except LoadCancelled:
+            return
+        except Exception as e:
+            self.failed.emit('%s: %s' % (self.path, e))
+            return
+        if not self.cancelled:
+            self.loaded.emit(arrays)
 
 
 class QTMorphWidget(QtGui.QWidget):
@@ -64,6 +116,10 @@ class QTMainWindow(QtGui.QWidget):
 
         # connect reset with everything
         self.sidebar.models_combo.activated[str].connect(self.resetUI)
+
+        # models load in the background, the sidebar follows once they are ready
+        self.GLWidget.modelChanged.connect(self.modelChanged)
+        self.GLWidget.loadProgress[int].connect(self.sidebar.setLoadProgress)
         
         self.setLayout(grid) 
         
@@ -97,8 +153,20 @@ class QTMainWindow(QtGui.QWidget):
             if Global.WIREFRAME_DEFAULT:
                 self.sidebar.wireframe_checkbox.setCheckState(Qt.Checked)
 
+        if self.sidebar.overlay_checkbox.checkState() == Qt.Checked:
+            if not Global.WIREFRAME_OVERLAY_DEFAULT:
+                self.sidebar.overlay_checkbox.setCheckState(Qt.Unchecked)
+        else:
+            if Global.WIREFRAME_OVERLAY_DEFAULT:
+                self.sidebar.overlay_checkbox.setCheckState(Qt.Checked)
+
         self.GLWidget.setModel(text)
 
+    def modelChanged(self):
+        # obj models are built with the Global defaults once loaded, the sidebar may have changed
+        # since `resetUI`
+        self.GLWidget.makeCurrent()
+        self.sidebar.applyState(self.GLWidget.render_obj)
         self.sidebar.replaceWidget(self.GLWidget.render_obj.getWidget())
 
 
@@ -116,6 +184,32 @@ class QTSideBar(QtGui.QWidget):
     def replaceWidget(self, newWidget):
         self.morphWidget.replaceWidget(newWidget)
 
+    def applyState(self, render_obj):
+        """
+        Sets the display toggles and shading of `render_obj` to what the sidebar shows
+        """
+        render_obj.color_on = self.color_checkbox.isChecked()
+        render_obj.wireframe_on = self.wireframe_checkbox.isChecked()
+        render_obj.wireframe_overlay = self.overlay_checkbox.isChecked()
+        render_obj.normals_on = self.normals_checkbox.isChecked()
+        for button, event in self.render_buttons:
+            event(button.isChecked())
+
+    def setLoadProgress(self, value):
+        """
+        Shows the model loading progress, hidden when `value` is negative
+
+        Parameters
+        ----------
+        value : int
+            percentage done, -1 when nothing is loading
+        """
+        if value < 0:
+            self.load_progress.hide()
+        else:
+            self.load_progress.setValue(value)
+            self.load_progress.show()
+
     def initUI(self):
 
         # Setup Grid
@@ -136,11 +230,18 @@ class QTSideBar(QtGui.QWidget):
 #        self.models_combo.addItem("UVKleinBottle")
         self.models_combo.addItem("UVTorus")
         for model in os.listdir(Global.MODELS_LOC):
-            self.models_combo.addItem(Global.MODELS_LOC + model)
+            if MeshHelper.isMeshFile(model):
+                self.models_combo.addItem(Global.MODELS_LOC + model)
+
+        # LOADING PROGRESS
+        self.load_progress = QtGui.QProgressBar()
+        self.load_progress.setRange(0, 100)
+        self.load_progress.hide()
 
         # WIREFRAME
         self.wireframe_checkbox = QtGui.QCheckBox()
         self.wireframe_label = QtGui.QLabel('Toggle Wireframe')
+        self.overlay_checkbox = QtGui.QCheckBox('Single Pass')
 
         # COLOR
         self.color_checkbox = QtGui.QCheckBox()
@@ -150,16 +251,26 @@ class QTSideBar(QtGui.QWidget):
         self.normals_checkbox = QtGui.QCheckBox()
         self.normals_label = QtGui.QLabel('Toggle Normals')
 
+        # CONTINUOUS RENDERING (for benchmarking, frames are otherwise only drawn on changes)
+        self.continuous_checkbox = QtGui.QCheckBox()
+        self.continuous_label = QtGui.QLabel('Continuous Rendering')
+
         if Global.COLOR_DEFAULT:
             self.color_checkbox.setCheckState(Qt.Checked)
         if Global.WIREFRAME_DEFAULT:
             self.wireframe_checkbox.setCheckState(Qt.Checked)
+        if Global.WIREFRAME_OVERLAY_DEFAULT:
+            self.overlay_checkbox.setCheckState(Qt.Checked)
         if Global.NORMALS_DEFAULT:
             self.normals_checkbox.setCheckState(Qt.Checked)
+        if Global.CONTINUOUS_RENDERING:
+            self.continuous_checkbox.setCheckState(Qt.Checked)
 
         self.color_checkbox.stateChanged[int].connect(self.glwidget.toggleColor)
         self.wireframe_checkbox.stateChanged[int].connect(self.glwidget.toggleWireframe)
+        self.overlay_checkbox.stateChanged[int].connect(self.glwidget.toggleWireframeOverlay)
         self.normals_checkbox.stateChanged[int].connect(self.glwidget.toggleNormals)
+        self.continuous_checkbox.toggled[bool].connect(self.glwidget.setContinuousRendering)
 
         # create group box for render types
         self.render_group = QtGui.QGroupBox()
@@ -176,6 +287,7 @@ class QTSideBar(QtGui.QWidget):
             vbox.addWidget(button)
             button.toggled[bool].connect(event)
         self.render_group.setLayout(vbox)
+        self.render_buttons = render_buttons
 
         # create morph widget for object specific qt attributes
         self.morphWidget = QTMorphWidget()
@@ -185,9 +297,11 @@ class QTSideBar(QtGui.QWidget):
         ##################
         grid.addWidget(self.models_label, 1, 1)
         grid.addWidget(self.models_combo, 1, 2, alignment=Qt.AlignCenter)
-        
+        grid.addWidget(self.load_progress, 0, 1, 1, 2)
+
         grid.addWidget(self.wireframe_label, 2, 1)
         grid.addWidget(self.wireframe_checkbox, 2, 2, alignment=Qt.AlignCenter)
+        grid.addWidget(self.overlay_checkbox, 2, 3)
 
         grid.addWidget(self.color_label, 3, 1)
         grid.addWidget(self.color_checkbox, 3, 2, alignment=Qt.AlignCenter)
@@ -195,9 +309,12 @@ class QTSideBar(QtGui.QWidget):
         grid.addWidget(self.normals_label, 4, 1)
         grid.addWidget(self.normals_checkbox, 4, 2, alignment=Qt.AlignCenter)
 
-        grid.addWidget(self.render_group, 5, 1, len(render_buttons), 2)
+        grid.addWidget(self.continuous_label, 5, 1)
+        grid.addWidget(self.continuous_checkbox, 5, 2, alignment=Qt.AlignCenter)
+
+        grid.addWidget(self.render_group, 6, 1, len(render_buttons), 2)
 
-        grid.addWidget(self.morphWidget, 5+len(render_buttons), 1, 7, 2)
+        grid.addWidget(self.morphWidget, 6+len(render_buttons), 1, 7, 2)
 
 
 
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+from __future__ import division
+import timeit
+
+from configs import Global
+
+class RenderScheduler(object):
+    """
+    Redraws the scene only when something changed, at most once per display refresh
+
+    Notes
+    -----
+    The display installs a `post(delay)` callable scheduling one redraw `delay` milliseconds
+    from now (a GLUT timer or a Qt single shot). Anything changing what is on screen calls
+    `requestRedraw`: camera and UI handlers, `ShaderHelper` when a uniform value changes and
+    `BufferHelper` when a buffer is sent. Requests made while a frame is drawn are ignored, the
+    passes of `draw` change uniforms back and forth every frame.
+
+    With vsync on (`Global.SWAP_INTERVAL`) the buffer swap already waits for the display, so
+    redraws are posted right away; without it they are spaced `1 / Global.DISPLAY_REFRESH_RATE`
+    apart. In continuous mode (`Global.CONTINUOUS_RENDERING`, for benchmarking) every frame
+    posts the next one with no delay.
+    """
+
+    post = None
+    vsync = False
+    continuous = Global.CONTINUOUS_RENDERING
+
+    dirty = True
+    pending = False
+    painting = False
+    last_frame = None
+
+    # frames drawn and redraw requests, to check that an idle scene stays idle
+    frames = 0
+    requests = 0
+
+    @classmethod
+    def install(cls, post, vsync = False):
+        """
+        Parameters
+        ----------
+        post : callable
+            `post(delay)` schedules a single redraw in `delay` milliseconds
+        vsync : bool
+            whether the buffer swap waits for the vertical blank
+        """
+        cls.post = post
+        cls.vsync = vsync
+        cls.pending = False
+        cls.requestRedraw()
+
+    @classmethod
+    def frameInterval(cls):
+        """
+        Seconds to leave between two frames
+        """
+        if cls.continuous or cls.vsync:
+            return 0.0
+        return 1.0 / Global.DISPLAY_REFRESH_RATE
+
+    @classmethod
+    def requestRedraw(cls):
+        """
+        Marks the scene as changed and schedules a redraw unless one is already coming
+        """
+        if cls.painting:
+            return
+        cls.requests += 1
+        cls.dirty = True
+        if cls.pending or cls.post is None:
+            return
+
+        delay = 0.0
+        if cls.last_frame is not None:
+            delay = max(0.0, cls.last_frame + cls.frameInterval() - timeit.default_timer())
+        cls.pending = True
+        cls.post(int(round(1000 * delay)))
+
+    @classmethod
+    def setContinuous(cls, bool):
+        cls.continuous = bool
+        cls.requestRedraw()
+
+    @classmethod
+    def beginFrame(cls):
+        cls.pending = False
+        cls.dirty = False
+        cls.painting = True
+
+    @classmethod
+    def endFrame(cls):
+        cls.painting = False
+        cls.last_frame = timeit.default_timer()
+        cls.frames += 1
+        if cls.continuous:
+            cls.requestRedraw()
@@ -9,6 +9,7 @@ import OpenGL.GLUT as glut
 import numpy as np
 from OpenGL.arrays import vbo
 from configs import Global
+from renderScheduler import RenderScheduler
 
 # use and edit configs.Global class for configs
 class ShaderHelper(object):
@@ -22,6 +23,50 @@ class ShaderHelper(object):
         # (vertex_loc, fragment_loc) => program
     }
 
+    attributes = {
+        # program => {attribute name => location}
+    }
+
+    uniforms = {
+        # program => {uniform name => location}
+    }
+
+    # location lookups asked for, and how many of them went to GL
+    location_lookups = 0
+    location_queries = 0
+
+    uniform_values = {
+        # program => {uniform name => value last sent to it}
+    }
+
+    desired_uniforms = {
+        # uniform name => (data, function_type) last asked for, re-applied on program switch
+    }
+
+    uniform_functions = {
+        '1f': gl.glUniform1f,
+        '2f': gl.glUniform2f,
+        '3f': gl.glUniform3f,
+        '4f': gl.glUniform4f,
+        '1i': gl.glUniform1i,
+        '2i': gl.glUniform2i,
+        '3i': gl.glUniform3i,
+        '4i': gl.glUniform4i,
+        'm3': gl.glUniformMatrix3fv,
+        'm4': gl.glUniformMatrix4fv,
+    }
+
+    # glUniform* calls (and scene block updates) made, and redundant ones skipped
+    uniform_calls = 0
+    uniform_skips = 0
+
+    # `Scene` uniform block shared by all programs (see shaders/scene.glsl), float offsets
+    # of its members in std140 layout; None until checked for support
+    scene_block = None
+    scene_buffer = None
+    scene = None
+    scene_offsets = {'projection': 0, 'view': 16, 'model': 32, 'lights': 48}
+    SCENE_BINDING = 0
 
     program = None
 
@@ -37,8 +82,10 @@ class ShaderHelper(object):
         if (vertex_loc, fragment_loc) in cls.programs:
 
             program = cls.programs[(vertex_loc, fragment_loc)]
-            gl.glUseProgram(program)
-            cls.program = program
+            if program != cls.program:
+                gl.glUseProgram(program)
+                cls.program = program
+                cls.applyUniforms(program)
             return
 
         # create program for GPU
@@ -49,7 +96,7 @@ class ShaderHelper(object):
             vertex = cls.shaders[vertex_loc]
         else:
             vertex   = gl.glCreateShader(gl.GL_VERTEX_SHADER)
-            v_shader_code = open(vertex_loc).read()
+            v_shader_code = cls.shaderSource(vertex_loc)
             gl.glShaderSource(vertex, v_shader_code)
             gl.glCompileShader(vertex)
             cls.shaders[vertex_loc] = vertex
@@ -60,13 +107,17 @@ class ShaderHelper(object):
             fragment = cls.shaders[fragment_loc]
         else:
             fragment = gl.glCreateShader(gl.GL_FRAGMENT_SHADER)            
-            f_shader_code = open(fragment_loc).read()
+            f_shader_code = cls.shaderSource(fragment_loc)
             gl.glShaderSource(fragment, f_shader_code)
             gl.glCompileShader(fragment)
             cls.shaders[fragment_loc] = fragment
             
         gl.glAttachShader(program, fragment)
 
+        # position at attribute 0, which cannot take a constant value (i.e. colors) on
+        # compatibility contexts
+        gl.glBindAttribLocation(program, 0, 'position')
+
         # build and clean up
         gl.glLinkProgram(program)
 
@@ -75,4 +126,199 @@ class ShaderHelper(object):
 
         cls.program = program
         cls.programs[(vertex_loc, fragment_loc)] = program
+        cls.introspect(program)
+
+        if cls.sceneBlockEnabled():
+            block = gl.glGetUniformBlockIndex(program, 'Scene')
+            if block != gl.GL_INVALID_INDEX:
+                gl.glUniformBlockBinding(program, block, cls.SCENE_BINDING)
+        cls.applyUniforms(program)
+
+    @classmethod
+    def sceneBlockEnabled(cls):
+        """
+        Whether camera matrices and lights go through the shared `Scene` uniform block
+
+        Notes
+        -----
+        Needs `Global.SCENE_UNIFORM_BLOCK` and GL_ARB_uniform_buffer_object (checked once, with
+        the GL context current); the block buffer is created on the first call.
+        """
+        if cls.scene_block is None:
+            cls.scene_block = False
+            if Global.SCENE_UNIFORM_BLOCK:
+                try:
+                    from OpenGL.GL.ARB.uniform_buffer_object import glInitUniformBufferObjectARB
+                    cls.scene_block = bool(glInitUniformBufferObjectARB())
+                except ImportError:
+                    pass
+
+            if cls.scene_block:
+                cls.scene = np.zeros(cls.scene_offsets['lights'] + 16 * cls.maxLights(), dtype=np.float32)
+                cls.scene_buffer = gl.glGenBuffers(1)
+                gl.glBindBuffer(gl.GL_UNIFORM_BUFFER, cls.scene_buffer)
+                gl.glBufferData(gl.GL_UNIFORM_BUFFER, cls.scene.nbytes, cls.scene, gl.GL_DYNAMIC_DRAW)
+                gl.glBindBufferBase(gl.GL_UNIFORM_BUFFER, cls.SCENE_BINDING, cls.scene_buffer)
+        return cls.scene_block
+
+    @staticmethod
+    def maxLights():
+        return max(len(Global.LIGHTS), 1)
+
+    @classmethod
+    def shaderSource(cls, shader_loc):
+        """
+        Reads the shader at `shader_loc`, prepended with `Global.SCENE_SHADER_LOC`
+        """
+        header = ''
+        if cls.sceneBlockEnabled():
+            header = ('#extension GL_ARB_uniform_buffer_object : require\n'
+                      '#define USE_SCENE_BLOCK\n'
+                      '#define MAX_LIGHTS %d\n' % cls.maxLights())
+        return header + open(Global.SCENE_SHADER_LOC).read() + open(shader_loc).read()
+
+    @staticmethod
+    def _activeName(name):
+        if isinstance(name, bytes):
+            name = name.decode('ascii')
+        return name.rstrip('\0')
+
+    @classmethod
+    def introspect(cls, program):
+        """
+        Saves the locations of every active attribute and uniform of the linked `program`
+
+        Notes
+        -----
+        Uniform arrays are saved both by their base name (i.e. `lights`) and per element
+        (`lights[0]`, `lights[1]`...), the same names `glGetUniformLocation` accepts.
+        """
+        attributes = {}
+        for index in range(gl.glGetProgramiv(program, gl.GL_ACTIVE_ATTRIBUTES)):
+            name, size, kind = gl.glGetActiveAttrib(program, index)
+            name = cls._activeName(name)
+            attributes[name] = gl.glGetAttribLocation(program, name)
+            cls.location_queries += 1
 
+        uniforms = {}
+        for index in range(gl.glGetProgramiv(program, gl.GL_ACTIVE_UNIFORMS)):
+            name, size, kind = gl.glGetActiveUniform(program, index)
+            name = cls._activeName(name)
+            if name.endswith('[0]'):
+                base = name[:-3]
+                for element in range(size):
+                    element_name = '%s[%d]' % (base, element)
+                    uniforms[element_name] = gl.glGetUniformLocation(program, element_name)
+                    cls.location_queries += 1
+                uniforms[base] = uniforms[name]
+            else:
+                uniforms[name] = gl.glGetUniformLocation(program, name)
+                cls.location_queries += 1
+
+        cls.attributes[program] = attributes
+        cls.uniforms[program] = uniforms
+
+    @classmethod
+    def getAttribLocation(cls, name, program = None):
+        """
+        Location of attribute `name` in `program` (the current program by default), -1 if the
+        attribute is not active
+        """
+        if program is None:
+            program = cls.getProgram()
+        cls.location_lookups += 1
+        return cls.attributes[program].get(name, -1)
+
+    @classmethod
+    def getUniformLocation(cls, name, program = None):
+        """
+        Location of uniform `name` in `program` (the current program by default), -1 if the
+        uniform is not active
+        """
+        if program is None:
+            program = cls.getProgram()
+        cls.location_lookups += 1
+        return cls.uniforms[program].get(name, -1)
+
+    @classmethod
+    def sendScene(cls, name, data):
+        """
+        Updates member `name` of the shared `Scene` uniform block (only what changed is uploaded)
+
+        Parameters
+        ----------
+        name : str
+            'projection', 'view', 'model' or 'lights'
+        data : numpy.array or list
+            a 4x4 matrix, or `Global.LIGHTS` like (ambient, diffuse, specular, position) tuples
+
+        Returns
+        -------
+        bool
+            False if the block is not in use (the caller has to fall back to plain uniforms)
+        """
+        if not cls.sceneBlockEnabled():
+            return False
+
+        values = np.asarray(data, dtype=np.float32).reshape(-1)
+        start = cls.scene_offsets[name]
+        if np.array_equal(cls.scene[start:start + len(values)], values):
+            cls.uniform_skips += 1
+            return True
+
+        cls.scene[start:start + len(values)] = values
+        gl.glBindBuffer(gl.GL_UNIFORM_BUFFER, cls.scene_buffer)
+        gl.glBufferSubData(gl.GL_UNIFORM_BUFFER, 4 * start, values.nbytes, values)
+        cls.uniform_calls += 1
+        RenderScheduler.requestRedraw()
+        return True
+
+    @classmethod
+    def sendUniform(cls, name, data, function_type):
+        """
+        Sets uniform `name` of the current program, skipping the GL call if it already has `data`
+
+        Parameters
+        ----------
+        name : str
+        data : int or list or numpy.array
+        function_type : str
+            see `uniform_functions`
+
+        Notes
+        -----
+        The value is also remembered for the other programs: they get it when they are next
+        used (see `applyUniforms`). Scene block members are routed to `sendScene`.
+        """
+        if name in cls.scene_offsets and cls.sendScene(name, data):
+            return
+        cls.desired_uniforms[name] = (data, function_type)
+        cls._setUniform(cls.getProgram(), name, data, function_type)
+
+    @classmethod
+    def applyUniforms(cls, program):
+        """
+        Brings the uniforms of `program` (the current one) up to date with `desired_uniforms`
+        """
+        for name, (data, function_type) in cls.desired_uniforms.items():
+            cls._setUniform(program, name, data, function_type)
+
+    @classmethod
+    def _setUniform(cls, program, name, data, function_type):
+        loc = cls.getUniformLocation(name, program)
+        if loc < 0:
+            return
+
+        value = np.asarray(data, dtype=np.float64).tobytes()
+        values = cls.uniform_values.setdefault(program, {})
+        if values.get(name) == value:
+            cls.uniform_skips += 1
+            return
+        values[name] = value
+        cls.uniform_calls += 1
+        RenderScheduler.requestRedraw()
+
+        if function_type[0] == 'm':
+            cls.uniform_functions[function_type](loc, 1, gl.GL_FALSE, data)
+        else:
+            cls.uniform_functions[function_type](loc, *data)
@@ -1,16 +1,14 @@
-uniform mat4 projection;
-uniform mat4 view;
-uniform mat4 model;
-
 uniform int drawNormals;
 
 attribute vec4 color;
 attribute vec4 position;
 attribute vec3 normal;
+attribute vec4 edge;
 
 varying vec4 f_color;
 varying vec3 f_normal;
 varying vec4 f_pos;
+varying vec4 f_edges;
 
 void main()
 {
@@ -30,4 +28,7 @@ void main()
 
     // send pos to frag
     f_pos = gl_Position;
+
+    // distances to the face edges, for the single pass wireframe
+    f_edges = edge;
 }
\ No newline at end of file
@@ -1,17 +1,16 @@
-uniform mat4 projection;
-uniform mat4 view;
-uniform mat4 model;
-
 uniform int normalsShading;
 uniform int zbufferShading;
 uniform int activeLights;
 uniform int wireframe;
+uniform int wireframeOverlay;
+uniform vec4 wireframeColor;
 
 uniform vec3 eye;
 
 varying vec4 f_color;
 varying vec3 f_normal;
 varying vec4 f_pos;
+varying vec4 f_edges;
 
 void main()
 {
@@ -25,16 +24,16 @@ void main()
 	for(int i=0; i<activeLights; i++){
 
             // always add ambient (cheat GI)
-	    total_color += gl_LightSource[i].ambient;
+	    total_color += LIGHT(i).ambient;
 
 	    // place light in world transformation
-	    vec4 light_pos = projection * view * gl_LightSource[i].position;
+	    vec4 light_pos = projection * view * LIGHT(i).position;
 
 	    // diffuse
 	    vec3 l_hat = normalize(vec3(light_pos - f_pos));
 	    float ndotl = dot(normalize(f_normal), l_hat);	    
 	    if(ndotl > 0.0){
-	        total_color += (gl_LightSource[i].diffuse) * ndotl;
+	        total_color += (LIGHT(i).diffuse) * ndotl;
 	    }
 
 	    // specular
@@ -49,7 +48,14 @@ void main()
     } else {
         gl_FragColor = f_color;
     }
-    
+
+    // single pass wireframe: edges are where a component of f_edges is an integer, about a
+    // pixel wide whatever the distance
+    if (wireframe == 0 && wireframeOverlay == 1){
+        vec4 pixels = abs(fract(f_edges + 0.5) - 0.5) / max(fwidth(f_edges), vec4(1e-6));
+        float nearest = min(min(pixels.x, pixels.y), min(pixels.z, pixels.w));
+        gl_FragColor = mix(wireframeColor, gl_FragColor, smoothstep(0.5, 1.5, nearest));
+    }
 }
 
 /* LIGHTING REFERENCE
@@ -1,12 +1,11 @@
-uniform mat4 projection;
-uniform mat4 view;
-uniform mat4 model;
-
 attribute vec4 color;
 attribute vec4 position;
 
+uniform vec2 uvGrid;
+
 varying vec4 v_color;
 varying vec3 f_normal;
+varying vec4 f_edges;
 
 void main()
 {
@@ -26,4 +25,7 @@ void main()
 
     v_color = color;
     f_normal = vec3(0,0,0);
+
+    // grid lines are where (u, v) * uvGrid is an integer
+    f_edges = vec4(position.xy * uvGrid, 0.5, 0.5);
 }
\ No newline at end of file
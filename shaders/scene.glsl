@@ -0,0 +1,33 @@
+// Prepended to every shader by ShaderHelper.
+// Camera matrices and lights come from the shared `Scene` uniform block when
+// GL_ARB_uniform_buffer_object is available (USE_SCENE_BLOCK defined), otherwise
+// from plain uniforms and the fixed-function gl_LightSource state.
+
+#ifdef USE_SCENE_BLOCK
+
+struct Light {
+    vec4 ambient;
+    vec4 diffuse;
+    vec4 specular;
+    vec4 position;
+};
+
+layout(std140) uniform Scene {
+    mat4 projection;
+    mat4 view;
+    mat4 model;
+    Light lights[MAX_LIGHTS];
+};
+
+#define LIGHT(i) lights[i]
+
+#else
+
+uniform mat4 projection;
+uniform mat4 view;
+uniform mat4 model;
+
+#define LIGHT(i) gl_LightSource[i]
+
+#endif
+
@@ -1,15 +1,14 @@
-uniform mat4 projection;
-uniform mat4 view;
-uniform mat4 model;
-
 uniform int drawNormals;
 
 attribute vec4 color;
 attribute vec4 position;
 
+uniform vec2 uvGrid;
+
 varying vec4 f_color;
 varying vec3 f_normal;
 varying vec4 f_pos;
+varying vec4 f_edges;
 
 
 void main()
@@ -48,4 +47,7 @@ void main()
 
     // send pos to frag
     f_pos = gl_Position;
+
+    // grid lines are where (u, v) * uvGrid is an integer
+    f_edges = vec4(position.xy * uvGrid, 0.5, 0.5);
 }
\ No newline at end of file